@@ -0,0 +1,1051 @@
+import os
+import argparse
+import time
+import itertools as ittl
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+
+
+def parse_args():
+    arg_parser = argparse.ArgumentParser(description="To compare array kernels with the original implementations")
+    arg_parser.add_argument("--n", type=int, default=3000, help="length of synthetic series")
+    arg_parser.add_argument("--seed", type=int, default=0, help="random seed for synthetic data")
+    arg_parser_subs = arg_parser.add_subparsers(
+        title="Position argument to call sub functions",
+        dest="switch",
+        description="use this position argument to call different benchmarks. "
+                    "For example: 'python benchmark.py --n 3000 rolling_top_corr'",
+        required=True,
+    )
+
+    # switch: rolling_top_corr
+    arg_parser_subs.add_parser(name="rolling_top_corr", help="rolling top-k Spearman correlation for CXY")
+
+    # switch: rolling_top_bottom_mean
+    arg_parser_subs.add_parser(name="rolling_top_bottom_mean", help="rolling top/bottom mean for AMP")
+
+    # switch: rolling_beta
+    arg_parser_subs.add_parser(name="rolling_beta", help="rolling beta, residual and residual std for BETA")
+
+    # switch: roll_return
+    arg_parser_subs.add_parser(name="roll_return", help="annualized roll return for TS")
+
+    # switch: intraday
+    arg_parser_subs.add_parser(name="intraday", help="minute bar kernels for EXR, SMT and RWTC")
+
+    # switch: neutralize
+    arg_parser_subs.add_parser(
+        name="neutralize",
+        help="cross-sectional neutralization for all factor classes in config.yaml, n is the number of days",
+    )
+
+    # switch: panel
+    arg_parser_subs.add_parser(
+        name="panel",
+        help="reading a neutralized factor table from sqlite and from its panel, n is the number of days",
+    )
+
+    # switch: storage
+    arg_parser_subs.add_parser(
+        name="storage",
+        help="reading a neutralized factor table from sqlite and from parquet, n is the number of days",
+    )
+
+    # switch: member_position
+    arg_parser_subs.add_parser(
+        name="member_position",
+        help="top broker positions for NOI, NDOI, WNOI and WNDOI, n is the number of days",
+    )
+
+    # switch: ta
+    arg_parser_subs.add_parser(
+        name="ta",
+        help="TA indicators of 60 instruments one by one and from a panel, n is the number of days",
+    )
+
+    # switch: market
+    arg_parser_subs.add_parser(
+        name="market",
+        help="sqrt(amount) weighted returns of market and sectors, n is the number of days",
+    )
+
+    # switch: rolling_moments
+    arg_parser_subs.add_parser(
+        name="rolling_moments",
+        help="rolling sum, mean and skewness for MTM, SKEW and BASIS of 60 instruments, n is the number of days",
+    )
+
+    # switch: signals
+    arg_parser_subs.add_parser(
+        name="signals",
+        help="signals of 4 factors x 2 moving average windows from neutralized factors, n is the number of days",
+    )
+
+    # switch: simulations
+    arg_parser_subs.add_parser(
+        name="simulations",
+        help="raw return, delta weight and cost of 100 signals sim by sim and in a batch, n is the number of days",
+    )
+
+    # switch: calendar
+    arg_parser_subs.add_parser(
+        name="calendar",
+        help="shifting n dates by calendar.get_next_date one by one and by the calendar index",
+    )
+
+    # switch: evaluations
+    arg_parser_subs.add_parser(
+        name="evaluations",
+        help="NAV indicators of the facNeu grid in config.yaml sim by sim with CNAV and in a batch, "
+             "n is the number of days",
+    )
+
+    return arg_parser.parse_args()
+
+
+def report(name: str, t_ref: float, t_new: float, max_abs_diff: float):
+    print(f"[{name}] ref = {t_ref:.4f}s, new = {t_new:.4f}s, "
+          f"speedup = {t_ref / max(t_new, 1e-9):.1f}x, max abs diff = {max_abs_diff:.3e}")
+
+
+def max_abs_diff(a: np.ndarray, b: np.ndarray) -> float:
+    a, b = np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64)
+    if not np.array_equal(np.isnan(a), np.isnan(b)):
+        return np.inf
+    d = np.abs(a - b)
+    return float(np.nanmax(d)) if np.any(~np.isnan(d)) else 0.0
+
+
+# ---------------------------------
+# ------ rolling top corr ---------
+# ---------------------------------
+
+def bench_rolling_top_corr(n: int, rng: np.random.Generator):
+    from solutions.factorAlg import cal_top_corr
+    from solutions.factorKernels import cal_rolling_top_corr_batch
+
+    wins, tops = [60, 120, 240], [0.1, 0.2, 0.5]
+    data = pd.DataFrame({
+        "x": rng.normal(size=n),
+        "y": rng.normal(size=n),
+        "vol": rng.integers(1000, 5000, size=n).astype(np.float64),  # integers to generate ties
+    })
+    data.loc[rng.choice(n, size=n // 50, replace=False), "x"] = np.nan
+    bgn_pos, stp_pos = max(wins), n
+
+    t0 = time.perf_counter()
+    ref = {}
+    for win, top in ittl.product(wins, tops):
+        top_size, r = int(win * top) + 1, np.full(n, np.nan)
+        for i in range(bgn_pos, stp_pos):
+            r[i] = cal_top_corr(data.iloc[i - win + 1: i + 1], x="x", y="y", sort_var="vol", top_size=top_size)
+        ref[(win, top)] = r
+    t_ref = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    new = cal_rolling_top_corr_batch(
+        x=data["x"].to_numpy(), y=data["y"].to_numpy(), sort_var=data["vol"].to_numpy(),
+        wins=wins, tops=tops, bgn_pos=bgn_pos, stp_pos=stp_pos,
+    )
+    t_new = time.perf_counter() - t0
+    diff = max(max_abs_diff(ref[k], new[k]) for k in ref)
+    report("rolling_top_corr", t_ref, t_new, diff)
+    return 0
+
+
+# ---------------------------------
+# --- rolling top bottom mean -----
+# ---------------------------------
+
+def bench_rolling_top_bottom_mean(n: int, rng: np.random.Generator):
+    from solutions.factorAlg import CFactorAMP
+    from solutions.factorKernels import cal_rolling_top_bottom_mean_batch
+
+    wins, lbds = [60, 120, 240], [0.2, 0.4, 0.6, 0.8]
+    data = pd.DataFrame({
+        "amp": rng.uniform(0, 0.05, size=n),
+        "spot": np.round(100 * np.exp(np.cumsum(rng.normal(0, 0.01, size=n))), 0),  # rounded to generate ties
+    })
+    data.loc[rng.choice(n, size=n // 50, replace=False), "amp"] = np.nan
+    bgn_pos, stp_pos = max(wins), n
+
+    t0 = time.perf_counter()
+    ref = {}
+    for win, lbd in ittl.product(wins, lbds):
+        top_size, h, l = int(win * lbd) + 1, np.full(n, np.nan), np.full(n, np.nan)
+        for i in range(bgn_pos, stp_pos):
+            h[i], l[i], _ = CFactorAMP.cal_amp(data.iloc[i - win + 1: i + 1], x="amp", sort_var="spot", top_size=top_size)
+        ref[(win, lbd)] = (h, l)
+    t_ref = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    new = cal_rolling_top_bottom_mean_batch(
+        x=data["amp"].to_numpy(), sort_var=data["spot"].to_numpy(),
+        wins=wins, lbds=lbds, bgn_pos=bgn_pos, stp_pos=stp_pos,
+    )
+    t_new = time.perf_counter() - t0
+    diff = max(max(max_abs_diff(ref[k][0], new[k][0]), max_abs_diff(ref[k][1], new[k][1])) for k in ref)
+    report("rolling_top_bottom_mean", t_ref, t_new, diff)
+    return 0
+
+
+# ---------------------------------
+# ------ rolling beta -------------
+# ---------------------------------
+
+def bench_rolling_beta(n: int, rng: np.random.Generator):
+    from solutions.factorKernels import cal_rolling_beta_batch
+
+    def cal_rolling_beta_ref(df: pd.DataFrame, x: str, y: str, rolling_window: int) -> pd.Series:
+        df["xy"] = (df[x] * df[y]).rolling(window=rolling_window).mean()
+        df["xx"] = (df[x] * df[x]).rolling(window=rolling_window).mean()
+        df["x"] = df[x].rolling(window=rolling_window).mean()
+        df["y"] = df[y].rolling(window=rolling_window).mean()
+        df["cov_xy"] = df["xy"] - df["x"] * df["y"]
+        df["cov_xx"] = df["xx"] - df["x"] * df["x"]
+        s = df["cov_xy"] / df["cov_xx"]
+        return s
+
+    wins = [10, 20, 60, 120, 240]
+    data = pd.DataFrame({"mkt": rng.normal(0, 0.01, size=n)})
+    data["ret"] = 0.8 * data["mkt"] + rng.normal(0, 0.01, size=n)
+    data.loc[rng.choice(n, size=n // 100, replace=False), "mkt"] = np.nan
+
+    t0 = time.perf_counter()
+    ref, df = {}, data.copy()
+    for win in wins:
+        beta = cal_rolling_beta_ref(df, x="mkt", y="ret", rolling_window=win)
+        res = df["ret"] - df["mkt"] * beta
+        res_std = res.rolling(window=win, min_periods=int(win * 0.6)).std()
+        ref[win] = (beta.to_numpy(), res.to_numpy(), res_std.to_numpy())
+    t_ref = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    new = cal_rolling_beta_batch(x=data["mkt"].to_numpy(), y=data["ret"].to_numpy(), wins=wins)
+    t_new = time.perf_counter() - t0
+    diff = max(max_abs_diff(u, v) for k in ref for u, v in zip(ref[k], new[k]))
+    report("rolling_beta", t_ref, t_new, diff)
+    return 0
+
+
+# ---------------------------------
+# ------ roll return --------------
+# ---------------------------------
+
+def bench_roll_return(n: int, rng: np.random.Generator):
+    from solutions.factorTermStructure import cal_roll_return
+
+    def cal_roll_return_ref(x: pd.Series, ticker_n: str, ticker_d: str, prc_n: str, prc_d: str):
+        if x[ticker_n] == "" or x[ticker_d] == "":
+            return np.nan
+        if x[prc_d] > 0:
+            cntrct_d, cntrct_n = x[ticker_d].split(".")[0], x[ticker_n].split(".")[0]
+            month_d, month_n = int(cntrct_d[-2:]), int(cntrct_n[-2:])
+            dlt_month = month_d - month_n
+            dlt_month = dlt_month + (12 if dlt_month <= 0 else 0)
+            return (x[prc_n] / x[prc_d] - 1) / dlt_month * 12 * 100
+        else:
+            return np.nan
+
+    data = pd.DataFrame({
+        "ticker_major": rng.choice(["cu2401.SHF", "cu2405.SHF", "MA409.ZCE", ""], size=n),
+        "ticker_minor": rng.choice(["cu2402.SHF", "cu2412.SHF", "MA501.ZCE", ""], size=n),
+        "close_major": rng.uniform(90, 110, size=n),
+        "close_minor": rng.uniform(-10, 110, size=n),
+    })
+
+    t0 = time.perf_counter()
+    ref = data.apply(
+        cal_roll_return_ref, args=("ticker_major", "ticker_minor", "close_major", "close_minor"), axis=1,
+    )
+    t_ref = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    new = cal_roll_return(
+        ticker_n=data["ticker_major"], ticker_d=data["ticker_minor"],
+        prc_n=data["close_major"], prc_d=data["close_minor"],
+    )
+    t_new = time.perf_counter() - t0
+    report("roll_return", t_ref, t_new, max_abs_diff(ref.to_numpy(), new))
+    return 0
+
+
+# ---------------------------------
+# ------ intraday -----------------
+# ---------------------------------
+
+def find_extreme_return_ref(tday_minb_data: pd.DataFrame, ret: str, dfts: list[int]) -> pd.Series:
+    ret_min, ret_max, ret_median = (
+        tday_minb_data[ret].min(),
+        tday_minb_data[ret].max(),
+        tday_minb_data[ret].median(),
+    )
+    if (ret_max + ret_min) > (2 * ret_median):
+        idx_exr, exr = tday_minb_data[ret].argmax(), -ret_max
+    else:
+        idx_exr, exr = tday_minb_data[ret].argmin(), -ret_min
+    res = {"EXR_RAW": exr}
+    for d in dfts:
+        idx_dxr = idx_exr - d
+        dxr = -tday_minb_data[ret].iloc[idx_dxr] if idx_dxr >= 0 else exr
+        res[f"DXR{d:02d}_RAW"] = dxr
+    return pd.Series(res)
+
+
+def cal_smt_ref(sorted_sub_data: pd.DataFrame, lbd: float, prc: str, ret: str) -> tuple[float, float]:
+    if (tot_amt_sum := sorted_sub_data["amount"].sum()) > 0:
+        tot_w = sorted_sub_data["amount"] / tot_amt_sum
+        tot_prc = sorted_sub_data[prc] @ tot_w
+        tot_ret = sorted_sub_data[ret] @ tot_w
+    else:
+        return np.nan, np.nan
+    volume_threshold = sorted_sub_data["vol"].sum() * lbd
+    n = sum(sorted_sub_data["vol"].cumsum() < volume_threshold) + 1
+    smt_df = sorted_sub_data.head(n)
+    if (smt_amt_sum := smt_df["amount"].sum()) > 0:
+        smt_w = smt_df["amount"] / smt_amt_sum
+        smt_prc = smt_df[prc] @ smt_w
+        smt_ret = smt_df[ret] @ smt_w
+        smt_p = ((smt_prc / tot_prc - 1) * 1e4) if tot_prc > 0 else 0
+        smt_r = (smt_ret - tot_ret) * 1e4 if not np.isinf(tot_ret) else 0
+        return smt_p, smt_r
+    else:
+        return np.nan, np.nan
+
+
+def cal_range_weighted_time_center_ref(tday_minb_data: pd.DataFrame, ret: str) -> pd.Series:
+    index_reset_df = tday_minb_data.reset_index()
+    pos_grp = index_reset_df.loc[index_reset_df[ret] > 0, ret]
+    neg_grp = index_reset_df.loc[index_reset_df[ret] < 0, ret]
+    pos_wgt = pos_grp.abs() / pos_grp.abs().sum()
+    neg_wgt = neg_grp.abs() / neg_grp.abs().sum()
+    rwtc_u = pos_grp.index @ pos_wgt / len(tday_minb_data)
+    rwtc_d = neg_grp.index @ neg_wgt / len(tday_minb_data)
+    rwtc_t = rwtc_u - rwtc_d
+    return pd.Series({"RWTCU": rwtc_u, "RWTCD": rwtc_d, "RWTCT": rwtc_t, "RWTCV": np.abs(rwtc_t)})
+
+
+def bench_intraday(n: int, rng: np.random.Generator):
+    from solutions.factorIntraday import (
+        split_segments, cal_extreme_return, cal_smart_idx, cal_smart_money, cal_range_weighted_time_center,
+    )
+
+    bars_per_day, dfts, lbds = 225, [1, 2, 3], [0.2, 0.4, 0.6]
+    m = n * bars_per_day
+    data = pd.DataFrame({
+        "trade_date": np.repeat([f"{20120101 + _:08d}" for _ in range(n)], bars_per_day),
+        "pre_close": rng.uniform(99, 101, size=m).round(1),
+        "vol": rng.integers(0, 50, size=m).astype(np.float64),
+    })
+    data["close"] = (data["pre_close"] * (1 + rng.normal(0, 0.002, size=m))).round(1)
+    data["amount"] = data["vol"] * data["close"] * 10
+    data["freq_ret"] = (data["close"] / data["pre_close"] - 1).fillna(0)
+    data["vwap"] = (data["amount"] / data["vol"]).ffill()
+
+    # reference
+    t0 = time.perf_counter()
+    exr_ref = data.groupby(by="trade_date").apply(find_extreme_return_ref, ret="freq_ret", dfts=dfts)  # type:ignore
+    data["smart_idx"] = data[["freq_ret", "vol"]].apply(
+        lambda z: np.abs(z["freq_ret"]) / np.log(z["vol"]) * 1e4 if z["vol"] > 1 else 0, axis=1
+    )
+    srt_data = data.sort_values(by=["trade_date", "smart_idx"], ascending=[True, False])
+    smt_ref = srt_data.groupby(by="trade_date").apply(
+        lambda z: pd.Series({lbd: cal_smt_ref(z, lbd=lbd, prc="vwap", ret="freq_ret") for lbd in lbds})
+    )
+    rwtc_ref = data.groupby(by="trade_date").apply(cal_range_weighted_time_center_ref, ret="freq_ret")  # type:ignore
+    t_ref = time.perf_counter() - t0
+
+    # new
+    t0 = time.perf_counter()
+    order, _, offsets = split_segments(data["trade_date"])
+    ret, vol, amount, vwap = [data[_].to_numpy(np.float64)[order] for _ in ["freq_ret", "vol", "amount", "vwap"]]
+    exr_new = cal_extreme_return(ret=ret, offsets=offsets, dfts=dfts)
+    smt_new = cal_smart_money(
+        ret=ret, vol=vol, amount=amount, prc=vwap,
+        smart_idx=cal_smart_idx(ret=ret, vol=vol), offsets=offsets, lbds=lbds,
+    )
+    rwtc_new = cal_range_weighted_time_center(ret=ret, offsets=offsets)
+    t_new = time.perf_counter() - t0
+
+    diffs = [max_abs_diff(exr_ref.to_numpy(), exr_new.to_numpy()), max_abs_diff(rwtc_ref.to_numpy(), rwtc_new.to_numpy())]
+    for lbd in lbds:
+        p_ref, r_ref = zip(*smt_ref[lbd])
+        diffs += [max_abs_diff(np.array(p_ref), smt_new[lbd][0]), max_abs_diff(np.array(r_ref), smt_new[lbd][1])]
+    report("intraday", t_ref, t_new, max(diffs))
+    return 0
+
+
+# ---------------------------------
+# ------ neutralization -----------
+# ---------------------------------
+
+def neutralize_by_date_ref(
+        raw_data: pd.DataFrame, old_names: list[str], new_names: list[str],
+        date_name: str, sec_name: str, instru_name: str,
+) -> pd.DataFrame:
+    import scipy.stats as sps
+
+    rank_data = (
+        raw_data[[date_name] + old_names]
+        .groupby(by=date_name, group_keys=False)[old_names]
+        .apply(lambda z: z.rank() / (z.count() + 1))
+    )
+    norm_rv_data = rank_data.apply(sps.norm.ppf)
+    norm_data = pd.merge(
+        left=raw_data[[date_name, instru_name, sec_name]],
+        right=norm_rv_data,
+        how="inner",
+        left_index=True, right_index=True,
+    )
+    neu_data = (
+        norm_data[[date_name, sec_name] + old_names]
+        .groupby(by=[date_name, sec_name], group_keys=False)[old_names]
+        .apply(lambda z: z - z.mean())
+    )
+    res_data = pd.merge(
+        left=raw_data[[date_name, instru_name, sec_name]],
+        right=neu_data,
+        how="inner",
+        left_index=True, right_index=True
+    ).rename(columns={o: n for o, n in zip(old_names, new_names)})
+    return res_data[[date_name, instru_name, sec_name] + new_names]
+
+
+def bench_neutralize(n: int, rng: np.random.Generator):
+    import yaml
+    import typedef
+    from solutions.shared import neutralize_by_date
+
+    with open("config.yaml", "r") as f:
+        config = yaml.safe_load(f)
+    sectors = {instru: v["sectorL1"] for instru, v in config["universe"].items()}
+    dates = [f"D{i:05d}" for i in range(n)]
+    raw_data = pd.DataFrame({
+        "trade_date": np.repeat(dates, len(sectors)),
+        "instrument": np.tile(list(sectors), n),
+        "sectorL1": np.tile(list(sectors.values()), n),
+    }).sort_values(by=["trade_date", "sectorL1"])
+
+    t_ref_tot, t_new_tot = 0.0, 0.0
+    for factor_class, cfg_args in config["factors"].items():
+        cfg = getattr(typedef, f"CCfgFactor{factor_class}")(**cfg_args)
+        old_names = cfg.factor_names
+        new_names = [f"{z}_NEU" for z in old_names]
+        data = raw_data.copy()
+        for z in old_names:
+            values = rng.normal(size=len(data))
+            values[rng.random(len(data)) < 0.1] = np.nan
+            data[z] = values
+
+        t0 = time.perf_counter()
+        ref = neutralize_by_date_ref(data, old_names, new_names, "trade_date", "sectorL1", "instrument")
+        t_ref = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        new = neutralize_by_date(data, old_names, new_names, "trade_date", "sectorL1", "instrument")
+        t_new = time.perf_counter() - t0
+
+        same_rows = ref.index.equals(new.index) and ref[["trade_date", "instrument"]].equals(
+            new[["trade_date", "instrument"]]
+        )
+        diff = max_abs_diff(ref[new_names].to_numpy(), new[new_names].to_numpy()) if same_rows else np.inf
+        report(f"neutralize.{factor_class}", t_ref, t_new, diff)
+        t_ref_tot, t_new_tot = t_ref_tot + t_ref, t_new_tot + t_new
+    print(f"[neutralize] all factor classes: ref = {t_ref_tot:.4f}s, new = {t_new_tot:.4f}s, "
+          f"speedup = {t_ref_tot / max(t_new_tot, 1e-9):.1f}x")
+    return 0
+
+
+# ---------------------------------
+# ------ panel store --------------
+# ---------------------------------
+
+def bench_panel(n: int, rng: np.random.Generator):
+    import tempfile
+    from husfort.qsqlite import CMgrSqlDb
+    from solutions.shared import gen_fac_neu_db
+    from solutions.panel import gen_panel_db, update_with_panel
+
+    instruments = [f"I{i:02d}" for i in range(60)]
+    factor_names = [f"F{k:02d}_NEU" for k in range(24)]
+    dates = pd.date_range("20120101", periods=n, freq="B").strftime("%Y%m%d")
+    data = pd.DataFrame({
+        "trade_date": np.repeat(dates, len(instruments)),
+        "instrument": np.tile(instruments, n),
+    })
+    for z in factor_names:
+        data[z] = rng.normal(size=len(data))
+    bgn_date, stp_date = dates[n // 4], dates[-1]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_struct = gen_fac_neu_db(tmp_dir, "BENCH", factor_names)
+        os.makedirs(db_struct.db_save_dir)
+        sqldb = CMgrSqlDb(db_struct.db_save_dir, db_struct.db_name, db_struct.table, mode="a")
+        update_with_panel(db_struct, sqldb, data)
+        panel = gen_panel_db(db_struct)
+
+        # long format, all factors
+        t0 = time.perf_counter()
+        sqldb = CMgrSqlDb(db_struct.db_save_dir, db_struct.db_name, db_struct.table, mode="r")
+        ref = sqldb.read_by_range(bgn_date, stp_date).sort_values(by=["trade_date", "instrument"])
+        t_ref = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        new = panel.read_by_range(bgn_date, stp_date)
+        t_new = time.perf_counter() - t0
+        report("panel.long", t_ref, t_new, max_abs_diff(ref[factor_names].to_numpy(), new[factor_names].to_numpy()))
+
+        # wide format of one factor, as used by signals and simulations
+        z = factor_names[0]
+        t0 = time.perf_counter()
+        sqldb = CMgrSqlDb(db_struct.db_save_dir, db_struct.db_name, db_struct.table, mode="r")
+        ref = sqldb.read_by_range(bgn_date, stp_date, value_columns=["trade_date", "instrument", z])
+        ref = pd.pivot_table(data=ref, index="trade_date", columns="instrument", values=z)
+        t_ref = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        new = panel.read_wide(z, bgn_date, stp_date)
+        t_new = time.perf_counter() - t0
+        report("panel.wide", t_ref, t_new, max_abs_diff(ref.to_numpy(), new.to_numpy()))
+
+        size_sqlite = os.path.getsize(os.path.join(db_struct.db_save_dir, db_struct.db_name))
+        size_panel = sum(os.path.getsize(panel.get_path(f)) for f in os.listdir(panel.panel_dir))
+        print(f"[panel] size of sqlite = {size_sqlite / 1024 ** 2:.1f} MB, size of panel = {size_panel / 1024 ** 2:.1f} MB")
+    return 0
+
+
+# ---------------------------------
+# ------ storage backends ---------
+# ---------------------------------
+
+def bench_storage(n: int, rng: np.random.Generator):
+    import tempfile
+    from solutions.shared import gen_fac_neu_db
+    from solutions.storage import gen_db_mgr
+
+    instruments = [f"I{i:02d}" for i in range(60)]
+    factor_names = [f"F{k:03d}_NEU" for k in range(200)]
+    dates = pd.date_range("20120101", periods=n, freq="B").strftime("%Y%m%d")
+    data = pd.DataFrame({
+        "trade_date": np.repeat(dates, len(instruments)),
+        "instrument": np.tile(instruments, n),
+    })
+    data = pd.concat([data, pd.DataFrame(rng.normal(size=(len(data), len(factor_names))), columns=factor_names)], axis=1)
+    bgn_date, stp_date = dates[n // 4], dates[-1]
+    value_columns = ["trade_date", "instrument"] + factor_names[0:20]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_struct = gen_fac_neu_db(tmp_dir, "BENCH", factor_names)
+        os.makedirs(db_struct.db_save_dir, exist_ok=True)
+        sizes, res, elapsed = {}, {}, {}
+        for suffix in (".db", ".parquet"):
+            db_name = f"BENCH{suffix}"
+            t0 = time.perf_counter()
+            db = gen_db_mgr(db_struct.db_save_dir, db_name, db_struct.table, mode="a")
+            db.update(data)
+            t_write = time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            db = gen_db_mgr(db_struct.db_save_dir, db_name, db_struct.table, mode="r")
+            res[suffix] = db.read_by_range(bgn_date, stp_date, value_columns=value_columns)
+            elapsed[suffix] = time.perf_counter() - t0
+
+            path = os.path.join(db_struct.db_save_dir, db_name)
+            if os.path.isdir(path):
+                sizes[suffix] = sum(os.path.getsize(os.path.join(r, f)) for r, _, fs in os.walk(path) for f in fs)
+            else:
+                sizes[suffix] = os.path.getsize(path)
+            print(f"[storage{suffix}] write = {t_write:.4f}s, size = {sizes[suffix] / 1024 ** 2:.1f} MB")
+
+        ref = res[".db"].sort_values(by=["trade_date", "instrument"])
+        new = res[".parquet"].sort_values(by=["trade_date", "instrument"])
+        diff = max_abs_diff(ref[factor_names[0:20]].to_numpy(), new[factor_names[0:20]].to_numpy())
+        report("storage.read_20_of_200_columns", elapsed[".db"], elapsed[".parquet"], diff)
+    return 0
+
+
+# ---------------------------------
+# ------ member position ----------
+# ---------------------------------
+
+def cal_mbr_pos_ref(
+        pos_data: pd.DataFrame, top: int, instru_oi_data: pd.DataFrame, using_diff: bool, call_weight_sum: bool,
+) -> pd.Series:
+    from solutions.factorAlg import auto_weight_sum
+
+    cntrct_pos_data = pos_data.query("code_type == 0")
+    lng_pos_data = cntrct_pos_data[["trade_date", "ts_code", "broker", "long_hld", "long_chg"]].dropna(
+        subset=["long_hld", "long_chg"], how="any")
+    lng_rnk_data = lng_pos_data[["trade_date", "ts_code", "long_hld"]].groupby(
+        by=["trade_date", "ts_code"]).rank(ascending=False)
+    lng_data = pd.merge(
+        left=lng_pos_data, right=lng_rnk_data,
+        left_index=True, right_index=True,
+        how="left", suffixes=("", "_rnk")
+    ).sort_values(by=["trade_date", "ts_code", "long_hld_rnk"], ascending=True)
+    lng_data_slc = lng_data.query(f"long_hld_rnk <= {top}")
+    lng_oi_df = pd.pivot_table(
+        data=lng_data_slc,
+        index="trade_date",
+        values="long_chg" if using_diff else "long_hld",
+        aggfunc=auto_weight_sum if call_weight_sum else "sum",
+    )
+    noi_df = instru_oi_data.set_index("trade_date").merge(
+        right=lng_oi_df, left_index=True, right_index=True, how="left",
+    )
+    noi_df["noi_sum"] = noi_df["long_chg" if using_diff else "long_hld"]
+    return noi_df[["noi_sum", "oi_instru"]].apply(
+        lambda z: z.iloc[0] / z.iloc[1] * 100 if z.iloc[1] > 0 else np.nan, axis=1
+    )
+
+
+def bench_member_position(n: int, rng: np.random.Generator):
+    from solutions.factorAlg import rank_mbr_pos, cal_mbr_pos_top_sums
+
+    tops = [5, 10, 20]
+    dates = [f"D{i:05d}" for i in range(n)]
+    n_cntrcts, n_brokers = 3, 20
+    size = n * n_cntrcts * n_brokers
+    pos_data = pd.DataFrame({
+        "trade_date": np.repeat(dates, n_cntrcts * n_brokers),
+        "ts_code": np.tile(np.repeat([f"C{i}" for i in range(n_cntrcts)], n_brokers), n),
+        "broker": np.tile([f"B{i:02d}" for i in range(n_brokers)], n * n_cntrcts),
+        "long_hld": rng.integers(0, 50, size=size) * 100.0,  # with ties
+        "long_chg": rng.integers(-10, 11, size=size) * 10.0,
+        "code_type": (rng.random(size) < 0.1).astype(int),
+    })
+    pos_data.loc[rng.random(size) < 0.02, "long_hld"] = np.nan
+    instru_oi_data = pd.DataFrame({"trade_date": dates, "oi_instru": rng.integers(0, 100000, size=n) * 1.0})
+
+    for factor_class in ["NOI", "NDOI", "WNOI", "WNDOI"]:
+        using_diff, call_weight_sum = factor_class in ["NDOI", "WNDOI"], factor_class in ["WNOI", "WNDOI"]
+        t0 = time.perf_counter()
+        ref = [cal_mbr_pos_ref(pos_data, top, instru_oi_data, using_diff, call_weight_sum) for top in tops]
+        t_ref = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        noi_sum = cal_mbr_pos_top_sums(
+            rank_mbr_pos(pos_data), value="long_chg" if using_diff else "long_hld",
+            tops=tops, weighted=call_weight_sum,
+        ).reindex(index=instru_oi_data["trade_date"]).to_numpy()
+        oi_instru = instru_oi_data["oi_instru"].to_numpy()[:, None]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            new = np.where(oi_instru > 0, noi_sum / oi_instru * 100, np.nan)
+        t_new = time.perf_counter() - t0
+
+        report(f"member_position.{factor_class}", t_ref, t_new, max_abs_diff(np.column_stack(ref), new))
+    return 0
+
+
+# ---------------------------------
+# ------ TA -----------------------
+# ---------------------------------
+
+def cal_ta_ref(cfg, major_data: pd.DataFrame) -> pd.DataFrame:
+    import talib as ta
+
+    opn, close = major_data["openI"], major_data["closeI"]
+    high, low, volume = major_data["highI"], major_data["lowI"], major_data["vol_major"]
+    res = pd.DataFrame(index=major_data.index)
+
+    fast, slow, diff = cfg.macd
+    res[cfg.name_macd] = ta.MACD(close, fastperiod=fast, slowperiod=slow, signalperiod=diff)[2]
+    timeperiod, up, dn = cfg.bbands
+    upper, middle, lower = ta.BBANDS(close, timeperiod=timeperiod, nbdevup=up, nbdevdn=dn, matype=0)
+    res[cfg.name_bbands] = [
+        (u / c - 1) * 100 if c >= m else (l / c - 1) * 100 for u, m, l, c in zip(upper, middle, lower, close)
+    ]
+    acceleration, maximum = cfg.sar
+    res[cfg.name_sar] = (close / ta.SAR(high, low, acceleration=acceleration, maximum=maximum) - 1) * 100
+    res[cfg.name_adx] = ta.ADX(high, low, close, timeperiod=cfg.adx)
+    res[cfg.name_bop] = ta.BOP(opn, high, low, close)
+    res[cfg.name_cci] = ta.CCI(high, low, close, timeperiod=cfg.cci)
+    res[cfg.name_cmo] = ta.CMO(close, timeperiod=cfg.cmo)
+    res[cfg.name_rsi] = ta.RSI(close, timeperiod=cfg.rsi)
+    res[cfg.name_mfi] = ta.MFI(high, low, close, volume, timeperiod=cfg.mfi)
+    res[cfg.name_willr] = ta.WILLR(high, low, close, timeperiod=cfg.willr)
+    fast, slow = cfg.adosc
+    res[cfg.name_adosc] = ta.ADOSC(high, low, close, volume, fastperiod=fast, slowperiod=slow) / volume.rolling(
+        slow).mean()
+    obv = ta.OBV(close, volume)
+    res[cfg.name_obv] = (obv - obv.shift(cfg.obv)) / volume.rolling(cfg.obv).mean()
+    res[cfg.name_natr] = ta.NATR(high, low, close, timeperiod=cfg.natr)
+    return res
+
+
+def bench_ta(n: int, rng: np.random.Generator):
+    import yaml
+    import typedef
+    from solutions.factorPanel import CInputPanel
+    from solutions.factorTechnical import cal_ta_for_panel
+
+    with open("config.yaml", "r") as f:
+        cfg = typedef.CCfgFactorTA(**yaml.safe_load(f)["factors"]["TA"])
+    dates = np.array([f"D{i:05d}" for i in range(n)], dtype=object)
+    instru_data: dict[str, pd.DataFrame] = {}
+    for i in range(60):
+        bgn = int(rng.integers(0, n // 3))  # instruments are listed at different dates
+        size = n - bgn
+        close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, size)))
+        instru_data[f"I{i:02d}"] = pd.DataFrame({
+            "trade_date": dates[bgn:],
+            "openI": close * (1 + rng.normal(0, 0.005, size)),
+            "highI": close * (1 + rng.uniform(0, 0.02, size)),
+            "lowI": close * (1 - rng.uniform(0, 0.02, size)),
+            "closeI": close,
+            "vol_major": rng.integers(1000, 3000, size) * 1.0,
+        })
+
+    t0 = time.perf_counter()
+    ref = {instru: cal_ta_ref(cfg, df) for instru, df in instru_data.items()}
+    t_ref = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    panel = CInputPanel.from_instru_data(instru_data)
+    new = cal_ta_for_panel(cfg, panel)
+    t_new = time.perf_counter() - t0
+
+    diff = 0.0
+    for j, instru in enumerate(panel.instruments):
+        rows = panel.mask[:, j]
+        for factor_name in cfg.factor_names:
+            diff = max(diff, max_abs_diff(ref[instru][factor_name].to_numpy(), new[factor_name][rows, j]))
+    report("ta", t_ref, t_new, diff)
+    return 0
+
+
+# ---------------------------------
+# ------ market -------------------
+# ---------------------------------
+
+def cal_market_return_ref(input_for_return: pd.DataFrame) -> pd.DataFrame:
+    def cal_market_return_by_date(sub_data: pd.DataFrame) -> float:
+        wgt = sub_data["rel_wgt"] / sub_data["rel_wgt"].sum()
+        return sub_data["return"] @ wgt
+
+    input_for_return = input_for_return.set_index("trade_date")
+    input_for_return["rel_wgt"] = np.sqrt(input_for_return["amount"])
+    ret = {"market": input_for_return.groupby(by="trade_date").apply(cal_market_return_by_date)}
+    for sector, sector_df in input_for_return.groupby(by="sectorL0"):
+        ret[sector] = sector_df.groupby(by="trade_date").apply(cal_market_return_by_date)
+    for sector, sector_df in input_for_return.groupby(by="sectorL1"):
+        ret[sector] = sector_df.groupby(by="trade_date").apply(cal_market_return_by_date)
+    return pd.DataFrame(ret)
+
+
+def bench_market(n: int, rng: np.random.Generator):
+    import yaml
+    from solutions.market import cal_market_return_by_group
+
+    with open("config.yaml", "r") as f:
+        universe = yaml.safe_load(f)["universe"]
+    dates = [f"D{i:05d}" for i in range(n)]
+    size = n * len(universe)
+    available_data = pd.DataFrame({
+        "trade_date": np.repeat(dates, len(universe)),
+        "instrument": np.tile(list(universe), n),
+        "sectorL0": np.tile([v["sectorL0"] for v in universe.values()], n),
+        "sectorL1": np.tile([v["sectorL1"] for v in universe.values()], n),
+        "return": rng.normal(0, 0.01, size=size),
+        "amount": rng.uniform(0, 1e6, size=size),
+    }).sample(frac=0.8, random_state=0).sort_values(by=["trade_date", "instrument"])
+
+    t0 = time.perf_counter()
+    ref = cal_market_return_ref(available_data)
+    t_ref = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    new = cal_market_return_by_group(available_data, levels=["sectorL0", "sectorL1"])
+    t_new = time.perf_counter() - t0
+
+    diff = max_abs_diff(ref.to_numpy(), new[ref.columns].to_numpy()) if ref.index.equals(new.index) else np.inf
+    report("market", t_ref, t_new, diff)
+    return 0
+
+
+# ---------------------------------
+# ------ rolling moments ----------
+# ---------------------------------
+
+def bench_rolling_moments(n: int, rng: np.random.Generator):
+    from solutions.factorPanel import CInputPanel
+    from solutions.factorKernels import cal_rolling_sum_mean_batch, cal_rolling_skew_batch
+
+    wins = [20, 60, 120, 240]
+    dates = np.array([f"D{i:05d}" for i in range(n)], dtype=object)
+    instru_data: dict[str, pd.DataFrame] = {}
+    for i in range(60):
+        bgn = int(rng.integers(0, n // 3))  # instruments are listed at different dates
+        size = n - bgn
+        basis_rate = rng.normal(0, 1, size)
+        basis_rate[rng.random(size) < 0.1] = np.nan
+        instru_data[f"I{i:02d}"] = pd.DataFrame({
+            "trade_date": dates[bgn:],
+            "return_c_major": rng.normal(0, 0.01, size),
+            "basis_rate": basis_rate,
+        })
+
+    t0 = time.perf_counter()
+    ref: dict[str, dict[str, pd.Series]] = {}
+    for instru, df in instru_data.items():
+        ref[instru] = {}
+        for win in wins:
+            ref[instru][f"sum{win}"] = df["return_c_major"].rolling(window=win).sum()
+            ref[instru][f"skew{win}"] = df["return_c_major"].rolling(window=win).skew()
+            ref[instru][f"mean{win}"] = df["basis_rate"].rolling(window=win, min_periods=int(2 * win / 3)).mean()
+    t_ref = time.perf_counter() - t0
+
+    panel = CInputPanel.from_instru_data(instru_data)  # inputs are loaded as a panel in universe mode
+    t0 = time.perf_counter()
+    ret, basis_rate = panel.compact(panel.data["return_c_major"]), panel.compact(panel.data["basis_rate"])
+    sum_mean = cal_rolling_sum_mean_batch(ret, wins)
+    skew = cal_rolling_skew_batch(ret, wins)
+    mean = cal_rolling_sum_mean_batch(basis_rate, wins, min_periods={win: int(2 * win / 3) for win in wins})
+    new: dict[str, np.ndarray] = {}
+    for win in wins:
+        new[f"sum{win}"] = panel.expand(sum_mean[win][0])
+        new[f"skew{win}"] = panel.expand(skew[win])
+        new[f"mean{win}"] = panel.expand(mean[win][1])
+    t_new = time.perf_counter() - t0
+
+    diff = 0.0
+    for j, instru in enumerate(panel.instruments):
+        rows = panel.mask[:, j]
+        for k, v in ref[instru].items():
+            diff = max(diff, max_abs_diff(v.to_numpy(), new[k][rows, j]))
+    report("rolling_moments", t_ref, t_new, diff)
+    return 0
+
+
+# ---------------------------------
+# ------ signals ------------------
+# ---------------------------------
+
+def cal_signal_ref(data: pd.DataFrame, factor_name: str, bgn_date: str, base_bgn_date: str, maw: int) -> pd.DataFrame:
+    from solutions.signals import _CSignal
+
+    input_data = data.loc[data["trade_date"] >= base_bgn_date, ["trade_date", "instrument", factor_name]]
+    sorted_data = input_data.sort_values(by=["trade_date", factor_name, "instrument"], ascending=[True, False, True])
+    grouped_data = sorted_data.groupby(by=["trade_date"], group_keys=False)[["trade_date", "instrument", factor_name]]
+    signal_data = grouped_data.apply(_CSignal.map_factor_to_signal)
+    return _CSignal.moving_average_signal(signal_data, bgn_date=bgn_date, maw=maw)
+
+
+def bench_signals(n: int, rng: np.random.Generator):
+    from solutions.signals import CSignalsFromFactorNeu
+
+    maws, factor_names, n_instru = [5, 10], ["F0", "F1", "F2", "F3"], 60
+    dates = [f"D{i:05d}" for i in range(n)]
+    calendar = SimpleNamespace(get_next_date=lambda d, shift: dates[dates.index(d) + shift])
+    data = pd.DataFrame({
+        "trade_date": np.repeat(dates, n_instru),
+        "instrument": np.tile([f"I{i:02d}" for i in range(n_instru)], n),
+        **{z: rng.normal(0, 1, n * n_instru) for z in factor_names},
+    }).sample(frac=0.9, random_state=0).sort_values(by=["trade_date", "instrument"]).reset_index(drop=True)
+    bgn_date = dates[max(maws)]
+
+    t0 = time.perf_counter()
+    ref = {
+        (z, maw): cal_signal_ref(data, z, bgn_date, calendar.get_next_date(bgn_date, -maw + 1), maw)
+        for z, maw in ittl.product(factor_names, maws)
+    }
+    t_ref = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    signals = CSignalsFromFactorNeu("X", factor_names, "", "", maws)
+    input_data = data[data["trade_date"] >= calendar.get_next_date(bgn_date, -max(maws) + 1)]
+    new = signals.core(input_data, bgn_date, dates[-1], calendar)  # type:ignore
+    t_new = time.perf_counter() - t0
+
+    diff = 0.0
+    for k, v in ref.items():
+        if not (v["trade_date"].tolist() == new[k]["trade_date"].tolist()
+                and v["instrument"].tolist() == new[k]["instrument"].tolist()):
+            diff = np.inf
+            break
+        diff = max(diff, max_abs_diff(v["weight"].to_numpy(), new[k]["weight"].to_numpy()))
+    report("signals", t_ref, t_new, diff)
+    return 0
+
+
+# ---------------------------------
+# ------ simulations --------------
+# ---------------------------------
+
+def bench_simulations(n: int, rng: np.random.Generator):
+    from solutions.simulations import CSim, CSimBatch
+
+    n_sims, n_instru, cost_rate = 100, 60, 3e-4
+    dates = np.array([f"D{i:05d}" for i in range(n)], dtype=object)
+    instruments = np.array([f"I{i:02d}" for i in range(n_instru)], dtype=object)
+    ret_data = pd.DataFrame({
+        "trade_date": np.repeat(dates, n_instru),
+        "instrument": np.tile(instruments, n),
+        "ret": rng.normal(0, 0.01, n * n_instru),
+    }).sample(frac=0.95, random_state=0).sort_values(by=["trade_date", "instrument"])
+    sig_data_list = [
+        pd.DataFrame({
+            "trade_date": np.repeat(dates, n_instru),
+            "instrument": np.tile(instruments, n),
+            "sig": rng.normal(0, 1, n * n_instru),
+        }).sample(frac=0.9, random_state=k).sort_values(by=["trade_date", "instrument"])
+        for k in range(n_sims)
+    ]
+    sim = CSim.__new__(CSim)
+    sim.sim_args = SimpleNamespace(cost=cost_rate)
+
+    t0 = time.perf_counter()
+    ref = [sim.cal_ret(CSim.merge_sig_and_ret(sig_data, ret_data)) for sig_data in sig_data_list]
+    t_ref = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    r, c = [np.searchsorted(v, ret_data[z].to_numpy(dtype=object)) for v, z in
+            [(dates, "trade_date"), (instruments, "instrument")]]
+    ret, ret_mask = np.zeros((n, n_instru)), np.zeros((n, n_instru), dtype=bool)
+    ret[r, c], ret_mask[r, c] = ret_data["ret"], True
+    sig, sig_mask = np.zeros((n_sims, n, n_instru)), np.zeros((n_sims, n, n_instru), dtype=bool)
+    for k, sig_data in enumerate(sig_data_list):
+        r, c = [np.searchsorted(v, sig_data[z].to_numpy(dtype=object)) for v, z in
+                [(dates, "trade_date"), (instruments, "instrument")]]
+        sig[k, r, c], sig_mask[k, r, c] = sig_data["sig"], True
+    raw_ret, dlt_wgt, cost, net_ret, *_ = CSimBatch.cal_ret(sig, sig_mask, ret, ret_mask, np.full(n_sims, cost_rate))
+    t_new = time.perf_counter() - t0
+
+    diff = 0.0
+    for k, v in enumerate(ref):
+        new = np.stack([raw_ret[k], dlt_wgt[k], cost[k], net_ret[k]], axis=1)
+        diff = max(diff, max_abs_diff(v[["raw_ret", "dlt_wgt", "cost", "net_ret"]].to_numpy(), new))
+    report("simulations", t_ref, t_new, diff)
+    return 0
+
+
+# ---------------------------------
+# ------ calendar -----------------
+# ---------------------------------
+
+def bench_calendar(n: int, rng: np.random.Generator):
+    import tempfile
+    from husfort.qcalendar import CCalendar
+    from solutions.calendarIndex import get_calendar_index
+
+    trade_dates = pd.bdate_range("2000-01-03", periods=n + 500).strftime("%Y%m%d")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        calendar_path = os.path.join(tmp_dir, "calendar.csv")
+        pd.DataFrame({"trade_date": trade_dates}).to_csv(calendar_path, index=False)
+        calendar = CCalendar(calendar_path)
+    dates = pd.Series(trade_dates[100:100 + n], name="trade_date")
+    shift = int(rng.integers(1, 20))
+
+    t0 = time.perf_counter()
+    ref = dates.map(lambda z: calendar.get_next_date(z, shift))
+    t_ref = time.perf_counter() - t0
+
+    calendar_index = get_calendar_index(calendar)  # built once in a process
+    t0 = time.perf_counter()
+    new = calendar_index.shift(dates, shift)
+    t_new = time.perf_counter() - t0
+
+    report("calendar", t_ref, t_new, 0.0 if ref.tolist() == new.tolist() else np.inf)
+    return 0
+
+
+# ---------------------------------
+# ------ evaluations --------------
+# ---------------------------------
+
+def bench_evaluations(n: int, rng: np.random.Generator):
+    import tempfile
+    import yaml
+    import typedef
+    from husfort.qevaluation import CNAV
+    from typedef import CRet, TFactors
+    from solutions.storage import gen_db_mgr
+    from solutions.shared import gen_nav_db, get_sim_args_fac_neu
+    from solutions.evaluations import process_for_evl_frm_sim, process_for_evl_batch, CEvlBatch, cal_nav_indicators
+
+    with open("config.yaml", "r") as f:
+        config = yaml.safe_load(f)
+    factors = TFactors([])
+    for factor_class, cfg_args in config["factors"].items():
+        factors.extend(getattr(typedef, f"CCfgFactor{factor_class}")(**cfg_args).get_factors_neu())
+    lag = config["CONST"]["LAG"]
+    rets = [CRet("RAW", prc, win, lag) for win in config["sim"]["wins"] for prc in ("Opn", "Cls")]
+    dates = [f"D{i:05d}" for i in range(n)]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sim_args_list = get_sim_args_fac_neu(factors, config["prd"]["wins"], rets, tmp_dir, tmp_dir, cost=0)
+        for k, sim_args in enumerate(sim_args_list):
+            d = int(rng.integers(0, n // 10)) if k % 10 == 0 else 0  # some sims start later
+            net_ret = rng.normal(2e-4, 0.01, n - d)
+            nav_data = pd.DataFrame({
+                "trade_date": dates[d:],
+                "raw_ret": net_ret, "dlt_wgt": 0.0, "cost": 0.0, "net_ret": net_ret,
+                "nav": np.cumprod(1 + net_ret),
+            })
+            db_struct = gen_nav_db(db_save_dir=tmp_dir, save_id=sim_args.sim_id)
+            gen_db_mgr(db_struct.db_save_dir, db_struct.db_name, db_struct.table, mode="a").update(nav_data)
+
+        t0 = time.perf_counter()
+        ref = [process_for_evl_frm_sim("facNeu", sim_args, tmp_dir, dates[0], "D99999") for sim_args in sim_args_list]
+        t_ref = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        new = process_for_evl_batch("facNeu", sim_args_list, tmp_dir, dates[0], "D99999")
+        t_new = time.perf_counter() - t0
+
+        # indicators only, returns are loaded already
+        ret_data = CEvlBatch("facNeu", sim_args_list, tmp_dir).load_ret(dates[0], "D99999")
+        t0 = time.perf_counter()
+        ref_ind = [CNAV(ret_data[z].dropna(), input_type="RET") for z in ret_data.columns]
+        for nav in ref_ind:
+            nav.cal_all_indicators()
+        ref_ind = [nav.to_dict() for nav in ref_ind]
+        t_ref_ind = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        new_ind = cal_nav_indicators(ret_data.to_numpy(dtype=np.float64))
+        t_new_ind = time.perf_counter() - t0
+
+    indicators = ["hpr", "retMean", "retStd", "retAnnual", "volAnnual", "sharpe", "calmar", "mdd"]
+    diff = max_abs_diff(pd.DataFrame(ref)[indicators].to_numpy(), pd.DataFrame(new)[indicators].to_numpy())
+    report(f"evaluations.facNeu x {len(sim_args_list)}", t_ref, t_new, diff)
+    diff = max_abs_diff(pd.DataFrame(ref_ind)[indicators].to_numpy(), np.stack([new_ind[k] for k in indicators], 1))
+    report(f"evaluations.facNeu x {len(sim_args_list)}, indicators only", t_ref_ind, t_new_ind, diff)
+    return 0
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    _rng = np.random.default_rng(args.seed)
+    if args.switch == "rolling_top_corr":
+        bench_rolling_top_corr(args.n, _rng)
+    elif args.switch == "rolling_top_bottom_mean":
+        bench_rolling_top_bottom_mean(args.n, _rng)
+    elif args.switch == "rolling_beta":
+        bench_rolling_beta(args.n, _rng)
+    elif args.switch == "roll_return":
+        bench_roll_return(args.n, _rng)
+    elif args.switch == "intraday":
+        bench_intraday(args.n, _rng)
+    elif args.switch == "neutralize":
+        bench_neutralize(args.n, _rng)
+    elif args.switch == "panel":
+        bench_panel(args.n, _rng)
+    elif args.switch == "storage":
+        bench_storage(args.n, _rng)
+    elif args.switch == "member_position":
+        bench_member_position(args.n, _rng)
+    elif args.switch == "ta":
+        bench_ta(args.n, _rng)
+    elif args.switch == "market":
+        bench_market(args.n, _rng)
+    elif args.switch == "rolling_moments":
+        bench_rolling_moments(args.n, _rng)
+    elif args.switch == "signals":
+        bench_signals(args.n, _rng)
+    elif args.switch == "simulations":
+        bench_simulations(args.n, _rng)
+    elif args.switch == "calendar":
+        bench_calendar(args.n, _rng)
+    elif args.switch == "evaluations":
+        bench_evaluations(args.n, _rng)
+    else:
+        raise ValueError(f"args.switch = {args.switch} is illegal")
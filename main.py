@@ -1,12 +1,32 @@
 import argparse
-
-
-def parse_args():
+import shlex
+
+FACTOR_CLASSES = (
+    "MTM", "SKEW",
+    "RS", "BASIS", "TS",
+    "S0BETA", "S1BETA", "CBETA", "IBETA", "PBETA",
+    "CTP", "CTR", "CVP", "CVR", "CSP", "CSR",
+    "NOI", "NDOI", "WNOI", "WNDOI",
+    "AMP", "EXR", "SMT", "RWTC",
+    "TA",
+)
+
+# begin dates of groups of nodes in pipeline, the same as run_all.ps1
+PIPELINE_BGN_DATES = {
+    "sig": "20170703",
+    "sim": "20180102",
+    "ml": "20170201",
+    "mdl_prd": "20170301",
+    "mdl_opt": "20170405",
+}
+
+
+def parse_args(argv: list[str] | None = None):
     arg_parser = argparse.ArgumentParser(description="To calculate data, such as macro and forex")
     arg_parser.add_argument("--bgn", type=str, help="begin date, format = [YYYYMMDD]", required=True)
     arg_parser.add_argument("--stp", type=str, help="stop  date, format = [YYYYMMDD]")
     arg_parser.add_argument("--nomp", default=False, action="store_true",
-                            help="not using multiprocess, for debug. Works only when switch in (factor,)")
+                            help="not using multiprocess, for debug. Works only when switch in (test_return, factor)")
     arg_parser.add_argument("--processes", type=int, default=None,
                             help="number of processes to be called, effective only when nomp = False")
     arg_parser.add_argument("--verbose", default=False, action="store_true",
@@ -32,14 +52,14 @@ def parse_args():
     # switch: factor
     arg_parser_sub = arg_parser_subs.add_parser(name="factor", help="Calculate factor")
     arg_parser_sub.add_argument(
-        "--fclass", type=str, help="factor class to run", required=True,
-        choices=("MTM", "SKEW",
-                 "RS", "BASIS", "TS",
-                 "S0BETA", "S1BETA", "CBETA", "IBETA", "PBETA",
-                 "CTP", "CTR", "CVP", "CVR", "CSP", "CSR",
-                 "NOI", "NDOI", "WNOI", "WNDOI",
-                 "AMP", "EXR", "SMT", "RWTC",
-                 "TA",),
+        "--fclass", type=str, required=True,
+        help=f"factor class to run, separated by ',' to run many classes in one run, like 'MTM,SKEW', "
+             f"or 'ALL' for all classes. Choices = {FACTOR_CLASSES}",
+    )
+    arg_parser_sub.add_argument(
+        "--ta-warmup", type=int, default=None,
+        help="truncate inputs of TA to this multiple of the max lookback of its indicators, "
+             "instead of the full history since 20120104. Values of TA may change slightly",
     )
 
     # switch: signals
@@ -62,361 +82,433 @@ def parse_args():
     arg_parser_sub = arg_parser_subs.add_parser(name="optimize", help="optimize portfolio and signals")
     arg_parser_sub.add_argument("--type", type=str, choices=("mdlPrd", "mdlOpt"))
 
-    return arg_parser.parse_args()
+    # switch: stages
+    arg_parser_sub = arg_parser_subs.add_parser(
+        name="stages",
+        help="run many switches in one process, sharing a pool of warm workers",
+    )
+    arg_parser_sub.add_argument(
+        "--stages", type=str, required=True,
+        help="switches with their arguments separated by ';', like "
+             "'factor --fclass MTM,SKEW; signals --type facNeu; simulations --type facNeu'. "
+             "Global arguments, like --bgn and --processes, are shared by all stages",
+    )
 
+    # switch: pipeline
+    arg_parser_sub = arg_parser_subs.add_parser(
+        name="pipeline",
+        help="run all switches as in run_all.ps1, independent switches run at the same time in sub processes",
+    )
+    arg_parser_sub.add_argument("--cores", type=int, default=None, help="budget of cores, default is cpu count")
+    arg_parser_sub.add_argument("--factor-cores", type=int, default=1, help="cores of each factor class")
+    arg_parser_sub.add_argument(
+        "--since", type=str, default=None,
+        help="run only nodes matching these patterns separated by ',' and nodes depending on them, "
+             "even if they are up to date, like 'mclrn.*' for run_all_since_mclrn.ps1",
+    )
+    arg_parser_sub.add_argument("--force", default=False, action="store_true",
+                                help="run nodes even if they are up to date")
+    arg_parser_sub.add_argument("--dry-run", default=False, action="store_true",
+                                help="print nodes and whether they are up to date, without running them")
+    for name, bgn_date in PIPELINE_BGN_DATES.items():
+        arg_parser_sub.add_argument(
+            f"--bgn-{name.replace('_', '-')}", type=str, default=bgn_date,
+            help=f"begin date of {name} nodes, default = {bgn_date}. "
+                 f"It is replaced by --bgn if --bgn is later, for an incremental update",
+        )
 
-if __name__ == "__main__":
-    import os
+    return arg_parser.parse_args(argv)
+
+
+def parse_fclasses(fclass: str) -> list[str]:
+    if fclass == "ALL":
+        return list(FACTOR_CLASSES)
+    fclasses = fclass.split(",")
+    for z in fclasses:
+        if z not in FACTOR_CLASSES:
+            raise ValueError(f"fclass = {z} is illegal, choices = {FACTOR_CLASSES}")
+    return fclasses
+
+
+def get_factor(fclass: str, ta_warmup: int | None = None, threads: int | None = None):
+    """
+
+    :param fclass: factor class, like "MTM"
+    :param ta_warmup: truncate inputs of TA to this multiple of the max lookback of its indicators
+    :param threads: number of threads to read instruments for factors calculated for all instruments at once
+    :return: an instance of CFactorRaw, None if this class is not configured
+    """
     from project_config import proj_cfg, db_struct_cfg, cfg_factors
-    from husfort.qlog import define_logger
-    from husfort.qcalendar import CCalendar
 
-    define_logger()
+    fac = None
+    if fclass == "MTM":
+        from solutions.factorAlg import CFactorMTM
 
-    calendar = CCalendar(proj_cfg.calendar_path)
-    args = parse_args()
-    bgn_date, stp_date = args.bgn, args.stp or calendar.get_next_date(args.bgn, shift=1)
+        if (cfg := cfg_factors.MTM) is not None:
+            fac = CFactorMTM(
+                cfg=cfg,
+                factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
+                universe=proj_cfg.universe,
+                db_struct_preprocess=db_struct_cfg.preprocess,
+            )
+    elif fclass == "SKEW":
+        from solutions.factorAlg import CFactorSKEW
 
-    if args.switch == "available":
-        from solutions.available import main_available
+        if (cfg := cfg_factors.SKEW) is not None:
+            fac = CFactorSKEW(
+                cfg=cfg,
+                factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
+                universe=proj_cfg.universe,
+                db_struct_preprocess=db_struct_cfg.preprocess,
+            )
+    elif fclass == "RS":
+        from solutions.factorAlg import CFactorRS
 
-        main_available(
-            bgn_date=bgn_date, stp_date=stp_date,
-            universe=proj_cfg.universe,
-            cfg_avlb_unvrs=proj_cfg.avlb_unvrs,
-            db_struct_preprocess=db_struct_cfg.preprocess,
-            db_struct_avlb=db_struct_cfg.available,
-            calendar=calendar,
-        )
-    elif args.switch == "market":
-        from solutions.market import main_market
+        if (cfg := cfg_factors.RS) is not None:
+            fac = CFactorRS(
+                cfg=cfg,
+                factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
+                universe=proj_cfg.universe,
+                db_struct_preprocess=db_struct_cfg.preprocess,
+            )
+    elif fclass == "BASIS":
+        from solutions.factorAlg import CFactorBASIS
 
-        main_market(
-            bgn_date=bgn_date, stp_date=stp_date,
-            calendar=calendar,
-            db_struct_avlb=db_struct_cfg.available,
-            db_struct_mkt=db_struct_cfg.market,
-            path_mkt_idx_data=proj_cfg.market_index_path,
-            mkt_idxes=list(proj_cfg.mkt_idxes.values()),
-            sectors=proj_cfg.const.SECTORS,
-        )
-    elif args.switch == "test_return":
-        from solutions.test_return import CTstRetRaw, CTstRetNeu
+        if (cfg := cfg_factors.BASIS) is not None:
+            fac = CFactorBASIS(
+                cfg=cfg,
+                factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
+                universe=proj_cfg.universe,
+                db_struct_preprocess=db_struct_cfg.preprocess,
+            )
+    elif fclass == "TS":
+        from solutions.factorAlg import CFactorTS
 
-        for win in proj_cfg.test_rets_wins:
-            # --- raw return
-            tst_ret = CTstRetRaw(
-                win=win, lag=proj_cfg.const.LAG,
+        if (cfg := cfg_factors.TS) is not None:
+            fac = CFactorTS(
+                cfg=cfg,
+                factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
                 universe=proj_cfg.universe,
-                db_tst_ret_save_dir=proj_cfg.test_return_dir,
                 db_struct_preprocess=db_struct_cfg.preprocess,
             )
-            tst_ret.main_test_return_raw(bgn_date, stp_date, calendar)
+    elif fclass == "S0BETA":
+        from solutions.factorAlg import CFactorS0BETA
 
-            # --- neutralization
-            tst_ret_neu = CTstRetNeu(
-                win=win, lag=proj_cfg.const.LAG,
+        if (cfg := cfg_factors.S0BETA) is not None:
+            fac = CFactorS0BETA(
+                cfg=cfg,
+                factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
                 universe=proj_cfg.universe,
-                db_tst_ret_save_dir=proj_cfg.test_return_dir,
-                db_struct_avlb=db_struct_cfg.available,
+                db_struct_preprocess=db_struct_cfg.preprocess,
+                db_struct_mkt=db_struct_cfg.market,
             )
-            tst_ret_neu.main_test_return_neu(
-                bgn_date=bgn_date,
-                stp_date=stp_date,
-                calendar=calendar,
+    elif fclass == "S1BETA":
+        from solutions.factorAlg import CFactorS1BETA
+
+        if (cfg := cfg_factors.S1BETA) is not None:
+            fac = CFactorS1BETA(
+                cfg=cfg,
+                factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
+                universe=proj_cfg.universe,
+                db_struct_preprocess=db_struct_cfg.preprocess,
+                db_struct_mkt=db_struct_cfg.market,
             )
-    elif args.switch == "factor":
-        from project_config import cfg_factors
+    elif fclass == "CBETA":
+        from solutions.factorAlg import CFactorCBETA
 
-        fac, fclass = None, args.fclass
-        if fclass == "MTM":
-            from solutions.factorAlg import CFactorMTM
+        if (cfg := cfg_factors.CBETA) is not None:
+            fac = CFactorCBETA(
+                cfg=cfg,
+                factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
+                universe=proj_cfg.universe,
+                db_struct_preprocess=db_struct_cfg.preprocess,
+                db_struct_forex=db_struct_cfg.forex,
+            )
+    elif fclass == "IBETA":
+        from solutions.factorAlg import CFactorIBETA
 
-            if (cfg := cfg_factors.MTM) is not None:
-                fac = CFactorMTM(
-                    cfg=cfg,
-                    factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
-                    universe=proj_cfg.universe,
-                    db_struct_preprocess=db_struct_cfg.preprocess,
-                )
-        elif fclass == "SKEW":
-            from solutions.factorAlg import CFactorSKEW
+        if (cfg := cfg_factors.IBETA) is not None:
+            fac = CFactorIBETA(
+                cfg=cfg,
+                factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
+                universe=proj_cfg.universe,
+                db_struct_preprocess=db_struct_cfg.preprocess,
+                db_struct_macro=db_struct_cfg.macro,
+            )
+    elif fclass == "PBETA":
+        from solutions.factorAlg import CFactorPBETA
 
-            if (cfg := cfg_factors.SKEW) is not None:
-                fac = CFactorSKEW(
-                    cfg=cfg,
-                    factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
-                    universe=proj_cfg.universe,
-                    db_struct_preprocess=db_struct_cfg.preprocess,
-                )
-        elif fclass == "RS":
-            from solutions.factorAlg import CFactorRS
+        if (cfg := cfg_factors.PBETA) is not None:
+            fac = CFactorPBETA(
+                cfg=cfg,
+                factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
+                universe=proj_cfg.universe,
+                db_struct_preprocess=db_struct_cfg.preprocess,
+                db_struct_macro=db_struct_cfg.macro,
+            )
+    elif fclass == "CTP":
+        from solutions.factorAlg import CFactorCTP
 
-            if (cfg := cfg_factors.RS) is not None:
-                fac = CFactorRS(
-                    cfg=cfg,
-                    factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
-                    universe=proj_cfg.universe,
-                    db_struct_preprocess=db_struct_cfg.preprocess,
-                )
-        elif fclass == "BASIS":
-            from solutions.factorAlg import CFactorBASIS
+        if (cfg := cfg_factors.CTP) is not None:
+            fac = CFactorCTP(
+                cfg=cfg,
+                factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
+                universe=proj_cfg.universe,
+                db_struct_preprocess=db_struct_cfg.preprocess,
+            )
+    elif fclass == "CTR":
+        from solutions.factorAlg import CFactorCTR
 
-            if (cfg := cfg_factors.BASIS) is not None:
-                fac = CFactorBASIS(
-                    cfg=cfg,
-                    factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
-                    universe=proj_cfg.universe,
-                    db_struct_preprocess=db_struct_cfg.preprocess,
-                )
-        elif fclass == "TS":
-            from solutions.factorAlg import CFactorTS
+        if (cfg := cfg_factors.CTR) is not None:
+            fac = CFactorCTR(
+                cfg=cfg,
+                factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
+                universe=proj_cfg.universe,
+                db_struct_preprocess=db_struct_cfg.preprocess,
+            )
+    elif fclass == "CVP":
+        from solutions.factorAlg import CFactorCVP
 
-            if (cfg := cfg_factors.TS) is not None:
-                fac = CFactorTS(
-                    cfg=cfg,
-                    factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
-                    universe=proj_cfg.universe,
-                    db_struct_preprocess=db_struct_cfg.preprocess,
-                )
-        elif fclass == "S0BETA":
-            from solutions.factorAlg import CFactorS0BETA
+        if (cfg := cfg_factors.CVP) is not None:
+            fac = CFactorCVP(
+                cfg=cfg,
+                factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
+                universe=proj_cfg.universe,
+                db_struct_preprocess=db_struct_cfg.preprocess,
+            )
+    elif fclass == "CVR":
+        from solutions.factorAlg import CFactorCVR
 
-            if (cfg := cfg_factors.S0BETA) is not None:
-                fac = CFactorS0BETA(
-                    cfg=cfg,
-                    factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
-                    universe=proj_cfg.universe,
-                    db_struct_preprocess=db_struct_cfg.preprocess,
-                    db_struct_mkt=db_struct_cfg.market,
-                )
-        elif fclass == "S1BETA":
-            from solutions.factorAlg import CFactorS1BETA
+        if (cfg := cfg_factors.CVR) is not None:
+            fac = CFactorCVR(
+                cfg=cfg,
+                factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
+                universe=proj_cfg.universe,
+                db_struct_preprocess=db_struct_cfg.preprocess,
+            )
+    elif fclass == "CSP":
+        from solutions.factorAlg import CFactorCSP
 
-            if (cfg := cfg_factors.S1BETA) is not None:
-                fac = CFactorS1BETA(
-                    cfg=cfg,
-                    factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
-                    universe=proj_cfg.universe,
-                    db_struct_preprocess=db_struct_cfg.preprocess,
-                    db_struct_mkt=db_struct_cfg.market,
-                )
-        elif fclass == "CBETA":
-            from solutions.factorAlg import CFactorCBETA
+        if (cfg := cfg_factors.CSP) is not None:
+            fac = CFactorCSP(
+                cfg=cfg,
+                factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
+                universe=proj_cfg.universe,
+                db_struct_preprocess=db_struct_cfg.preprocess,
+            )
+    elif fclass == "CSR":
+        from solutions.factorAlg import CFactorCSR
 
-            if (cfg := cfg_factors.CBETA) is not None:
-                fac = CFactorCBETA(
-                    cfg=cfg,
-                    factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
-                    universe=proj_cfg.universe,
-                    db_struct_preprocess=db_struct_cfg.preprocess,
-                    db_struct_forex=db_struct_cfg.forex,
-                )
-        elif fclass == "IBETA":
-            from solutions.factorAlg import CFactorIBETA
+        if (cfg := cfg_factors.CSR) is not None:
+            fac = CFactorCSR(
+                cfg=cfg,
+                factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
+                universe=proj_cfg.universe,
+                db_struct_preprocess=db_struct_cfg.preprocess,
+            )
+    elif fclass == "NOI":
+        from solutions.factorAlg import CFactorNOI
 
-            if (cfg := cfg_factors.IBETA) is not None:
-                fac = CFactorIBETA(
-                    cfg=cfg,
-                    factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
-                    universe=proj_cfg.universe,
-                    db_struct_preprocess=db_struct_cfg.preprocess,
-                    db_struct_macro=db_struct_cfg.macro,
-                )
-        elif fclass == "PBETA":
-            from solutions.factorAlg import CFactorPBETA
+        if (cfg := cfg_factors.NOI) is not None:
+            fac = CFactorNOI(
+                cfg=cfg,
+                factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
+                universe=proj_cfg.universe,
+                db_struct_preprocess=db_struct_cfg.preprocess,
+                db_struct_pos=db_struct_cfg.position.copy_to_another(
+                    another_db_save_dir=proj_cfg.by_instru_pos_dir),
+            )
+    elif fclass == "NDOI":
+        from solutions.factorAlg import CFactorNDOI
 
-            if (cfg := cfg_factors.PBETA) is not None:
-                fac = CFactorPBETA(
-                    cfg=cfg,
-                    factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
-                    universe=proj_cfg.universe,
-                    db_struct_preprocess=db_struct_cfg.preprocess,
-                    db_struct_macro=db_struct_cfg.macro,
-                )
-        elif fclass == "CTP":
-            from solutions.factorAlg import CFactorCTP
+        if (cfg := cfg_factors.NDOI) is not None:
+            fac = CFactorNDOI(
+                cfg=cfg,
+                factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
+                universe=proj_cfg.universe,
+                db_struct_preprocess=db_struct_cfg.preprocess,
+                db_struct_pos=db_struct_cfg.position.copy_to_another(
+                    another_db_save_dir=proj_cfg.by_instru_pos_dir),
+            )
+    elif fclass == "WNOI":
+        from solutions.factorAlg import CFactorWNOI
 
-            if (cfg := cfg_factors.CTP) is not None:
-                fac = CFactorCTP(
-                    cfg=cfg,
-                    factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
-                    universe=proj_cfg.universe,
-                    db_struct_preprocess=db_struct_cfg.preprocess,
-                )
-        elif fclass == "CTR":
-            from solutions.factorAlg import CFactorCTR
+        if (cfg := cfg_factors.WNOI) is not None:
+            fac = CFactorWNOI(
+                cfg=cfg,
+                factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
+                universe=proj_cfg.universe,
+                db_struct_preprocess=db_struct_cfg.preprocess,
+                db_struct_pos=db_struct_cfg.position.copy_to_another(
+                    another_db_save_dir=proj_cfg.by_instru_pos_dir),
+            )
+    elif fclass == "WNDOI":
+        from solutions.factorAlg import CFactorWNDOI
 
-            if (cfg := cfg_factors.CTR) is not None:
-                fac = CFactorCTR(
-                    cfg=cfg,
-                    factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
-                    universe=proj_cfg.universe,
-                    db_struct_preprocess=db_struct_cfg.preprocess,
-                )
-        elif fclass == "CVP":
-            from solutions.factorAlg import CFactorCVP
+        if (cfg := cfg_factors.WNDOI) is not None:
+            fac = CFactorWNDOI(
+                cfg=cfg,
+                factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
+                universe=proj_cfg.universe,
+                db_struct_preprocess=db_struct_cfg.preprocess,
+                db_struct_pos=db_struct_cfg.position.copy_to_another(
+                    another_db_save_dir=proj_cfg.by_instru_pos_dir),
+            )
+    elif fclass == "AMP":
+        from solutions.factorAlg import CFactorAMP
 
-            if (cfg := cfg_factors.CVP) is not None:
-                fac = CFactorCVP(
-                    cfg=cfg,
-                    factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
-                    universe=proj_cfg.universe,
-                    db_struct_preprocess=db_struct_cfg.preprocess,
-                )
-        elif fclass == "CVR":
-            from solutions.factorAlg import CFactorCVR
+        if (cfg := cfg_factors.AMP) is not None:
+            fac = CFactorAMP(
+                cfg=cfg,
+                factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
+                universe=proj_cfg.universe,
+                db_struct_preprocess=db_struct_cfg.preprocess,
+            )
+    elif fclass == "EXR":
+        from solutions.factorAlg import CFactorEXR
 
-            if (cfg := cfg_factors.CVR) is not None:
-                fac = CFactorCVR(
-                    cfg=cfg,
-                    factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
-                    universe=proj_cfg.universe,
-                    db_struct_preprocess=db_struct_cfg.preprocess,
-                )
-        elif fclass == "CSP":
-            from solutions.factorAlg import CFactorCSP
+        if (cfg := cfg_factors.EXR) is not None:
+            fac = CFactorEXR(
+                cfg=cfg,
+                factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
+                universe=proj_cfg.universe,
+                db_struct_preprocess=db_struct_cfg.preprocess,
+                db_struct_minute_bar=db_struct_cfg.minute_bar,
+            )
+    elif fclass == "SMT":
+        from solutions.factorAlg import CFactorSMT
 
-            if (cfg := cfg_factors.CSP) is not None:
-                fac = CFactorCSP(
-                    cfg=cfg,
-                    factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
-                    universe=proj_cfg.universe,
-                    db_struct_preprocess=db_struct_cfg.preprocess,
-                )
-        elif fclass == "CSR":
-            from solutions.factorAlg import CFactorCSR
+        if (cfg := cfg_factors.SMT) is not None:
+            fac = CFactorSMT(
+                cfg=cfg,
+                factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
+                universe=proj_cfg.universe,
+                db_struct_preprocess=db_struct_cfg.preprocess,
+                db_struct_minute_bar=db_struct_cfg.minute_bar,
+            )
+    elif fclass == "RWTC":
+        from solutions.factorAlg import CFactorRWTC
 
-            if (cfg := cfg_factors.CSR) is not None:
-                fac = CFactorCSR(
-                    cfg=cfg,
-                    factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
-                    universe=proj_cfg.universe,
-                    db_struct_preprocess=db_struct_cfg.preprocess,
-                )
-        elif fclass == "NOI":
-            from solutions.factorAlg import CFactorNOI
+        if (cfg := cfg_factors.RWTC) is not None:
+            fac = CFactorRWTC(
+                cfg=cfg,
+                factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
+                universe=proj_cfg.universe,
+                db_struct_preprocess=db_struct_cfg.preprocess,
+                db_struct_minute_bar=db_struct_cfg.minute_bar,
+            )
+    elif fclass == "TA":
+        from solutions.factorAlg import CFactorTA
 
-            if (cfg := cfg_factors.NOI) is not None:
-                fac = CFactorNOI(
-                    cfg=cfg,
-                    factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
-                    universe=proj_cfg.universe,
-                    db_struct_preprocess=db_struct_cfg.preprocess,
-                    db_struct_pos=db_struct_cfg.position.copy_to_another(
-                        another_db_save_dir=proj_cfg.by_instru_pos_dir),
-                )
-        elif fclass == "NDOI":
-            from solutions.factorAlg import CFactorNDOI
+        if (cfg := cfg_factors.TA) is not None:
+            fac = CFactorTA(
+                cfg=cfg,
+                warmup_multiple=ta_warmup,
+                threads=threads,
+                factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
+                universe=proj_cfg.universe,
+                db_struct_preprocess=db_struct_cfg.preprocess,
+                db_struct_minute_bar=db_struct_cfg.minute_bar,
+            )
+    else:
+        raise NotImplementedError(f"fclass = {fclass}")
+    return fac
 
-            if (cfg := cfg_factors.NDOI) is not None:
-                fac = CFactorNDOI(
-                    cfg=cfg,
-                    factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
-                    universe=proj_cfg.universe,
-                    db_struct_preprocess=db_struct_cfg.preprocess,
-                    db_struct_pos=db_struct_cfg.position.copy_to_another(
-                        another_db_save_dir=proj_cfg.by_instru_pos_dir),
-                )
-        elif fclass == "WNOI":
-            from solutions.factorAlg import CFactorWNOI
 
-            if (cfg := cfg_factors.WNOI) is not None:
-                fac = CFactorWNOI(
-                    cfg=cfg,
-                    factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
-                    universe=proj_cfg.universe,
-                    db_struct_preprocess=db_struct_cfg.preprocess,
-                    db_struct_pos=db_struct_cfg.position.copy_to_another(
-                        another_db_save_dir=proj_cfg.by_instru_pos_dir),
-                )
-        elif fclass == "WNDOI":
-            from solutions.factorAlg import CFactorWNDOI
+# modules of switches which use process pools, preloaded by workers of the shared pool
+STAGE_MODULES = {
+    "factor": "solutions.factorAlg",
+    "signals": "solutions.signals",
+    "simulations": "solutions.simulations",
+    "evaluations": "solutions.evaluations",
+    "mclrn": "solutions.mclrn_mdl_trn_prd",
+}
 
-            if (cfg := cfg_factors.WNDOI) is not None:
-                fac = CFactorWNDOI(
-                    cfg=cfg,
-                    factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
-                    universe=proj_cfg.universe,
-                    db_struct_preprocess=db_struct_cfg.preprocess,
-                    db_struct_pos=db_struct_cfg.position.copy_to_another(
-                        another_db_save_dir=proj_cfg.by_instru_pos_dir),
-                )
-        elif fclass == "AMP":
-            from solutions.factorAlg import CFactorAMP
 
-            if (cfg := cfg_factors.AMP) is not None:
-                fac = CFactorAMP(
-                    cfg=cfg,
-                    factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
-                    universe=proj_cfg.universe,
-                    db_struct_preprocess=db_struct_cfg.preprocess,
-                )
-        elif fclass == "EXR":
-            from solutions.factorAlg import CFactorEXR
+def run_switch(args: argparse.Namespace, bgn_date: str, stp_date: str, calendar, executor=None):
+    """
 
-            if (cfg := cfg_factors.EXR) is not None:
-                fac = CFactorEXR(
-                    cfg=cfg,
-                    factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
-                    universe=proj_cfg.universe,
-                    db_struct_preprocess=db_struct_cfg.preprocess,
-                    db_struct_minute_bar=db_struct_cfg.minute_bar,
-                )
-        elif fclass == "SMT":
-            from solutions.factorAlg import CFactorSMT
+    :param args: parsed arguments of one switch
+    :param calendar: CCalendar
+    :param executor: a running CPoolExecutor shared by stages, None for a new pool in each stage
+    """
+    import os
+    from project_config import proj_cfg, db_struct_cfg, cfg_factors
 
-            if (cfg := cfg_factors.SMT) is not None:
-                fac = CFactorSMT(
-                    cfg=cfg,
-                    factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
-                    universe=proj_cfg.universe,
-                    db_struct_preprocess=db_struct_cfg.preprocess,
-                    db_struct_minute_bar=db_struct_cfg.minute_bar,
-                )
-        elif fclass == "RWTC":
-            from solutions.factorAlg import CFactorRWTC
+    if args.switch == "available":
+        from solutions.available import main_available
 
-            if (cfg := cfg_factors.RWTC) is not None:
-                fac = CFactorRWTC(
-                    cfg=cfg,
-                    factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
-                    universe=proj_cfg.universe,
-                    db_struct_preprocess=db_struct_cfg.preprocess,
-                    db_struct_minute_bar=db_struct_cfg.minute_bar,
-                )
-        elif fclass == "TA":
-            from solutions.factorAlg import CFactorTA
+        main_available(
+            bgn_date=bgn_date, stp_date=stp_date,
+            universe=proj_cfg.universe,
+            cfg_avlb_unvrs=proj_cfg.avlb_unvrs,
+            db_struct_preprocess=db_struct_cfg.preprocess,
+            db_struct_avlb=db_struct_cfg.available,
+            calendar=calendar,
+        )
+    elif args.switch == "market":
+        from solutions.market import main_market
 
-            if (cfg := cfg_factors.TA) is not None:
-                fac = CFactorTA(
-                    cfg=cfg,
-                    factors_by_instru_dir=proj_cfg.factors_by_instru_dir,
-                    universe=proj_cfg.universe,
-                    db_struct_preprocess=db_struct_cfg.preprocess,
-                    db_struct_minute_bar=db_struct_cfg.minute_bar,
-                )
-        else:
-            raise NotImplementedError(f"fclass = {args.fclass}")
+        main_market(
+            bgn_date=bgn_date, stp_date=stp_date,
+            calendar=calendar,
+            db_struct_avlb=db_struct_cfg.available,
+            db_struct_mkt=db_struct_cfg.market,
+            path_mkt_idx_data=proj_cfg.market_index_path,
+            mkt_idxes=list(proj_cfg.mkt_idxes.values()),
+            sectors=proj_cfg.const.SECTORS,
+        )
+    elif args.switch == "test_return":
+        from solutions.test_return import main_test_returns
+
+        main_test_returns(
+            wins=proj_cfg.test_rets_wins,
+            lag=proj_cfg.const.LAG,
+            universe=proj_cfg.universe,
+            db_tst_ret_save_dir=proj_cfg.test_return_dir,
+            db_struct_preprocess=db_struct_cfg.preprocess,
+            db_struct_avlb=db_struct_cfg.available,
+            bgn_date=bgn_date,
+            stp_date=stp_date,
+            calendar=calendar,
+            call_multiprocess=not args.nomp,
+            processes=args.processes,
+            executor=executor,
+        )
+    elif args.switch == "factor":
+        fclasses = parse_fclasses(args.fclass)
+        # --nomp means one core, factors calculated for all instruments at once use one thread too
+        threads = 1 if args.nomp else args.processes
+        factors = [
+            fac for fclass in fclasses
+            if (fac := get_factor(fclass, ta_warmup=args.ta_warmup, threads=threads)) is not None
+        ]
 
-        if fac is not None:
-            from solutions.factor import CFactorNeu
+        if factors:
+            from solutions.factor import CFactorNeu, main_raw_for_classes
 
             # --- raw factors
-            fac.main_raw(
-                bgn_date=bgn_date, stp_date=stp_date, calendar=calendar,
-                call_multiprocess=not args.nomp, processes=args.processes,
-            )
+            if len(factors) == 1:
+                factors[0].main_raw(
+                    bgn_date=bgn_date, stp_date=stp_date, calendar=calendar,
+                    call_multiprocess=not args.nomp, processes=args.processes, executor=executor,
+                )
+            else:
+                main_raw_for_classes(
+                    factors=factors, bgn_date=bgn_date, stp_date=stp_date, calendar=calendar,
+                    call_multiprocess=not args.nomp, processes=args.processes, executor=executor,
+                )
 
             # --- Neutralization
-            neutralizer = CFactorNeu(
-                ref_factor=fac,
-                universe=proj_cfg.universe,
-                db_struct_preprocess=db_struct_cfg.preprocess,
-                db_struct_avlb=db_struct_cfg.available,
-                neutral_by_instru_dir=proj_cfg.neutral_by_instru_dir,
-            )
-            neutralizer.main_neu(bgn_date=bgn_date, stp_date=stp_date, calendar=calendar)
+            for fac in factors:
+                neutralizer = CFactorNeu(
+                    ref_factor=fac,
+                    universe=proj_cfg.universe,
+                    db_struct_preprocess=db_struct_cfg.preprocess,
+                    db_struct_avlb=db_struct_cfg.available,
+                    neutral_by_instru_dir=proj_cfg.neutral_by_instru_dir,
+                )
+                neutralizer.main_neu(bgn_date=bgn_date, stp_date=stp_date, calendar=calendar)
     elif args.switch == "signals":
         if args.type == "facNeu":
             from solutions.signals import main_signals_from_factor_neu, main_signals_from_opt
@@ -432,6 +524,7 @@ if __name__ == "__main__":
                 calendar=calendar,
                 call_multiprocess=not args.nomp,
                 processes=args.processes,
+                executor=executor,
             )
         elif args.type == "mdlPrd":
             from solutions.mclrn_mdl_parser import load_config_models
@@ -525,6 +618,7 @@ if __name__ == "__main__":
                 calendar=calendar,
                 call_multiprocess=not args.nomp,
                 processes=args.processes,
+                executor=executor,
             )
         elif args.type == "mdlPrd":
             from solutions.mclrn_mdl_parser import load_config_models
@@ -547,6 +641,7 @@ if __name__ == "__main__":
                 calendar=calendar,
                 call_multiprocess=not args.nomp,
                 processes=args.processes,
+                executor=executor,
             )
         elif args.type == "mdlOpt":
             from solutions.shared import get_sim_args_mdl_opt
@@ -566,6 +661,7 @@ if __name__ == "__main__":
                 calendar=calendar,
                 call_multiprocess=not args.nomp,
                 processes=args.processes,
+                executor=executor,
             )
         elif args.type == "grpOpt":
             from solutions.shared import get_sim_args_grp_opt
@@ -584,6 +680,7 @@ if __name__ == "__main__":
                 calendar=calendar,
                 call_multiprocess=not args.nomp,
                 processes=args.processes,
+                executor=executor,
             )
         else:
             raise ValueError(f"args.type == {args.type} is illegal")
@@ -613,6 +710,7 @@ if __name__ == "__main__":
                 stp_date=stp_date,
                 call_multiprocess=not args.nomp,
                 processes=args.processes,
+                executor=executor,
             )
             # plot by group
             grouped_sim_args = group_sim_args_by_factor_class(sim_args_list, cfg_factors.get_mapper_name_to_class_neu())
@@ -648,6 +746,7 @@ if __name__ == "__main__":
                 stp_date=stp_date,
                 call_multiprocess=not args.nomp,
                 processes=args.processes,
+                executor=executor,
             )
             grouped_sim_args = group_sim_args_by_factor_group(sim_args_list)
             main_plt_grouped_sim_args(
@@ -678,6 +777,7 @@ if __name__ == "__main__":
                 stp_date=stp_date,
                 call_multiprocess=not args.nomp,
                 processes=args.processes,
+                executor=executor,
             )
             grouped_sim_args = group_sim_args_by_ret_prc(sim_args_list)
             main_plt_grouped_sim_args(
@@ -707,6 +807,7 @@ if __name__ == "__main__":
                 stp_date=stp_date,
                 call_multiprocess=not args.nomp,
                 processes=args.processes,
+                executor=executor,
             )
             plot_sim_args_list(
                 fig_name="Cls.Opn",
@@ -752,6 +853,7 @@ if __name__ == "__main__":
                 call_multiprocess=not args.nomp,
                 processes=args.processes,
                 verbose=args.verbose,
+                executor=executor,
             )
         else:
             raise ValueError(f"args.type == {args.type} is illegal")
@@ -803,3 +905,83 @@ if __name__ == "__main__":
             raise ValueError(f"args.type == {args.type} is illegal")
     else:
         raise ValueError(f"args.switch = {args.switch} is illegal")
+    return 0
+
+
+def run_stages(args: argparse.Namespace, bgn_date: str, stp_date: str, calendar):
+    """
+    Run switches in args.stages one by one, in one process. Workers of the pool are
+    started only once, with modules of all stages and the calendar preloaded.
+
+    """
+    from solutions.executor import CPoolExecutor
+
+    global_argv = ["--bgn", args.bgn]
+    global_argv += ["--stp", args.stp] if args.stp else []
+    global_argv += ["--processes", str(args.processes)] if args.processes else []
+    global_argv += ["--nomp"] if args.nomp else []
+    global_argv += ["--verbose"] if args.verbose else []
+    stages = [parse_args(global_argv + shlex.split(stage)) for stage in args.stages.split(";") if stage.strip()]
+    if any(stage.switch in ("stages", "pipeline") for stage in stages):
+        raise ValueError("switch 'stages' or 'pipeline' can not be nested in stages")
+
+    if args.nomp:
+        for stage in stages:
+            run_switch(stage, bgn_date, stp_date, calendar)
+    else:
+        modules = tuple(dict.fromkeys(STAGE_MODULES[z.switch] for z in stages if z.switch in STAGE_MODULES))
+        with CPoolExecutor(processes=args.processes, modules=modules, shared={"calendar": calendar}) as executor:
+            for stage in stages:
+                run_switch(stage, bgn_date, stp_date, calendar, executor=executor)
+    return 0
+
+
+def run_pipeline(args: argparse.Namespace, stp_date: str) -> int:
+    """
+
+    :return: number of failed nodes
+    """
+    import os
+    import multiprocessing as mp
+    from project_config import proj_cfg, cfg_factors
+    from solutions.pipeline import CPipeline, CStamps, gen_pipeline_nodes, select_nodes
+
+    cores = args.cores or mp.cpu_count()
+    bgn_dates = {"raw": args.bgn} | {k: max(args.bgn, getattr(args, f"bgn_{k}")) for k in PIPELINE_BGN_DATES}
+    nodes = gen_pipeline_nodes(
+        fclasses=[z for z in FACTOR_CLASSES if getattr(cfg_factors, z) is not None],
+        bgn_dates=bgn_dates,
+        cores=cores,
+        factor_cores=min(args.factor_cores, cores),
+    )
+    if args.since:
+        nodes = select_nodes(nodes, since=args.since.split(","))
+    pipeline = CPipeline(
+        nodes=nodes,
+        script=os.path.abspath(__file__),
+        stp_date=stp_date,
+        cores=cores,
+        stamps=CStamps(os.path.join(proj_cfg.project_root_dir, "pipeline")),
+        verbose=args.verbose,
+    )
+    return pipeline.run(force=args.force or bool(args.since), dry_run=args.dry_run)
+
+
+if __name__ == "__main__":
+    from project_config import proj_cfg
+    from husfort.qlog import define_logger
+    from husfort.qcalendar import CCalendar
+
+    define_logger()
+
+    calendar = CCalendar(proj_cfg.calendar_path)
+    args = parse_args()
+    bgn_date, stp_date = args.bgn, args.stp or calendar.get_next_date(args.bgn, shift=1)
+
+    if args.switch == "stages":
+        run_stages(args, bgn_date, stp_date, calendar)
+    elif args.switch == "pipeline":
+        if run_pipeline(args, stp_date) > 0:
+            raise SystemExit(1)
+    else:
+        run_switch(args, bgn_date, stp_date, calendar)
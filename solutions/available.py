@@ -1,12 +1,15 @@
+import numpy as np
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from husfort.qutility import check_and_makedirs
 from husfort.qcalendar import CCalendar
-from husfort.qsqlite import CDbStruct, CMgrSqlDb
+from husfort.qsqlite import CDbStruct
 from typedef import TUniverse, CCfgAvlbUnvrs
+from solutions.storage import gen_db_mgr
 
 
 def load_major(db_struct_instru: CDbStruct, bgn_date: str, stp_date: str) -> pd.DataFrame:
-    sqldb = CMgrSqlDb(
+    sqldb = gen_db_mgr(
         db_save_dir=db_struct_instru.db_save_dir,
         db_name=db_struct_instru.db_name,
         table=db_struct_instru.table,
@@ -22,17 +25,15 @@ def reformat(raw_data: pd.DataFrame) -> pd.DataFrame:
     ).set_index("trade_date")
 
 
-def get_available_universe_by_date(x: pd.Series, ret_df: pd.DataFrame, amt_df: pd.DataFrame) -> pd.DataFrame:
-    # x is a Series like this: pd.Series({"cu":True, "CY":False}, name="20120104")
-    trade_date: str = x.name  # type:ignore
-    sub_available_universe_df = pd.DataFrame(
-        {
-            "return": ret_df.loc[trade_date, x],  # type:ignore
-            "amount": amt_df.loc[trade_date, x],  # type:ignore
-        }
-    )
-    sub_available_universe_df["trade_date"] = trade_date
-    return sub_available_universe_df
+def load_major_by_universe(
+        db_struct_preprocess: CDbStruct, universe: TUniverse, bgn_date: str, stp_date: str, threads: int = None,
+) -> dict[str, pd.DataFrame]:
+    def load_by_instru(instru: str) -> pd.DataFrame:
+        db_struct_instru = db_struct_preprocess.copy_to_another(another_db_name=f"{instru}.db")
+        return load_major(db_struct_instru=db_struct_instru, bgn_date=bgn_date, stp_date=stp_date)
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        return dict(zip(universe, executor.map(load_by_instru, universe)))
 
 
 def get_available_universe(
@@ -45,28 +46,39 @@ def get_available_universe(
         calendar: CCalendar,
 ) -> pd.DataFrame:
     win_start_date = calendar.get_next_date(bgn_date, -cfg_avlb_unvrs.win + 1)
+    major_data = load_major_by_universe(db_struct_preprocess, universe, bgn_date=win_start_date, stp_date=stp_date)
     amt_data, amt_ma_data, return_data = {}, {}, {}
-    for instru in universe:
-        db_struct_instru = db_struct_preprocess.copy_to_another(another_db_name=f"{instru}.db")
-        instru_major_data = load_major(db_struct_instru=db_struct_instru, bgn_date=win_start_date, stp_date=stp_date)
+    for instru, instru_major_data in major_data.items():
         selected_major_data = reformat(instru_major_data)
         amt_ma_data[instru] = selected_major_data["amount"].fillna(0).rolling(window=cfg_avlb_unvrs.win).mean()
         amt_data[instru] = selected_major_data["amount"].fillna(0)
         return_data[instru] = selected_major_data["return"]
     amt_df, amt_ma_df, return_df = pd.DataFrame(amt_data), pd.DataFrame(amt_ma_data), pd.DataFrame(return_data)
 
-    # --- reorganize and save
+    # --- stack available (date, instrument) by one boolean index, in order of date then universe
     filter_df: pd.DataFrame = amt_ma_df.ge(cfg_avlb_unvrs.amount_threshold)
     filter_df = filter_df.truncate(before=bgn_date)
-    res = filter_df.apply(get_available_universe_by_date, args=(return_df, amt_df), axis=1)  # type:ignore
-    update_df: pd.DataFrame = pd.concat(res.tolist(), axis=0, ignore_index=False).reset_index()
-    update_df = update_df.rename(mapper={"index": "instrument"}, axis=1)
+    offset = len(amt_ma_df) - len(filter_df)
+    row_ids, col_ids = np.nonzero(filter_df.to_numpy())
+    instruments = list(universe)
+    update_df = pd.DataFrame({
+        "trade_date": filter_df.index.to_numpy()[row_ids],
+        "instrument": pd.Categorical.from_codes(col_ids, categories=instruments),
+        "return": return_df[instruments].to_numpy(np.float64)[row_ids + offset, col_ids],
+        "amount": amt_df[instruments].to_numpy(np.float64)[row_ids + offset, col_ids],
+    })
     update_df = update_df.sort_values(by=["trade_date", "amount"], ascending=[True, False])
-    update_df = update_df[["trade_date", "instrument", "return", "amount"]]
 
     # --- add section
-    update_df["sectorL0"] = update_df["instrument"].map(lambda z: universe[z].sectorL0)
-    update_df["sectorL1"] = update_df["instrument"].map(lambda z: universe[z].sectorL1)
+    sectors = pd.DataFrame(
+        {
+            "sectorL0": [universe[z].sectorL0 for z in instruments],
+            "sectorL1": [universe[z].sectorL1 for z in instruments],
+        },
+        index=pd.CategoricalIndex(instruments, categories=instruments, name="instrument"),
+    )
+    update_df = update_df.join(sectors, on="instrument")
+    update_df["instrument"] = update_df["instrument"].astype(str)
     update_df = update_df.sort_values(by=["trade_date", "sectorL1"], ascending=True)
     return update_df[db_struct_avlb.table.vars.names]
 
@@ -81,7 +93,7 @@ def main_available(
         calendar: CCalendar,
 ):
     check_and_makedirs(db_struct_avlb.db_save_dir)
-    sqldb = CMgrSqlDb(
+    sqldb = gen_db_mgr(
         db_save_dir=db_struct_avlb.db_save_dir,
         db_name=db_struct_avlb.db_name,
         table=db_struct_avlb.table,
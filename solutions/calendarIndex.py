@@ -0,0 +1,111 @@
+import functools
+import numpy as np
+from husfort.qcalendar import CCalendar
+
+"""
+-------------------------------------------------------------
+Part I: integer positions of trade dates, so shifting dates,
+        finding month ends and grouping dates by month are
+        array operations instead of a call of calendar for
+        each date.
+-------------------------------------------------------------
+"""
+
+
+class CCalendarIndex:
+    def __init__(self, calendar: CCalendar):
+        self.trade_dates: np.ndarray = np.array(calendar.get_iter_list("00000101", "99991231"), dtype=object)
+        self.trade_ints: np.ndarray = self.trade_dates.astype(np.int64)  # YYYYMMDD as int, for searching
+        self.ordinals: dict[str, int] = {d: i for i, d in enumerate(self.trade_dates)}
+        months = self.trade_ints // 100
+        # True if the next trade date is in another month, the last trade date is unknown
+        self.is_month_end: np.ndarray = np.append(months[:-1] != months[1:], False)
+
+    def ordinal(self, date: str) -> int:
+        try:
+            return self.ordinals[date]
+        except KeyError:
+            raise ValueError(f"{date} is not a trade date")
+
+    def ordinals_of(self, dates: np.ndarray | list[str]) -> np.ndarray:
+        """
+
+        :param dates: 1-D array of trade dates with format YYYYMMDD, in any order
+        :return: 1-D int array, positions of dates in trade dates
+        """
+        date_ints = np.asarray(dates, dtype=object).astype(np.int64)
+        pos = np.searchsorted(self.trade_ints, date_ints)
+        bad = pos >= len(self.trade_ints)
+        bad[~bad] = self.trade_ints[pos[~bad]] != date_ints[~bad]
+        if bad.any():
+            raise ValueError(f"{date_ints[bad][:5].tolist()} are not trade dates")
+        return pos
+
+    def at(self, pos: np.ndarray) -> np.ndarray:
+        if len(pos) > 0 and (pos.min() < 0 or pos.max() >= len(self.trade_dates)):
+            raise IndexError(f"shifted dates are out of calendar [{self.trade_dates[0]}, {self.trade_dates[-1]}]")
+        return self.trade_dates[pos]
+
+    def next_date(self, date: str, shift: int = 1) -> str:
+        """
+        the same as calendar.get_next_date, with a dict lookup instead of a search in the calendar
+
+        """
+        pos = self.ordinal(date) + shift
+        if not 0 <= pos < len(self.trade_dates):
+            raise IndexError(f"{date} shifted by {shift} is out of calendar")
+        return str(self.trade_dates[pos])
+
+    def shift(self, dates: np.ndarray | list[str], shift: int) -> np.ndarray:
+        """
+
+        :return: 1-D object array of str, calendar.get_next_date(z, shift) of each date in dates
+        """
+        return self.at(self.ordinals_of(dates) + shift)
+
+    def window_start(self, dates: np.ndarray | list[str], win: int) -> np.ndarray:
+        """
+
+        :return: first dates of windows with win trade dates ending at each date in dates
+        """
+        return self.shift(dates, -win + 1)
+
+    def month_ends(self, bgn_date: str, stp_date: str) -> list[str]:
+        """
+
+        :return: trade dates in [bgn_date, stp_date) whose next trade date is in another month,
+                 like calendar.get_last_days_in_range
+        """
+        i0, i1 = np.searchsorted(self.trade_ints, [int(bgn_date), int(stp_date)])
+        return self.trade_dates[i0:i1][self.is_month_end[i0:i1]].tolist()
+
+    def last_day_of_month(self, month: str) -> str:
+        """
+
+        :param month: like "202401"
+        """
+        i0, i1 = np.searchsorted(self.trade_ints, [int(month) * 100, int(month) * 100 + 99])
+        if i0 == i1:
+            raise ValueError(f"There is no trade date in {month}")
+        return self.trade_dates[i1 - 1]
+
+    @staticmethod
+    def split_by_month(dates: np.ndarray | list[str]) -> dict[str, list[str]]:
+        """
+
+        :param dates: 1-D array of sorted dates with format YYYYMMDD
+        :return: a dict with key = month, like "202401", value = dates in that month
+        """
+        dates = np.asarray(dates, dtype=object)
+        months = dates.astype(np.int64) // 100
+        bgn_idx = np.flatnonzero(np.diff(months, prepend=-1))
+        return {str(months[i]): d.tolist() for i, d in zip(bgn_idx, np.split(dates, bgn_idx[1:]))}
+
+
+@functools.lru_cache(maxsize=8)
+def get_calendar_index(calendar: CCalendar) -> CCalendarIndex:
+    """
+    the index of each calendar is built only once in a process
+
+    """
+    return CCalendarIndex(calendar)
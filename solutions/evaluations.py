@@ -1,28 +1,37 @@
 import os
-import multiprocessing as mp
+import numpy as np
 import pandas as pd
-from rich.progress import track, Progress
-from husfort.qutility import error_handler, check_and_makedirs
+from rich.progress import track
+from husfort.qutility import check_and_makedirs
 from husfort.qevaluation import CNAV
-from husfort.qsqlite import CMgrSqlDb, CDbStruct
+from husfort.qsqlite import CDbStruct
 from husfort.qplot import CPlotLines
+from solutions.storage import gen_db_mgr
 from solutions.shared import gen_nav_db
+from solutions.executor import CPoolExecutor, use_executor
 from typedef import CSimArgs, TSimGrpIdByFacNeu, TSimGrpIdByFacGrp, TRetPrc
 
 
+"""
+------------------------------------------------
+Part I: evaluation for each sim, with CNAV
+------------------------------------------------
+"""
+
+
 class CEvl:
     def __init__(self, db_struct_nav: CDbStruct):
         self.db_struct_nav = db_struct_nav
         self.indicators = ("hpr", "retMean", "retStd", "retAnnual", "volAnnual", "sharpe", "calmar", "mdd")
 
-    def load(self, bgn_date: str, stp_date: str) -> pd.DataFrame:
-        sqldb = CMgrSqlDb(
+    def load(self, bgn_date: str, stp_date: str, value_columns: list[str] = None) -> pd.DataFrame:
+        sqldb = gen_db_mgr(
             db_save_dir=self.db_struct_nav.db_save_dir,
             db_name=self.db_struct_nav.db_name,
             table=self.db_struct_nav.table,
             mode="r"
         )
-        nav_data = sqldb.read_by_range(bgn_date, stp_date)
+        nav_data = sqldb.read_by_range(bgn_date, stp_date, value_columns=value_columns)
         return nav_data
 
     def add_arguments(self, res: dict):
@@ -35,7 +44,7 @@ class CEvl:
         :param stp_date:
         :return: a pd.Series, with string index
         """
-        nav_data = self.load(bgn_date, stp_date)
+        nav_data = self.load(bgn_date, stp_date, value_columns=["trade_date", "net_ret"])
         ret_srs = nav_data.set_index("trade_date")["net_ret"]
         return ret_srs
 
@@ -123,6 +132,19 @@ class CEvlGrpOpt(CEvlFrmSim):
         return 0
 
 
+def get_evl_class(sim_type: str) -> type[CEvlFrmSim]:
+    if sim_type == "facNeu":
+        return CEvlFacNeu
+    elif sim_type == "mdlPrd":
+        return CEvlMdlPrd
+    elif sim_type == "mdlOpt":
+        return CEvlMdlOpt
+    elif sim_type == "grpOpt":
+        return CEvlGrpOpt
+    else:
+        raise ValueError(f"sim type = {sim_type} is illegal")
+
+
 def process_for_evl_frm_sim(
         sim_type: str,
         sim_args: CSimArgs,
@@ -130,19 +152,98 @@ def process_for_evl_frm_sim(
         bgn_date: str,
         stp_date: str,
 ) -> dict:
-    if sim_type == "facNeu":
-        s = CEvlFacNeu(sim_args, sim_save_dir=sim_save_dir)
-    elif sim_type == "mdlPrd":
-        s = CEvlMdlPrd(sim_args, sim_save_dir=sim_save_dir)
-    elif sim_type == "mdlOpt":
-        s = CEvlMdlOpt(sim_args, sim_save_dir=sim_save_dir)
-    elif sim_type == "grpOpt":
-        s = CEvlGrpOpt(sim_args, sim_save_dir=sim_save_dir)
-    else:
-        raise ValueError(f"sim type = {sim_type} is illegal")
+    s = get_evl_class(sim_type)(sim_args, sim_save_dir=sim_save_dir)
     return s.main(bgn_date, stp_date)
 
 
+"""
+------------------------------------------------------------------
+Part II: batch evaluation. Net returns of many sims are loaded to
+         one matrix of dates x sims, and indicators of all sims are
+         calculated column-wise, with the same definitions as CNAV
+------------------------------------------------------------------
+"""
+
+
+def cal_nav_indicators(ret: np.ndarray, annual_factor: int = 250) -> dict[str, np.ndarray]:
+    """
+
+    :param ret: 2-D array of dates x sims, net return of each sim, nan for dates out of a sim
+    :param annual_factor:
+    :return: a dict, with key = indicator, value = 1-D array of sims
+    """
+    ret = np.asfortranarray(ret)  # each sim is contiguous, sums are pairwise like pd.Series.mean
+    mask = ~np.isnan(ret)
+    obs = mask.sum(axis=0)
+    if (obs == 0).any():
+        raise ValueError(f"There are no returns for sims at columns {np.flatnonzero(obs == 0).tolist()}")
+    ret_filled = np.where(mask, ret, 0)
+    ret_mean = ret_filled.sum(axis=0) / obs
+    # std is nan for sims with only one return, like pd.Series.std
+    sum_sq = (np.where(mask, ret - ret_mean, 0) ** 2).sum(axis=0)
+    ret_std = np.sqrt(np.divide(sum_sq, obs - 1, out=np.full(len(obs), np.nan), where=obs > 1))
+    nav = np.cumprod(1 + ret_filled, axis=0)  # nav is kept on dates out of a sim
+    started = np.logical_or.accumulate(mask, axis=0)
+    nav_max = np.maximum.accumulate(np.where(started, nav, 0), axis=0)  # max from the first date of each sim
+    mdd = (1 - nav / np.where(started, nav_max, nav)).max(axis=0)
+    ret_annual = ret_mean * annual_factor
+    vol_annual = ret_std * np.sqrt(annual_factor)
+    return {
+        "hpr": nav[-1] - 1,
+        "retMean": ret_mean,
+        "retStd": ret_std,
+        "retAnnual": ret_annual,
+        "volAnnual": vol_annual,
+        "sharpe": ret_annual / vol_annual,
+        "calmar": ret_annual / mdd,
+        "mdd": mdd,
+    }
+
+
+class CEvlBatch:
+    def __init__(self, sim_type: str, sim_args_list: list[CSimArgs], sim_save_dir: str):
+        evl_class = get_evl_class(sim_type)
+        self.evls = [evl_class(sim_args, sim_save_dir=sim_save_dir) for sim_args in sim_args_list]
+
+    def load_ret(self, bgn_date: str, stp_date: str) -> pd.DataFrame:
+        """
+
+        :return: a pd.DataFrame, with index = trade_date, columns = sim ids
+        """
+        ret_data = pd.DataFrame({evl.sim_args.sim_id: evl.get_ret(bgn_date, stp_date) for evl in self.evls})
+        return ret_data.sort_index()
+
+    def main(self, bgn_date: str, stp_date: str) -> list[dict]:
+        ret_data = self.load_ret(bgn_date, stp_date)
+        if (empty := ret_data.columns[ret_data.notna().sum() == 0]).size > 0:
+            raise ValueError(f"There are no returns in [{bgn_date}, {stp_date}) for sims: {empty.tolist()}")
+        indicators = cal_nav_indicators(ret_data.to_numpy(dtype=np.float64))
+        res_list = []
+        for j, evl in enumerate(self.evls):
+            res = {k: float(indicators[k][j]) for k in evl.indicators}
+            evl.add_arguments(res)
+            res_list.append(res)
+        return res_list
+
+
+def process_for_evl_batch(
+        sim_type: str,
+        sim_args_list: list[CSimArgs],
+        sim_save_dir: str,
+        bgn_date: str,
+        stp_date: str,
+) -> list[dict]:
+    evl_batch = CEvlBatch(sim_type, sim_args_list, sim_save_dir=sim_save_dir)
+    return evl_batch.main(bgn_date, stp_date)
+
+
+"""
+-------------------------------
+Part III: evaluate simulations
+-------------------------------
+"""
+
+
 def main_evl_sims(
         sim_type: str,
         sim_args_list: list[CSimArgs],
@@ -155,25 +256,59 @@ def main_evl_sims(
         stp_date: str,
         call_multiprocess: bool,
         processes: int,
+        executor: CPoolExecutor | None = None,
+        sims_per_batch: int = 500,
 ):
+    """
+
+    :param executor: a running pool shared by stages. If None, a new pool is started for this stage.
+    :param sims_per_batch: max number of sims evaluated in a batch. Batches are split evenly to processes
+                           if call_multiprocess. 0 to evaluate one by one with CNAV.
+    """
     desc = "Calculating evaluations for simulations"
     evl_sims: list[dict] = []
-    if call_multiprocess:
-        with Progress() as pb:
-            main_task = pb.add_task(description=desc, total=len(sim_args_list))
-            with mp.get_context("spawn").Pool(processes=processes) as pool:
-                jobs = []
-                for sim_args in sim_args_list:
-                    job = pool.apply_async(
-                        process_for_evl_frm_sim,
-                        args=(sim_type, sim_args, sim_save_dir, bgn_date, stp_date),
-                        callback=lambda _: pb.update(main_task, advance=1),
-                        error_callback=error_handler,
-                    )
-                    jobs.append(job)
-                pool.close()
-                pool.join()
-            evl_sims = [job.get() for job in jobs]
+    if sims_per_batch > 0:
+        if call_multiprocess:
+            with use_executor(executor, processes) as pool_executor:
+                # at least one batch for each process, sims keep their order
+                size = max(min(sims_per_batch, -(-len(sim_args_list) // pool_executor.processes)), 1)
+                batches = [sim_args_list[i:i + size] for i in range(0, len(sim_args_list), size)]
+                res = pool_executor.run(
+                    process_for_evl_batch,
+                    [
+                        {
+                            "sim_type": sim_type,
+                            "sim_args_list": batch,
+                            "sim_save_dir": sim_save_dir,
+                            "bgn_date": bgn_date,
+                            "stp_date": stp_date,
+                        } for batch in batches
+                    ],
+                    description=desc,
+                    raise_on_error=True,
+                )
+            evl_sims = [evl for evls in res for evl in evls]
+        else:
+            batches = [sim_args_list[i:i + sims_per_batch] for i in range(0, len(sim_args_list), sims_per_batch)]
+            for batch in track(batches, description=desc):
+                evl_sims.extend(process_for_evl_batch(sim_type, batch, sim_save_dir, bgn_date, stp_date))
+    elif call_multiprocess:
+        with use_executor(executor, processes) as pool_executor:
+            res = pool_executor.run(
+                process_for_evl_frm_sim,
+                [
+                    {
+                        "sim_type": sim_type,
+                        "sim_args": sim_args,
+                        "sim_save_dir": sim_save_dir,
+                        "bgn_date": bgn_date,
+                        "stp_date": stp_date,
+                    } for sim_args in sim_args_list
+                ],
+                description=desc,
+                raise_on_error=True,
+            )
+        evl_sims = res
     else:
         for sim_args in track(sim_args_list, description=desc):
             evl = process_for_evl_frm_sim(sim_type, sim_args, sim_save_dir, bgn_date, stp_date)
@@ -196,9 +331,9 @@ def main_evl_sims(
 
 
 """
-------------
---- plot ---
-------------
+------------------
+Part IV: plot
+------------------
 """
 
 
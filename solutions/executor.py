@@ -0,0 +1,190 @@
+import time
+import importlib
+import multiprocessing as mp
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Iterator
+from loguru import logger
+from rich.progress import Progress
+from husfort.qutility import SFY, error_handler
+
+"""
+-----------------------------------------------------------------
+Part I: worker side. Workers are started once, import modules and
+        keep shared objects, like the calendar, before any task.
+        Tasks get shared objects by name instead of pickling them
+        again and again.
+-----------------------------------------------------------------
+"""
+
+# modules imported by workers of every pool
+PRELOAD_MODULES = ("numpy", "pandas")
+
+_shared: dict[str, Any] = {}
+
+
+def init_worker(modules: tuple[str, ...], shared: dict[str, Any]):
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass  # tasks needing it will fail with a clear error later
+    _shared.update(shared)
+
+
+# (index, function, kwargs, names of shared objects, submitted time)
+TTask = tuple[int, Callable, dict[str, Any], tuple[str, ...], float]
+
+# (index, result, error, queue wait, compute time)
+TTaskRes = tuple[int, Any, BaseException | None, float, float]
+
+
+def ping(_: int) -> int:
+    return 0
+
+
+def run_task(task: TTask) -> TTaskRes:
+    idx, func, kwargs, shared_kwargs, t_submit = task
+    t_start = time.time()
+    try:
+        res, err = func(**kwargs, **{k: _shared[k] for k in shared_kwargs}), None
+    except Exception as e:
+        res, err = None, e
+    return idx, res, err, t_start - t_submit, time.time() - t_start
+
+
+"""
+--------------------------------------------------------
+Part II: pool shared by all stages of one invocation
+--------------------------------------------------------
+"""
+
+
+@dataclass
+class CStageStats:
+    stage: str
+    tasks: int
+    chunksize: int
+    wall: float = 0  # seconds from the first submission to the last result
+    compute: float = 0  # sum of seconds spent in tasks
+    queue_wait: float = 0  # sum of seconds from submission to start of tasks
+    max_queue_wait: float = 0
+    errors: int = 0
+
+    def __str__(self) -> str:
+        mean_wait = self.queue_wait / max(self.tasks, 1)
+        return (
+            f"{self.stage}: tasks = {self.tasks}, chunksize = {self.chunksize}, wall = {self.wall:.2f}s, "
+            f"compute = {self.compute:.2f}s, queue wait = {self.queue_wait:.2f}s "
+            f"(mean = {mean_wait:.3f}s, max = {self.max_queue_wait:.2f}s), errors = {self.errors}"
+        )
+
+
+class CPoolExecutor:
+    def __init__(
+            self,
+            processes: int | None = None,
+            modules: tuple[str, ...] = (),
+            shared: dict[str, Any] | None = None,
+    ):
+        """
+
+        :param processes: number of worker processes, None for cpu count
+        :param modules: modules imported by workers at start, besides PRELOAD_MODULES
+        :param shared: objects sent to workers only once, like {"calendar": calendar}
+        """
+        self.processes = processes or mp.cpu_count()
+        self.modules = PRELOAD_MODULES + tuple(modules)
+        self.shared = shared or {}
+        self.pool = None
+        self.stats: list[CStageStats] = []
+
+    def __enter__(self) -> "CPoolExecutor":
+        t0 = time.time()
+        self.pool = mp.get_context("spawn").Pool(
+            self.processes, initializer=init_worker, initargs=(self.modules, self.shared),
+        )
+        # wait until workers are up, so start-up is not counted as queue wait of the first stage
+        self.pool.map(ping, range(self.processes), chunksize=1)
+        logger.info(f"Started {SFY(self.processes)} workers in {SFY(f'{time.time() - t0:.2f}')}s")
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.pool.close()
+        self.pool.join()
+        self.pool = None
+        if len(self.stats) > 1:
+            self.report()
+
+    def get_chunksize(self, n: int) -> int:
+        # the same as Pool.map, about 4 chunks for each worker
+        chunksize, extra = divmod(n, self.processes * 4)
+        return chunksize + 1 if extra else max(chunksize, 1)
+
+    def run(
+            self,
+            func: Callable,
+            kwargs_list: list[dict[str, Any]],
+            shared_kwargs: tuple[str, ...] = (),
+            description: str = "Running tasks",
+            chunksize: int | None = None,
+            raise_on_error: bool = False,
+    ) -> list:
+        """
+        Run func(**kwargs, **shared) for each kwargs in kwargs_list in the pool,
+        errors are passed to error_handler and do not stop other tasks.
+
+        :param func: must be picklable, a function defined at module level or a bound method
+        :param kwargs_list:
+        :param shared_kwargs: names of objects in shared, which are also passed to func
+        :param description: description of the progress bar, also the stage name in the report
+        :param chunksize: number of tasks sent to a worker at once, default is like Pool.map
+        :param raise_on_error: raise a RuntimeError after all tasks are finished if any task failed,
+                               for stages whose results must be complete
+        :return: results of func in the order of kwargs_list, None for failed tasks
+        """
+        chunksize = chunksize or self.get_chunksize(len(kwargs_list))
+        stats = CStageStats(stage=description, tasks=len(kwargs_list), chunksize=chunksize)
+        res: list = [None] * len(kwargs_list)
+        t0 = time.time()
+        # tasks are stamped when the pool takes them from this generator
+        tasks = ((i, func, kwargs, shared_kwargs, time.time()) for i, kwargs in enumerate(kwargs_list))
+        with Progress() as pb:
+            main_task = pb.add_task(description=description, total=len(kwargs_list))
+            for idx, r, err, queue_wait, compute in self.pool.imap_unordered(run_task, tasks, chunksize=chunksize):
+                if err is not None:
+                    stats.errors += 1
+                    error_handler(err)
+                res[idx] = r
+                stats.compute += compute
+                stats.queue_wait += queue_wait
+                stats.max_queue_wait = max(stats.max_queue_wait, queue_wait)
+                pb.update(main_task, advance=1)
+        stats.wall = time.time() - t0
+        self.stats.append(stats)
+        logger.info(str(stats))
+        if raise_on_error and stats.errors > 0:
+            raise RuntimeError(f"{stats.errors} of {stats.tasks} tasks failed in {description}")
+        return res
+
+    def report(self):
+        logger.info(f"Time of {SFY(len(self.stats))} stages in the pool of {SFY(self.processes)} workers:")
+        for stats in self.stats:
+            logger.info(str(stats))
+
+
+@contextmanager
+def use_executor(
+        executor: CPoolExecutor | None, processes: int | None, shared: dict[str, Any] | None = None,
+) -> Iterator[CPoolExecutor]:
+    """
+
+    :param executor: a running executor shared by stages, it is used if not None
+    :param processes: number of processes of a new executor for this stage only
+    :param shared: shared objects of the new executor
+    """
+    if executor is not None:
+        yield executor
+    else:
+        with CPoolExecutor(processes=processes, shared=shared) as new_executor:
+            yield new_executor
@@ -1,12 +1,20 @@
+import os
 import numpy as np
 import pandas as pd
-import multiprocessing as mp
-from rich.progress import track, Progress
-from husfort.qutility import SFY, error_handler, check_and_makedirs
-from husfort.qsqlite import CDbStruct, CMgrSqlDb
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+from rich.progress import track
+from husfort.qutility import SFY, check_and_makedirs
+from husfort.qsqlite import CDbStruct
 from husfort.qcalendar import CCalendar
-from typedef import TFactorClass, TFactorNames, TUniverse, TFactorName
+from typedef import TFactorClass, TFactorNames, TUniverse, TFactorName, TCostHint
+from solutions.storage import gen_db_mgr
 from solutions.shared import gen_fac_raw_db, gen_fac_neu_db, neutralize_by_date
+from solutions.factorCache import CInstruDataCache, CCacheStats, TReadPlan
+from solutions.factorCheckpoint import CInputCheckpoint, get_table_key
+from solutions.factorPanel import CInputPanel
+from solutions.panel import update_with_panel
+from solutions.executor import CPoolExecutor, use_executor
 
 
 class CFactorGeneric:
@@ -17,7 +25,7 @@ class CFactorGeneric:
 
     def load_by_instru(self, instru: str, bgn_date: str, stp_date: str) -> pd.DataFrame:
         db_struct_instru = gen_fac_raw_db(instru, self.save_by_instru_dir, self.factor_class, self.factor_names)
-        sqldb = CMgrSqlDb(
+        sqldb = gen_db_mgr(
             db_save_dir=db_struct_instru.db_save_dir,
             db_name=db_struct_instru.db_name,
             table=db_struct_instru.table,
@@ -30,7 +38,7 @@ class CFactorGeneric:
     def save_raw_by_instru(self, factor_data: pd.DataFrame, instru: str, calendar: CCalendar):
         db_struct_instru = gen_fac_raw_db(instru, self.save_by_instru_dir, self.factor_class, self.factor_names)
         check_and_makedirs(db_struct_instru.db_save_dir)
-        sqldb = CMgrSqlDb(
+        sqldb = gen_db_mgr(
             db_save_dir=db_struct_instru.db_save_dir,
             db_name=db_struct_instru.db_name,
             table=db_struct_instru.table,
@@ -43,14 +51,14 @@ class CFactorGeneric:
     def save_neu_by_class(self, factor_data: pd.DataFrame, calendar: CCalendar):
         db_struct_class = gen_fac_neu_db(self.save_by_instru_dir, self.factor_class, self.factor_names)
         check_and_makedirs(db_struct_class.db_save_dir)
-        sqldb = CMgrSqlDb(
+        sqldb = gen_db_mgr(
             db_save_dir=db_struct_class.db_save_dir,
             db_name=db_struct_class.db_name,
             table=db_struct_class.table,
             mode="a",
         )
         if sqldb.check_continuity(factor_data["trade_date"].iloc[0], calendar) == 0:
-            sqldb.update(factor_data[db_struct_class.table.vars.names])
+            update_with_panel(db_struct_class, sqldb, factor_data[db_struct_class.table.vars.names])
         return 0
 
     def get_factor_data(self, input_data: pd.DataFrame, bgn_date: str) -> pd.DataFrame:
@@ -64,6 +72,12 @@ class CFactorGeneric:
 
 
 class CFactorRaw(CFactorGeneric):
+    # max number of trade dates kept in checkpoints, None for the lookback of the class
+    ckp_max_lookback: int | None = None
+    # light factors with cal_factor_for_universe realized are calculated for all instruments
+    # at once, others are calculated instrument by instrument, in a process pool if allowed
+    cost_hint: TCostHint = "heavy"
+
     def __init__(
             self,
             factor_class: TFactorClass,
@@ -85,79 +99,106 @@ class CFactorRaw(CFactorGeneric):
         self.db_struct_forex = db_struct_forex
         self.db_struct_macro = db_struct_macro
         self.db_struct_mkt = db_struct_mkt
+        self.cache: CInstruDataCache | None = None
+        self.checkpoint: CInputCheckpoint | None = None
+
+    def read_by_range(
+            self, db_struct: CDbStruct, bgn_date: str, stp_date: str, values: list[str] = None
+    ) -> pd.DataFrame:
+        if self.checkpoint is None:
+            return self.read_from_source(db_struct, bgn_date, stp_date, values)
+
+        table_key = get_table_key(db_struct)
+        if (tail := self.checkpoint.get_tail(table_key, bgn_date, values)) is not None:
+            new_data = self.read_from_source(db_struct, self.checkpoint.next_date, stp_date, values)
+            data = pd.concat([tail.get(bgn_date, values), new_data], axis=0, ignore_index=True)
+        else:
+            data = self.read_from_source(db_struct, bgn_date, stp_date, values)
+        self.checkpoint.record(db_struct, bgn_date, values, data)
+        return data
+
+    def read_from_source(
+            self, db_struct: CDbStruct, bgn_date: str, stp_date: str, values: list[str] = None
+    ) -> pd.DataFrame:
+        if self.cache is not None:
+            return self.cache.read_by_range(db_struct, bgn_date, stp_date, value_columns=values)
+        sqldb = gen_db_mgr(
+            db_save_dir=db_struct.db_save_dir,
+            db_name=db_struct.db_name,
+            table=db_struct.table,
+            mode="r",
+        )
+        return sqldb.read_by_range(bgn_date, stp_date, value_columns=values)
 
     def load_preprocess(self, instru: str, bgn_date: str, stp_date: str, values: list[str] = None) -> pd.DataFrame:
         if self.db_struct_preprocess is not None:
             db_struct_instru = self.db_struct_preprocess.copy_to_another(another_db_name=f"{instru}.db")
-            sqldb = CMgrSqlDb(
-                db_save_dir=db_struct_instru.db_save_dir,
-                db_name=db_struct_instru.db_name,
-                table=db_struct_instru.table,
-                mode="r",
-            )
-            return sqldb.read_by_range(bgn_date, stp_date, value_columns=values)
+            return self.read_by_range(db_struct_instru, bgn_date, stp_date, values)
         else:
             raise ValueError("Argument 'db_struct_preprocess' must be provided")
 
     def load_minute_bar(self, instru: str, bgn_date: str, stp_date: str, values: list[str] = None) -> pd.DataFrame:
         if self.db_struct_minute_bar is not None:
             db_struct_instru = self.db_struct_minute_bar.copy_to_another(another_db_name=f"{instru}.db")
-            sqldb = CMgrSqlDb(
-                db_save_dir=db_struct_instru.db_save_dir,
-                db_name=db_struct_instru.db_name,
-                table=db_struct_instru.table,
-                mode="r",
-            )
-            return sqldb.read_by_range(bgn_date, stp_date, value_columns=values)
+            return self.read_by_range(db_struct_instru, bgn_date, stp_date, values)
         else:
             raise ValueError("Argument 'db_struct_minute_bar' must be provided")
 
     def load_pos(self, instru: str, bgn_date: str, stp_date: str, values: list[str] = None) -> pd.DataFrame:
         if self.db_struct_pos is not None:
             db_struct_instru = self.db_struct_pos.copy_to_another(another_db_name=f"{instru}.db")
-            sqldb = CMgrSqlDb(
-                db_save_dir=db_struct_instru.db_save_dir,
-                db_name=db_struct_instru.db_name,
-                table=db_struct_instru.table,
-                mode="r",
-            )
-            return sqldb.read_by_range(bgn_date, stp_date, value_columns=values)
+            return self.read_by_range(db_struct_instru, bgn_date, stp_date, values)
         else:
             raise ValueError("Argument 'db_struct_pos' must be provided")
 
+    def load_preprocess_panel(
+            self, bgn_date: str, stp_date: str, values: list[str], threads: int | None = None,
+    ) -> CInputPanel:
+        """
+
+        :param values: columns to load, must contain "trade_date"
+        :param threads: number of threads to read databases of instruments
+        :return: inputs of all instruments in universe aligned by trade date
+        """
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            instru_data = executor.map(
+                lambda instru: self.load_preprocess(instru, bgn_date, stp_date, values), self.universe,
+            )
+            return CInputPanel.from_instru_data(dict(zip(self.universe, instru_data)))
+
+    def get_factor_data_from_panel(
+            self, panel: CInputPanel, factor_panel: dict[TFactorName, np.ndarray], bgn_date: str,
+    ) -> dict[str, pd.DataFrame]:
+        """
+
+        :param panel: inputs loaded by load_preprocess_panel, with column "ticker_major"
+        :param factor_panel: a dict with key = factor name, value = 2-D array of dates x instruments
+        :return: a dict with key = instrument, value = the same as get_factor_data
+        """
+        res: dict[str, pd.DataFrame] = {}
+        for j, instru in enumerate(panel.instruments):
+            rows = panel.mask[:, j] & (panel.dates >= bgn_date)
+            factor_data = pd.DataFrame({"trade_date": panel.dates[rows], "ticker": panel.data["ticker_major"][rows, j]})
+            for factor_name in self.factor_names:
+                factor_data[factor_name] = factor_panel[factor_name][rows, j]
+            res[instru] = factor_data
+        return res
+
     def load_forex(self, bgn_date: str, stp_date: str) -> pd.DataFrame:
         if self.db_struct_forex is not None:
-            sqldb = CMgrSqlDb(
-                db_save_dir=self.db_struct_forex.db_save_dir,
-                db_name=self.db_struct_forex.db_name,
-                table=self.db_struct_forex.table,
-                mode="r",
-            )
-            return sqldb.read_by_range(bgn_date, stp_date)
+            return self.read_by_range(self.db_struct_forex, bgn_date, stp_date)
         else:
             raise ValueError("Argument 'db_struct_forex' must be provided")
 
     def load_macro(self, bgn_date: str, stp_date: str) -> pd.DataFrame:
         if self.db_struct_macro is not None:
-            sqldb = CMgrSqlDb(
-                db_save_dir=self.db_struct_macro.db_save_dir,
-                db_name=self.db_struct_macro.db_name,
-                table=self.db_struct_macro.table,
-                mode="r",
-            )
-            return sqldb.read_by_range(bgn_date, stp_date)
+            return self.read_by_range(self.db_struct_macro, bgn_date, stp_date)
         else:
             raise ValueError("Argument 'db_struct_macro' must be provided")
 
     def load_mkt(self, bgn_date: str, stp_date: str) -> pd.DataFrame:
         if self.db_struct_mkt is not None:
-            sqldb = CMgrSqlDb(
-                db_save_dir=self.db_struct_mkt.db_save_dir,
-                db_name=self.db_struct_mkt.db_name,
-                table=self.db_struct_mkt.table,
-                mode="r",
-            )
-            return sqldb.read_by_range(bgn_date, stp_date)
+            return self.read_by_range(self.db_struct_mkt, bgn_date, stp_date)
         else:
             raise ValueError("Argument 'db_struct_mkt' must be provided")
 
@@ -170,32 +211,161 @@ class CFactorRaw(CFactorGeneric):
         """
         raise NotImplementedError
 
+    def cal_factor_for_universe(self, bgn_date: str, stp_date: str, calendar: CCalendar) -> dict[str, pd.DataFrame]:
+        """
+        This function is optional, to be realized by factors which can be calculated
+        for all instruments at once. If realized, main_raw will call it instead of
+        cal_factor_by_instru when use_universe_mode is True.
+
+        :return : a dict with key = instrument, value = the same as cal_factor_by_instru
+        """
+        raise NotImplementedError
+
+    @property
+    def has_universe_mode(self) -> bool:
+        return type(self).cal_factor_for_universe is not CFactorRaw.cal_factor_for_universe
+
+    def use_universe_mode(self, call_multiprocess: bool) -> bool:
+        """
+
+        :return: True if the universe mode is realized, and the class is light or no process pool is allowed
+        """
+        return self.has_universe_mode and (self.cost_hint == "light" or not call_multiprocess)
+
+    def get_ckp_bgn_date(self, db_struct: CDbStruct, default: str) -> str:
+        """
+
+        :return: the first date covered by the checkpoint of this table if it is valid,
+                 else default
+        """
+        if self.checkpoint is not None and (d := self.checkpoint.get_bgn_date(get_table_key(db_struct))):
+            return d
+        return default
+
     def process_by_instru(self, instru: str, bgn_date: str, stp_date: str, calendar: CCalendar):
-        factor_data = self.cal_factor_by_instru(instru, bgn_date, stp_date, calendar)
-        self.save_raw_by_instru(factor_data, instru, calendar)
+        self.checkpoint = CInputCheckpoint(
+            save_dir=os.path.join(self.save_by_instru_dir, "checkpoints", self.factor_class),
+            instru=instru,
+            signature=self.factor_names,
+        )
+        try:
+            self.checkpoint.load(bgn_date, calendar)
+            factor_data = self.cal_factor_by_instru(instru, bgn_date, stp_date, calendar)
+            self.save_raw_by_instru(factor_data, instru, calendar)
+            self.checkpoint.save(bgn_date, stp_date, calendar, max_lookback=self.ckp_max_lookback)
+        finally:
+            self.checkpoint = None
+        return 0
+
+    def main_raw_for_universe(self, bgn_date: str, stp_date: str, calendar: CCalendar):
+        logger.info(f"Calculating factor {SFY(self.factor_class)} for all instruments at once")
+        factor_data = self.cal_factor_for_universe(bgn_date, stp_date, calendar)
+        for instru in track(self.universe, description=f"Saving factor {SFY(self.factor_class)}"):
+            if factor_data[instru].empty:
+                logger.info(f"No data of {SFY(instru)} since {bgn_date} for factor {SFY(self.factor_class)}, skipped")
+                continue
+            # errors of an instrument do not stop others, like the per-instrument pool
+            try:
+                self.save_raw_by_instru(factor_data[instru], instru, calendar)
+            except Exception as e:
+                logger.error(f"Failed to save factor {SFY(self.factor_class)} of {SFY(instru)}: {e}")
         return 0
 
-    def main_raw(self, bgn_date: str, stp_date: str, calendar: CCalendar, call_multiprocess: bool, processes: int):
+    def main_raw(
+            self, bgn_date: str, stp_date: str, calendar: CCalendar, call_multiprocess: bool, processes: int,
+            executor: CPoolExecutor | None = None,
+    ):
+        """
+
+        :param executor: a running pool shared by stages, with "calendar" in its shared objects.
+                         If None, a new pool is started for this stage.
+        """
+        if self.use_universe_mode(call_multiprocess):
+            return self.main_raw_for_universe(bgn_date, stp_date, calendar)
+
         description = f"Calculating factor {SFY(self.factor_class)}"
         if call_multiprocess:
-            with Progress() as pb:
-                main_task = pb.add_task(description, total=len(self.universe))
-                with mp.get_context("spawn").Pool(processes) as pool:
-                    for instru in self.universe:
-                        pool.apply_async(
-                            self.process_by_instru,
-                            args=(instru, bgn_date, stp_date, calendar),
-                            callback=lambda _: pb.update(main_task, advance=1),
-                            error_callback=error_handler,
-                        )
-                    pool.close()
-                    pool.join()
+            with use_executor(executor, processes, shared={"calendar": calendar}) as pool_executor:
+                pool_executor.run(
+                    self.process_by_instru,
+                    [{"instru": instru, "bgn_date": bgn_date, "stp_date": stp_date} for instru in self.universe],
+                    shared_kwargs=("calendar",),
+                    description=description,
+                )
         else:
             for instru in track(self.universe, description=description):
                 self.process_by_instru(instru, bgn_date, stp_date, calendar)
         return 0
 
 
+# --------------------------------------------
+# ------ Many factor classes in one run ------
+# --------------------------------------------
+
+def process_by_instru_for_classes(
+        factors: list[CFactorRaw], instru: str, bgn_date: str, stp_date: str, calendar: CCalendar,
+        plan: TReadPlan = None,
+) -> tuple[CCacheStats, TReadPlan]:
+    cache = CInstruDataCache(plan=plan)
+    for factor in factors:
+        factor.cache = cache
+        try:
+            factor.process_by_instru(instru, bgn_date, stp_date, calendar)
+        finally:
+            factor.cache = None
+    cache.clear()
+    return cache.stats, cache.plan
+
+
+def main_raw_for_classes(
+        factors: list[CFactorRaw], bgn_date: str, stp_date: str, calendar: CCalendar,
+        call_multiprocess: bool, processes: int, executor: CPoolExecutor | None = None,
+):
+    """
+    Calculate raw factors of many classes, inputs of each instrument are read from
+    sqlite only once and shared by all classes. The first instrument is calculated
+    in the main process to learn the read plan, which is used by all other instruments.
+    Classes in universe mode are calculated for all instruments at once, before others.
+
+    :param executor: the same as CFactorRaw.main_raw
+    """
+    for factor in factors:
+        if factor.use_universe_mode(call_multiprocess):
+            factor.main_raw_for_universe(bgn_date, stp_date, calendar)
+    if not (factors := [factor for factor in factors if not factor.use_universe_mode(call_multiprocess)]):
+        return 0
+
+    universe = list(factors[0].universe)
+    description = f"Calculating factor {SFY(','.join([factor.factor_class for factor in factors]))}"
+    stats, plan = process_by_instru_for_classes(factors, universe[0], bgn_date, stp_date, calendar)
+    instru_stats: list[CCacheStats] = [stats]
+    if call_multiprocess:
+        with use_executor(executor, processes, shared={"calendar": calendar}) as pool_executor:
+            res = pool_executor.run(
+                process_by_instru_for_classes,
+                [
+                    {"factors": factors, "instru": instru, "bgn_date": bgn_date, "stp_date": stp_date, "plan": plan}
+                    for instru in universe[1:]
+                ],
+                shared_kwargs=("calendar",),
+                description=description,
+            )
+        instru_stats += [z[0] for z in res if z is not None]
+    else:
+        for instru in track(universe[1:], description=description):
+            stats, _ = process_by_instru_for_classes(factors, instru, bgn_date, stp_date, calendar, plan)
+            instru_stats.append(stats)
+
+    stats = sum(instru_stats, CCacheStats())
+    logger.info(
+        f"Sqlite reads for {SFY(len(factors))} factor classes: "
+        f"served {SFY(stats.served_rows)} rows/{SFY(f'{stats.served_bytes / 1024 ** 2:.1f}')} MB, "
+        f"read {SFY(stats.read_rows)} rows/{SFY(f'{stats.read_bytes / 1024 ** 2:.1f}')} MB, "
+        f"saved {SFY(stats.saved_rows)} rows/{SFY(f'{stats.saved_bytes / 1024 ** 2:.1f}')} MB"
+    )
+    return 0
+
+
 # --------------------------------------------
 # -------------- Neutralization --------------
 # --------------------------------------------
@@ -231,7 +401,7 @@ class CFactorNeu(CFactorGeneric):
         return res
 
     def load_available(self, bgn_date: str, stp_date: str) -> pd.DataFrame:
-        sqldb = CMgrSqlDb(
+        sqldb = gen_db_mgr(
             db_save_dir=self.db_struct_avlb.db_save_dir,
             db_name=self.db_struct_avlb.db_name,
             table=self.db_struct_avlb.table,
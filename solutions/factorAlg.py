@@ -1,6 +1,5 @@
 import numpy as np
 import pandas as pd
-import talib as ta
 import itertools as ittl
 from husfort.qcalendar import CCalendar
 from typedef import (
@@ -12,9 +11,25 @@ from typedef import (
     CCfgFactorCTR, CCfgFactorCVR, CCfgFactorCSR,
     CCfgFactorNOI, CCfgFactorNDOI, CCfgFactorWNOI, CCfgFactorWNDOI,
     CCfgFactorAMP, CCfgFactorEXR, CCfgFactorSMT, CCfgFactorRWTC,
-    CCfgFactorTA,
+    CCfgFactorTA, TFactorName,
 )
 from solutions.factor import CFactorRaw
+from solutions.factorKernels import (
+    cal_rolling_top_corr_batch,
+    cal_rolling_top_bottom_mean_batch,
+    cal_rolling_beta_batch,
+    cal_rolling_sum_mean_batch,
+    cal_rolling_skew_batch,
+)
+from solutions.factorTermStructure import cal_roll_return
+from solutions.factorTechnical import cal_ta_indicators, get_ta_lookback, cal_ta_for_panel
+from solutions.factorIntraday import (
+    split_segments,
+    cal_extreme_return,
+    cal_smart_idx,
+    cal_smart_money,
+    cal_range_weighted_time_center,
+)
 
 """
 -----------------------
@@ -23,39 +38,6 @@ Part I: Some math tools
 """
 
 
-def cal_rolling_corr(df: pd.DataFrame, x: str, y: str, rolling_window: int) -> pd.Series:
-    df["xy"] = (df[x] * df[y]).rolling(window=rolling_window).mean()
-    df["xx"] = (df[x] * df[x]).rolling(window=rolling_window).mean()
-    df["yy"] = (df[y] * df[y]).rolling(window=rolling_window).mean()
-    df["x"] = df[x].rolling(window=rolling_window).mean()
-    df["y"] = df[y].rolling(window=rolling_window).mean()
-
-    df["cov_xy"] = df["xy"] - df["x"] * df["y"]
-    df["cov_xx"] = df["xx"] - df["x"] * df["x"]
-    df["cov_yy"] = df["yy"] - df["y"] * df["y"]
-
-    # due to float number precision, cov_xx or cov_yy could be slightly negative
-    df.loc[np.abs(df["cov_xx"]) <= 1e-10, "cov_xx"] = 0
-    df.loc[np.abs(df["cov_yy"]) <= 1e-10, "cov_yy"] = 0
-
-    df["sqrt_cov_xx_yy"] = np.sqrt(df["cov_xx"] * df["cov_yy"])
-    s = df[["cov_xy", "sqrt_cov_xx_yy"]].apply(
-        lambda z: 0 if z["sqrt_cov_xx_yy"] == 0 else z["cov_xy"] / z["sqrt_cov_xx_yy"], axis=1
-    )
-    return s
-
-
-def cal_rolling_beta(df: pd.DataFrame, x: str, y: str, rolling_window: int) -> pd.Series:
-    df["xy"] = (df[x] * df[y]).rolling(window=rolling_window).mean()
-    df["xx"] = (df[x] * df[x]).rolling(window=rolling_window).mean()
-    df["x"] = df[x].rolling(window=rolling_window).mean()
-    df["y"] = df[y].rolling(window=rolling_window).mean()
-    df["cov_xy"] = df["xy"] - df["x"] * df["y"]
-    df["cov_xx"] = df["xx"] - df["x"] * df["x"]
-    s = df["cov_xy"] / df["cov_xx"]
-    return s
-
-
 def cal_top_corr(sub_data: pd.DataFrame, x: str, y: str, sort_var: str, top_size: int, ascending: bool = False):
     sorted_data = sub_data.sort_values(by=sort_var, ascending=ascending)
     top_data = sorted_data.head(top_size)
@@ -68,6 +50,48 @@ def auto_weight_sum(x: pd.Series) -> float:
     return x @ weight
 
 
+def rank_mbr_pos(pos_data: pd.DataFrame) -> pd.DataFrame:
+    """
+
+    :param pos_data: positions of brokers, with columns ["trade_date", "ts_code", "long_hld", "long_chg", "code_type"]
+    :return: positions of contracts, with "long_hld_rnk", the descending rank of "long_hld"
+             among brokers of the same (trade_date, ts_code)
+    """
+    cntrct_pos_data = pos_data.loc[pos_data["code_type"] == 0, ["trade_date", "ts_code", "long_hld", "long_chg"]]
+    lng_data = cntrct_pos_data.dropna(subset=["long_hld", "long_chg"], how="any")
+    lng_rnk = lng_data.groupby(by=["trade_date", "ts_code"], sort=False)["long_hld"].rank(ascending=False)
+    return lng_data.assign(long_hld_rnk=lng_rnk)
+
+
+def cal_mbr_pos_top_sums(rnk_data: pd.DataFrame, value: str, tops: list[int], weighted: bool) -> pd.DataFrame:
+    """
+    sum of value of brokers whose rank is not greater than top, over all contracts of each date,
+    for all tops in one groupby.
+
+    :param rnk_data: output of rank_mbr_pos
+    :param value: "long_hld" or "long_chg"
+    :param tops: sizes of top brokers
+    :param weighted: if True, weighted by abs(value) like auto_weight_sum, else sum
+    :return: a DataFrame with index = "trade_date" and columns = tops. Dates without any
+             selected broker are NaN, so are dates whose abs(value) sum to 0 if weighted.
+    """
+    x = rnk_data[value].to_numpy(np.float64)
+    selected = rnk_data["long_hld_rnk"].to_numpy()[:, None] <= np.array(tops)[None, :]
+    dates = rnk_data["trade_date"].to_numpy()
+    if weighted:
+        abs_x = np.abs(x)[:, None] * selected
+        abs_sum = pd.DataFrame(abs_x, columns=tops).groupby(by=dates, sort=True).sum()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            weighted_x = x[:, None] * (abs_x / abs_sum.reindex(index=dates).to_numpy())
+        res = pd.DataFrame(weighted_x, columns=tops).groupby(by=dates, sort=True).sum()
+        res = res.where(abs_sum > 0)
+    else:
+        res = pd.DataFrame(x[:, None] * selected, columns=tops).groupby(by=dates, sort=True).sum()
+        size = pd.DataFrame(selected, columns=tops).groupby(by=dates, sort=True).sum()
+        res = res.where(size > 0)
+    return res.rename_axis(index="trade_date")
+
+
 """
 ---------------------------------------------------
 Part II: factor class from different configuration
@@ -75,94 +99,116 @@ Part II: factor class from different configuration
 """
 
 
-class CFactorMTM(CFactorRaw):
-    def __init__(self, cfg: CCfgFactorMTM, **kwargs):
-        self.cfg = cfg
-        super().__init__(factor_class=cfg.factor_class, factor_names=cfg.factor_names, **kwargs)
+class __CFactorRolling(CFactorRaw):
+    cost_hint = "light"
+    # column of preprocess, rolling statistics of it are calculated
+    value: str
+
+    def cal_core(self, values: np.ndarray) -> dict[TFactorName, np.ndarray]:
+        """
+        This function is to be realized by specific factors
+
+        :param values: 2-D array, rows are dates of each instrument in order, columns are instruments
+        :return: a dict with key = factor name, value = 2-D array with the same shape as values
+        """
+        raise NotImplementedError
 
     def cal_factor_by_instru(self, instru: str, bgn_date: str, stp_date: str, calendar: CCalendar) -> pd.DataFrame:
         win_start_date = calendar.get_start_date(bgn_date, max(self.cfg.wins), -5)
-        major_data = self.load_preprocess(
+        input_data = self.load_preprocess(
             instru, bgn_date=win_start_date, stp_date=stp_date,
-            values=["trade_date", "ticker_major", "return_c_major"],
+            values=["trade_date", "ticker_major", self.value],
         )
-        for win, factor_name in zip(self.cfg.wins, self.factor_names):
-            major_data[factor_name] = major_data["return_c_major"].rolling(window=win).sum()
-        self.rename_ticker(major_data)
-        factor_data = self.get_factor_data(major_data, bgn_date)
+        for factor_name, values in self.cal_core(input_data[[self.value]].to_numpy(np.float64)).items():
+            input_data[factor_name] = values[:, 0]
+        self.rename_ticker(input_data)
+        factor_data = self.get_factor_data(input_data, bgn_date)
         return factor_data
 
+    def cal_factor_for_universe(self, bgn_date: str, stp_date: str, calendar: CCalendar) -> dict[str, pd.DataFrame]:
+        win_start_date = calendar.get_start_date(bgn_date, max(self.cfg.wins), -5)
+        panel = self.load_preprocess_panel(
+            bgn_date=win_start_date, stp_date=stp_date,
+            values=["trade_date", "ticker_major", self.value],
+        )
+        factor_panel = {
+            factor_name: panel.expand(values)
+            for factor_name, values in self.cal_core(panel.compact(panel.data[self.value])).items()
+        }
+        return self.get_factor_data_from_panel(panel, factor_panel, bgn_date)
+
+
+class CFactorMTM(__CFactorRolling):
+    value = "return_c_major"
+
+    def __init__(self, cfg: CCfgFactorMTM, **kwargs):
+        self.cfg = cfg
+        super().__init__(factor_class=cfg.factor_class, factor_names=cfg.factor_names, **kwargs)
+
+    def cal_core(self, values: np.ndarray) -> dict[TFactorName, np.ndarray]:
+        sum_mean = cal_rolling_sum_mean_batch(values, wins=self.cfg.wins)
+        return {factor_name: sum_mean[win][0] for win, factor_name in zip(self.cfg.wins, self.factor_names)}
+
+
+class CFactorSKEW(__CFactorRolling):
+    value = "return_c_major"
 
-class CFactorSKEW(CFactorRaw):
     def __init__(self, cfg: CCfgFactorSKEW, **kwargs):
         self.cfg = cfg
         super().__init__(factor_class=cfg.factor_class, factor_names=cfg.factor_names, **kwargs)
 
-    def cal_factor_by_instru(self, instru: str, bgn_date: str, stp_date: str, calendar: CCalendar) -> pd.DataFrame:
-        win_start_date = calendar.get_start_date(bgn_date, max(self.cfg.wins), -5)
-        major_data = self.load_preprocess(
-            instru, bgn_date=win_start_date, stp_date=stp_date,
-            values=["trade_date", "ticker_major", "return_c_major"],
-        )
-        for win, factor_name in zip(self.cfg.wins, self.factor_names):
-            major_data[factor_name] = major_data["return_c_major"].rolling(window=win).skew()
-        self.rename_ticker(major_data)
-        factor_data = self.get_factor_data(major_data, bgn_date)
-        return factor_data
+    def cal_core(self, values: np.ndarray) -> dict[TFactorName, np.ndarray]:
+        skew = cal_rolling_skew_batch(values, wins=self.cfg.wins)
+        return {factor_name: skew[win] for win, factor_name in zip(self.cfg.wins, self.factor_names)}
+
 
+class CFactorRS(__CFactorRolling):
+    value = "stock"
 
-class CFactorRS(CFactorRaw):
     def __init__(self, cfg: CCfgFactorRS, **kwargs):
         self.cfg = cfg
         super().__init__(factor_class=cfg.factor_class, factor_names=cfg.factor_names, **kwargs)
 
-    def cal_factor_by_instru(self, instru: str, bgn_date: str, stp_date: str, calendar: CCalendar) -> pd.DataFrame:
+    def cal_core(self, values: np.ndarray) -> dict[TFactorName, np.ndarray]:
         __min_win = 5
-        win_start_date = calendar.get_start_date(bgn_date, max(self.cfg.wins), -5)
-        adj_data = self.load_preprocess(
-            instru, bgn_date=win_start_date, stp_date=stp_date,
-            values=["trade_date", "ticker_major", "stock"],
-        )
-        adj_data["stock"] = adj_data["stock"].ffill(limit=__min_win).fillna(0)
+        stock = pd.DataFrame(values).ffill(limit=__min_win).fillna(0).to_numpy()
+        sum_mean = cal_rolling_sum_mean_batch(stock, wins=self.cfg.wins)
+        res: dict[TFactorName, np.ndarray] = {}
         for win in self.cfg.wins:
-            rspa = f"{self.factor_class}PA{win:03d}_RAW"
-            rsla = f"{self.factor_class}LA{win:03d}_RAW"
-
-            ma = adj_data["stock"].rolling(window=win).mean()
-            s = adj_data["stock"] / ma
-            s[s == np.inf] = np.nan  # some maybe resulted from divided by Zero
-            adj_data[rspa] = 1 - s
-
-            la = adj_data["stock"].shift(win)
-            s = adj_data["stock"] / la
-            s[s == np.inf] = np.nan  # some maybe resulted from divided by Zero
-            adj_data[rsla] = 1 - s
-        self.rename_ticker(adj_data)
-        factor_data = self.get_factor_data(adj_data, bgn_date)
-        return factor_data
+            rspa = TFactorName(f"{self.factor_class}PA{win:03d}_RAW")
+            rsla = TFactorName(f"{self.factor_class}LA{win:03d}_RAW")
+            with np.errstate(invalid="ignore", divide="ignore"):
+                _, ma = sum_mean[win]
+                s = stock / ma
+                s[s == np.inf] = np.nan  # some maybe resulted from divided by Zero
+                res[rspa] = 1 - s
+
+                la = np.full(stock.shape, np.nan)
+                la[win:] = stock[:-win]
+                s = stock / la
+                s[s == np.inf] = np.nan  # some maybe resulted from divided by Zero
+                res[rsla] = 1 - s
+        return res
+
 
+class CFactorBASIS(__CFactorRolling):
+    value = "basis_rate"
 
-class CFactorBASIS(CFactorRaw):
     def __init__(self, cfg: CCfgFactorBASIS, **kwargs):
         self.cfg = cfg
         super().__init__(factor_class=cfg.factor_class, factor_names=cfg.factor_names, **kwargs)
 
-    def cal_factor_by_instru(
-            self, instru: str, bgn_date: str, stp_date: str, calendar: CCalendar
-    ) -> pd.DataFrame:
-        win_start_date = calendar.get_start_date(bgn_date, max(self.cfg.wins), -5)
-        adj_data = self.load_preprocess(
-            instru, bgn_date=win_start_date, stp_date=stp_date,
-            values=["trade_date", "ticker_major", "basis_rate"],
+    def cal_core(self, values: np.ndarray) -> dict[TFactorName, np.ndarray]:
+        sum_mean = cal_rolling_sum_mean_batch(
+            values, wins=self.cfg.wins, min_periods={win: int(2 * win / 3) for win in self.cfg.wins},
         )
+        res: dict[TFactorName, np.ndarray] = {}
         for win in self.cfg.wins:
-            f0 = f"{self.factor_class}{win:03d}_RAW"
-            f1 = f"{self.factor_class}D{win:03d}_RAW"
-            adj_data[f0] = adj_data["basis_rate"].rolling(window=win, min_periods=int(2 * win / 3)).mean()
-            adj_data[f1] = adj_data["basis_rate"] - adj_data[f0]
-        self.rename_ticker(adj_data)
-        factor_data = self.get_factor_data(adj_data, bgn_date)
-        return factor_data
+            f0 = TFactorName(f"{self.factor_class}{win:03d}_RAW")
+            f1 = TFactorName(f"{self.factor_class}D{win:03d}_RAW")
+            _, res[f0] = sum_mean[win]
+            res[f1] = values - res[f0]
+        return res
 
 
 class CFactorTS(CFactorRaw):
@@ -170,19 +216,6 @@ class CFactorTS(CFactorRaw):
         self.cfg = cfg
         super().__init__(factor_class=cfg.factor_class, factor_names=cfg.factor_names, **kwargs)
 
-    @staticmethod
-    def cal_roll_return(x: pd.Series, ticker_n: str, ticker_d: str, prc_n: str, prc_d: str):
-        if x[ticker_n] == "" or x[ticker_d] == "":
-            return np.nan
-        if x[prc_d] > 0:
-            cntrct_d, cntrct_n = x[ticker_d].split(".")[0], x[ticker_n].split(".")[0]
-            month_d, month_n = int(cntrct_d[-2:]), int(cntrct_n[-2:])
-            dlt_month = month_d - month_n
-            dlt_month = dlt_month + (12 if dlt_month <= 0 else 0)
-            return (x[prc_n] / x[prc_d] - 1) / dlt_month * 12 * 100
-        else:
-            return np.nan
-
     def cal_factor_by_instru(
             self, instru: str, bgn_date: str, stp_date: str, calendar: CCalendar
     ) -> pd.DataFrame:
@@ -192,10 +225,9 @@ class CFactorTS(CFactorRaw):
             values=["trade_date", "ticker_major", "ticker_minor", "close_major", "close_minor"],
         )
         adj_data[["ticker_major", "ticker_minor"]] = adj_data[["ticker_major", "ticker_minor"]].fillna("")
-        adj_data["ts"] = adj_data.apply(
-            self.cal_roll_return,
-            args=("ticker_major", "ticker_minor", "close_major", "close_minor"),
-            axis=1,
+        adj_data["ts"] = cal_roll_return(
+            ticker_n=adj_data["ticker_major"], ticker_d=adj_data["ticker_minor"],
+            prc_n=adj_data["close_major"], prc_d=adj_data["close_minor"],
         )
         for win in self.cfg.wins:
             f0 = f"{self.factor_class}{win:03d}_RAW"
@@ -214,26 +246,19 @@ class __CFactorBETA(CFactorRaw):
         return adj_data
 
     def betas_from_wins(self, wins: list[int], input_data: pd.DataFrame, x: str, y: str):
+        # beta, beta difference, residual and residual std of all wins
+        betas = cal_rolling_beta_batch(
+            x=input_data[x].to_numpy(np.float64), y=input_data[y].to_numpy(np.float64), wins=wins,
+        )
         __prefix0 = f"{self.factor_class}{wins[0]:03d}"
-        f0 = f"{__prefix0}_RAW"
+        beta0, _, _ = betas[wins[0]]
         for i, win in enumerate(wins):
-            fi = f"{self.factor_class}{win:03d}_RAW"
-            input_data[fi] = cal_rolling_beta(df=input_data, x=x, y=y, rolling_window=win)
+            beta, res, res_std = betas[win]
+            input_data[f"{self.factor_class}{win:03d}_RAW"] = beta
             if i > 0:
-                fid = f"{__prefix0}D{win:03d}_RAW"
-                input_data[fid] = input_data[f0] - input_data[fi]
-        return 0
-
-    def res_from_wins(self, wins: list[int], input_data: pd.DataFrame, x: str, y: str):
-        for i, win in enumerate(wins):
-            b, fi = f"{self.factor_class}{win:03d}_RAW", f"{self.factor_class}{win:03d}RES_RAW"
-            input_data[fi] = input_data[y] - input_data[x] * input_data[b]
-        return 0
-
-    def res_std_from_wins(self, wins: list[int], input_data: pd.DataFrame):
-        for i, win in enumerate(wins):
-            res, fi = f"{self.factor_class}{win:03d}RES_RAW", f"{self.factor_class}{win:03d}RESSTD_RAW"
-            input_data[fi] = input_data[res].rolling(window=win, min_periods=int(win * 0.6)).std()
+                input_data[f"{__prefix0}D{win:03d}_RAW"] = beta0 - beta
+            input_data[f"{self.factor_class}{win:03d}RES_RAW"] = res
+            input_data[f"{self.factor_class}{win:03d}RESSTD_RAW"] = res_std
         return 0
 
 
@@ -258,8 +283,6 @@ class CFactorS0BETA(__CFactorBETA):
             y_data=adj_market_data[["trade_date", __x_ret]]
         )
         self.betas_from_wins(self.cfg.wins, adj_data, __x_ret, __y_ret)
-        self.res_from_wins(self.cfg.wins, adj_data, __x_ret, __y_ret)
-        self.res_std_from_wins(self.cfg.wins, adj_data)
         self.rename_ticker(adj_data)
         factor_data = self.get_factor_data(adj_data, bgn_date)
         return factor_data
@@ -285,8 +308,6 @@ class CFactorS1BETA(__CFactorBETA):
             y_data=adj_market_data[["trade_date", __x_ret]]
         )
         self.betas_from_wins(self.cfg.wins, adj_data, __x_ret, __y_ret)
-        self.res_from_wins(self.cfg.wins, adj_data, __x_ret, __y_ret)
-        self.res_std_from_wins(self.cfg.wins, adj_data)
         self.rename_ticker(adj_data)
         factor_data = self.get_factor_data(adj_data, bgn_date)
         return factor_data
@@ -312,8 +333,6 @@ class CFactorCBETA(__CFactorBETA):
             y_data=adj_forex_data[["trade_date", __x_ret]]
         )
         self.betas_from_wins(self.cfg.wins, adj_data, __x_ret, __y_ret)
-        self.res_from_wins(self.cfg.wins, adj_data, __x_ret, __y_ret)
-        self.res_std_from_wins(self.cfg.wins, adj_data)
         self.rename_ticker(adj_data)
         factor_data = self.get_factor_data(adj_data, bgn_date)
         return factor_data
@@ -340,8 +359,6 @@ class CFactorIBETA(__CFactorBETA):
             y_data=adj_macro_data[["trade_date", __x_ret]]
         )
         self.betas_from_wins(self.cfg.wins, adj_data, __x_ret, __y_ret)
-        self.res_from_wins(self.cfg.wins, adj_data, __x_ret, __y_ret)
-        self.res_std_from_wins(self.cfg.wins, adj_data)
         self.rename_ticker(adj_data)
         factor_data = self.get_factor_data(adj_data, bgn_date)
         return factor_data
@@ -368,8 +385,6 @@ class CFactorPBETA(__CFactorBETA):
             y_data=adj_macro_data[["trade_date", __x_ret]]
         )
         self.betas_from_wins(self.cfg.wins, adj_data, __x_ret, __y_ret)
-        self.res_from_wins(self.cfg.wins, adj_data, __x_ret, __y_ret)
-        self.res_std_from_wins(self.cfg.wins, adj_data)
         self.rename_ticker(adj_data)
         factor_data = self.get_factor_data(adj_data, bgn_date)
         return factor_data
@@ -384,18 +399,25 @@ class __CFactorCXY(CFactorRaw):
             wins: list[int], tops: list[float],
             sort_var: str,
     ):
+        trade_dates = raw_data.index.to_numpy(dtype=str)
+        bgn_pos = int(np.searchsorted(trade_dates, bgn_date, side="left"))
+        stp_pos = int(np.searchsorted(trade_dates, stp_date, side="left"))
+        r_data = cal_rolling_top_corr_batch(
+            x=raw_data[x].to_numpy(dtype=np.float64),
+            y=raw_data[y].to_numpy(dtype=np.float64),
+            sort_var=raw_data[sort_var].to_numpy(dtype=np.float64),
+            wins=wins, tops=tops,
+            bgn_pos=bgn_pos, stp_pos=stp_pos,
+        )
         for win, top in ittl.product(wins, tops):
             factor_name = f"{self.factor_class}{win:03d}T{int(top * 10):02d}_RAW"
+            r = r_data[(win, top)]
+            # windows not long enough, keep the same results as slicing with iloc
             top_size = int(win * top) + 1
-            r_data = {}
-            for i, trade_date in enumerate(raw_data.index):
-                if trade_date < bgn_date:
-                    continue
-                elif trade_date >= stp_date:
-                    break
+            for i in range(bgn_pos, min(win - 1, stp_pos)):
                 sub_data = raw_data.iloc[i - win + 1: i + 1]
-                r_data[trade_date] = cal_top_corr(sub_data, x=x, y=y, sort_var=sort_var, top_size=top_size)
-            raw_data[factor_name] = pd.Series(r_data)
+                r[i] = cal_top_corr(sub_data, x=x, y=y, sort_var=sort_var, top_size=top_size)
+            raw_data[factor_name] = r
         return 0
 
 
@@ -584,62 +606,26 @@ class __CFactorMbrPos(CFactorRaw):
         self.using_diff = cfg.factor_class in ["NDOI", "WNDOI"]
         super().__init__(factor_class=cfg.factor_class, factor_names=cfg.factor_names, **kwargs)
 
-    @staticmethod
-    def __robust_rate(z: pd.Series) -> float:
-        return z.iloc[0] / z.iloc[1] * 100 if z.iloc[1] > 0 else np.nan
-
-    def cal_core(self, pos_data: pd.DataFrame, top: int, instru_oi_data: pd.DataFrame) -> pd.DataFrame:
-        cntrct_pos_data = pos_data.query("code_type == 0")
-
-        lng_pos_data = cntrct_pos_data[["trade_date", "ts_code", "broker", "long_hld", "long_chg"]].dropna(
-            subset=["long_hld", "long_chg"], how="any")
-        srt_pos_data = cntrct_pos_data[["trade_date", "ts_code", "broker", "short_hld", "short_chg"]].dropna(
-            subset=["short_hld", "short_chg"], how="any")
-
-        lng_rnk_data = lng_pos_data[["trade_date", "ts_code", "long_hld"]].groupby(
-            by=["trade_date", "ts_code"]).rank(ascending=False)
-        srt_rnk_data = srt_pos_data[["trade_date", "ts_code", "short_hld"]].groupby(
-            by=["trade_date", "ts_code"]).rank(ascending=False)
-
-        lng_data = pd.merge(
-            left=lng_pos_data, right=lng_rnk_data,
-            left_index=True, right_index=True,
-            how="left", suffixes=("", "_rnk")
-        ).sort_values(by=["trade_date", "ts_code", "long_hld_rnk"], ascending=True)
-        lng_data_slc = lng_data.query(f"long_hld_rnk <= {top}")
-
-        srt_data = pd.merge(
-            left=srt_pos_data, right=srt_rnk_data,
-            left_index=True, right_index=True,
-            how="left", suffixes=("", "_rnk")
-        ).sort_values(by=["trade_date", "ts_code", "short_hld_rnk"], ascending=True)
-        srt_data_slc = srt_data.query(f"short_hld_rnk <= {top}")
-
-        lng_oi_df = pd.pivot_table(
-            data=lng_data_slc,
-            index="trade_date",
-            values="long_chg" if self.using_diff else "long_hld",
-            aggfunc=auto_weight_sum if self.call_weight_sum else "sum",
-        )
-        srt_oi_df = pd.pivot_table(
-            data=srt_data_slc,
-            index="trade_date",
-            values="short_chg" if self.using_diff else "short_hld",
-            aggfunc=auto_weight_sum if self.call_weight_sum else "sum",
-        )
-
-        noi_df = instru_oi_data.set_index("trade_date").merge(
-            right=lng_oi_df, left_index=True, right_index=True, how="left",
-        ).merge(
-            right=srt_oi_df, left_index=True, right_index=True, how="left",
-        )
-        if self.using_diff:
-            noi_df["noi_sum"] = noi_df["long_chg"]  # - noi_df["short_chg"]
-        else:
-            noi_df["noi_sum"] = noi_df["long_hld"]  # - noi_df["short_hld"]
-
-        noi_df["net"] = noi_df[["noi_sum", "oi_instru"]].apply(self.__robust_rate, axis=1)
-        return noi_df[["net"]]
+    def cal_core(self, pos_data: pd.DataFrame, tops: list[int], instru_oi_data: pd.DataFrame) -> pd.DataFrame:
+        """
+
+        :param pos_data: positions of brokers
+        :param tops: sizes of top brokers
+        :param instru_oi_data: with columns ["trade_date", "oi_instru"]
+        :return: a DataFrame with index = "trade_date" and columns = tops, net position rate in percent
+        """
+        lng_data = rank_mbr_pos(pos_data)
+        noi_sum = cal_mbr_pos_top_sums(
+            lng_data,
+            value="long_chg" if self.using_diff else "long_hld",
+            tops=tops,
+            weighted=self.call_weight_sum,
+        )
+        noi_sum = noi_sum.reindex(index=instru_oi_data["trade_date"])
+        oi_instru = instru_oi_data["oi_instru"].to_numpy(np.float64)[:, None]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            net = np.where(oi_instru > 0, noi_sum.to_numpy() / oi_instru * 100, np.nan)
+        return pd.DataFrame(net, index=noi_sum.index, columns=tops)
 
     def cal_factor_by_instru(
             self, instru: str, bgn_date: str, stp_date: str, calendar: CCalendar
@@ -656,20 +642,22 @@ class __CFactorMbrPos(CFactorRaw):
         pos_data = self.load_pos(
             instru, bgn_date=win_start_date, stp_date=stp_date,
             values=[
-                "trade_date", "ts_code", "broker",
-                "long_hld", "long_chg", "short_hld", "short_chg",
+                "trade_date", "ts_code",
+                "long_hld", "long_chg",
                 "code_type"
             ]
         )
 
         # cal
         res = {}
+        net_data = self.cal_core(
+            pos_data=pos_data, tops=self.cfg.tops, instru_oi_data=adj_data[["trade_date", "oi_instru"]],
+        )
         for top in self.cfg.tops:
-            net_data = self.cal_core(pos_data=pos_data, top=top, instru_oi_data=adj_data[["trade_date", "oi_instru"]])
             for win in self.cfg.wins:
                 mp = int(2 * win / 3)
                 factor_name = f"{self.factor_class}{win:03d}T{top:02d}_RAW"
-                res[factor_name] = net_data["net"].rolling(window=win, min_periods=mp).mean()
+                res[factor_name] = net_data[top].rolling(window=win, min_periods=mp).mean()
         res_df = pd.DataFrame(res).reset_index()
 
         # merge to header
@@ -725,21 +713,30 @@ class CFactorAMP(CFactorRaw):
         adj_major_data["amp"] = adj_major_data["highI"] / adj_major_data["lowI"] - 1
         adj_major_data["spot"] = adj_major_data["closeI"]
 
+        trade_dates = adj_major_data["trade_date"].to_numpy(dtype=str)
+        bgn_pos = int(np.searchsorted(trade_dates, bgn_date, side="left"))
+        stp_pos = int(np.searchsorted(trade_dates, stp_date, side="left"))
+        amp_data = cal_rolling_top_bottom_mean_batch(
+            x=adj_major_data["amp"].to_numpy(dtype=np.float64),
+            sort_var=adj_major_data["spot"].to_numpy(dtype=np.float64),
+            wins=self.cfg.wins, lbds=self.cfg.lbds,
+            bgn_pos=bgn_pos, stp_pos=stp_pos,
+        )
         factor_raw_data = {}
         for win, lbd in ittl.product(self.cfg.wins, self.cfg.lbds):
             top_size = int(win * lbd) + 1
             factor_h, factor_l, factor_d = [
                 f"{self.factor_class}{win:03d}T{int(lbd * 10):02d}{_}_RAW" for _ in ["H", "L", "D"]
             ]
-            r_h_data, r_l_data, r_d_data = {}, {}, {}
-            for i, trade_date in enumerate(adj_major_data["trade_date"]):
-                if (trade_date < bgn_date) or (trade_date >= stp_date):
-                    continue
+            r_h, r_l = amp_data[(win, lbd)]
+            # windows not long enough, keep the same results as slicing with iloc
+            for i in range(bgn_pos, min(win - 1, stp_pos)):
                 sub_data = adj_major_data.iloc[i - win + 1: i + 1]
-                rh, rl, rd = self.cal_amp(sub_data=sub_data, x="amp", sort_var="spot", top_size=top_size)
-                r_h_data[trade_date], r_l_data[trade_date], r_d_data[trade_date] = rh, rl, rd
-            for iter_data, factor in zip([r_h_data, r_l_data, r_d_data], [factor_h, factor_l, factor_d]):
-                factor_raw_data[factor] = pd.Series(iter_data)
+                r_h[i], r_l[i], _ = self.cal_amp(sub_data=sub_data, x="amp", sort_var="spot", top_size=top_size)
+            slc = slice(bgn_pos, stp_pos)
+            factor_raw_data[factor_h] = pd.Series(r_h[slc], index=trade_dates[slc])
+            factor_raw_data[factor_l] = pd.Series(r_l[slc], index=trade_dates[slc])
+            factor_raw_data[factor_d] = factor_raw_data[factor_h] - factor_raw_data[factor_l]
         factor_raw_df = pd.DataFrame(factor_raw_data)
         input_data = pd.merge(
             left=adj_major_data,
@@ -758,24 +755,6 @@ class CFactorEXR(CFactorRaw):
         self.cfg = cfg
         super().__init__(factor_class=cfg.factor_class, factor_names=cfg.factor_names, **kwargs)
 
-    @staticmethod
-    def find_extreme_return(tday_minb_data: pd.DataFrame, ret: str, dfts: list[int]) -> pd.Series:
-        ret_min, ret_max, ret_median = (
-            tday_minb_data[ret].min(),
-            tday_minb_data[ret].max(),
-            tday_minb_data[ret].median(),
-        )
-        if (ret_max + ret_min) > (2 * ret_median):
-            idx_exr, exr = tday_minb_data[ret].argmax(), -ret_max
-        else:
-            idx_exr, exr = tday_minb_data[ret].argmin(), -ret_min
-        res = {"EXR_RAW": exr}
-        for d in dfts:
-            idx_dxr = idx_exr - d
-            dxr = -tday_minb_data[ret].iloc[idx_dxr] if idx_dxr >= 0 else exr
-            res[f"DXR{d:02d}_RAW"] = dxr
-        return pd.Series(res)
-
     def cal_factor_by_instru(
             self, instru: str, bgn_date: str, stp_date: str, calendar: CCalendar
     ) -> pd.DataFrame:
@@ -787,9 +766,10 @@ class CFactorEXR(CFactorRaw):
         adj_minb_data = self.load_minute_bar(instru, bgn_date=win_start_date, stp_date=stp_date)
         adj_minb_data["freq_ret"] = adj_minb_data["close"] / adj_minb_data["pre_close"] - 1
         adj_minb_data["freq_ret"] = adj_minb_data["freq_ret"].fillna(0)
-        exr_dxr_df = adj_minb_data.groupby(by="trade_date").apply(
-            self.find_extreme_return, ret="freq_ret", dfts=self.cfg.dfts  # type:ignore
-        )
+        order, trade_dates, offsets = split_segments(adj_minb_data["trade_date"])
+        exr_dxr_df = cal_extreme_return(
+            ret=adj_minb_data["freq_ret"].to_numpy(np.float64)[order], offsets=offsets, dfts=self.cfg.dfts,
+        ).set_axis(pd.Index(trade_dates, name="trade_date"))
         factor_win_dfs: list[pd.DataFrame] = []
         for win in self.cfg.wins:
             rename_mapper = {
@@ -822,45 +802,6 @@ class CFactorSMT(CFactorRaw):
         self.cfg = cfg
         super().__init__(factor_class=cfg.factor_class, factor_names=cfg.factor_names, **kwargs)
 
-    @staticmethod
-    def cal_smart_idx(data: pd.DataFrame, ret: str, vol: str) -> pd.Series:
-        return data[[ret, vol]].apply(lambda z: np.abs(z[ret]) / np.log(z[vol]) * 1e4 if z[vol] > 1 else 0, axis=1)
-
-    @staticmethod
-    def cal_smt(sorted_sub_data: pd.DataFrame, lbd: float, prc: str, ret: str) -> tuple[float, float]:
-        # total price and ret
-        if (tot_amt_sum := sorted_sub_data["amount"].sum()) > 0:
-            tot_w = sorted_sub_data["amount"] / tot_amt_sum
-            tot_prc = sorted_sub_data[prc] @ tot_w
-            tot_ret = sorted_sub_data[ret] @ tot_w
-        else:
-            return np.nan, np.nan
-
-        # select smart data from total
-        volume_threshold = sorted_sub_data["vol"].sum() * lbd
-        n = sum(sorted_sub_data["vol"].cumsum() < volume_threshold) + 1
-        smt_df = sorted_sub_data.head(n)
-
-        # smart price and ret
-        if (smt_amt_sum := smt_df["amount"].sum()) > 0:
-            smt_w = smt_df["amount"] / smt_amt_sum
-            smt_prc = smt_df[prc] @ smt_w
-            smt_ret = smt_df[ret] @ smt_w
-            smt_p = ((smt_prc / tot_prc - 1) * 1e4) if tot_prc > 0 else 0
-            smt_r = (smt_ret - tot_ret) * 1e4 if not np.isinf(tot_ret) else 0
-            return smt_p, smt_r
-        else:
-            return np.nan, np.nan
-
-    def cal_by_trade_date(self, trade_date_data: pd.DataFrame) -> pd.Series:
-        res = {}
-        for lbd in self.cfg.lbds:
-            p_lbl = f"{self.factor_class}T{int(lbd * 10):02d}P_RAW"
-            r_lbl = f"{self.factor_class}T{int(lbd * 10):02d}R_RAW"
-            smt_p, smt_r = self.cal_smt(trade_date_data, lbd=lbd, prc="vwap", ret="freq_ret")
-            res[p_lbl], res[r_lbl] = smt_p, smt_r
-        return pd.Series(res)
-
     def cal_factor_by_instru(
             self, instru: str, bgn_date: str, stp_date: str, calendar: CCalendar
     ) -> pd.DataFrame:
@@ -876,11 +817,21 @@ class CFactorSMT(CFactorRaw):
         # because a price ratio is considered in the final results, not an absolute value of price is considered
         adj_minb_data["vwap"] = (adj_minb_data["amount"] / adj_minb_data["vol"]).ffill()
 
-        # smart idx
-        adj_minb_data["smart_idx"] = self.cal_smart_idx(adj_minb_data, ret="freq_ret", vol="vol")
-        adj_minb_data = adj_minb_data.sort_values(by=["trade_date", "smart_idx"], ascending=[True, False])
-
-        concat_factor_data = adj_minb_data.groupby(by="trade_date", group_keys=False).apply(self.cal_by_trade_date)
+        # smart idx, rows of each trade date are sorted by it in cal_smart_money
+        order, trade_dates, offsets = split_segments(adj_minb_data["trade_date"])
+        ret, vol, amount, vwap = [
+            adj_minb_data[_].to_numpy(np.float64)[order] for _ in ["freq_ret", "vol", "amount", "vwap"]
+        ]
+        smt_data = cal_smart_money(
+            ret=ret, vol=vol, amount=amount, prc=vwap,
+            smart_idx=cal_smart_idx(ret=ret, vol=vol), offsets=offsets, lbds=self.cfg.lbds,
+        )
+        factor_raw_data = {}
+        for lbd in self.cfg.lbds:
+            p_lbl = f"{self.factor_class}T{int(lbd * 10):02d}P_RAW"
+            r_lbl = f"{self.factor_class}T{int(lbd * 10):02d}R_RAW"
+            factor_raw_data[p_lbl], factor_raw_data[r_lbl] = smt_data[lbd]
+        concat_factor_data = pd.DataFrame(factor_raw_data, index=pd.Index(trade_dates, name="trade_date"))
         input_data = pd.merge(
             left=adj_major_data,
             right=concat_factor_data,
@@ -898,21 +849,6 @@ class CFactorRWTC(CFactorRaw):
         self.cfg = cfg
         super().__init__(factor_class=cfg.factor_class, factor_names=cfg.factor_names, **kwargs)
 
-    @staticmethod
-    def cal_range_weighted_time_center(tday_minb_data: pd.DataFrame, ret: str) -> pd.Series:
-        index_reset_df = tday_minb_data.reset_index()
-        pos_idx = index_reset_df[ret] > 0
-        neg_idx = index_reset_df[ret] < 0
-        pos_grp = index_reset_df.loc[pos_idx, ret]
-        neg_grp = index_reset_df.loc[neg_idx, ret]
-        pos_wgt = pos_grp.abs() / pos_grp.abs().sum()
-        neg_wgt = neg_grp.abs() / neg_grp.abs().sum()
-        rwtc_u = pos_grp.index @ pos_wgt / len(tday_minb_data)
-        rwtc_d = neg_grp.index @ neg_wgt / len(tday_minb_data)
-        rwtc_t = rwtc_u - rwtc_d
-        rwtc_v = np.abs(rwtc_t)
-        return pd.Series({"RWTCU": rwtc_u, "RWTCD": rwtc_d, "RWTCT": rwtc_t, "RWTCV": rwtc_v})
-
     def cal_factor_by_instru(
             self, instru: str, bgn_date: str, stp_date: str, calendar: CCalendar
     ) -> pd.DataFrame:
@@ -924,9 +860,10 @@ class CFactorRWTC(CFactorRaw):
         adj_minb_data = self.load_minute_bar(instru, bgn_date=win_start_date, stp_date=stp_date)
         adj_minb_data["freq_ret"] = adj_minb_data["close"] / adj_minb_data["pre_close"] - 1
         adj_minb_data["freq_ret"] = adj_minb_data["freq_ret"].fillna(0)
-        rwtc_df = adj_minb_data.groupby(by="trade_date").apply(
-            self.cal_range_weighted_time_center, ret="freq_ret"  # type:ignore
-        )
+        order, trade_dates, offsets = split_segments(adj_minb_data["trade_date"])
+        rwtc_df = cal_range_weighted_time_center(
+            ret=adj_minb_data["freq_ret"].to_numpy(np.float64)[order], offsets=offsets,
+        ).set_axis(pd.Index(trade_dates, name="trade_date"))
         factor_win_dfs: list[pd.DataFrame] = []
         for win in self.cfg.wins:
             rename_mapper = {
@@ -952,78 +889,40 @@ class CFactorRWTC(CFactorRaw):
 
 
 class CFactorTA(CFactorRaw):
-    def __init__(self, cfg: CCfgFactorTA, **kwargs):
+    # indicators with exponential smoothing converge long before this many trade dates
+    ckp_max_lookback = 480
+    # inputs are loaded from this date if warm-up is not truncated
+    default_bgn_date = "20120104"
+    # TA-Lib is called instrument by instrument in both modes, so the process pool is used if allowed.
+    # Without a pool, the universe mode still saves reads and dataframes, see "python benchmark.py ta"
+    cost_hint = "heavy"
+
+    def __init__(self, cfg: CCfgFactorTA, warmup_multiple: int | None = None, threads: int | None = None, **kwargs):
+        """
+
+        :param cfg: config of TA
+        :param warmup_multiple: if not None, inputs are truncated to (warmup_multiple x the max lookback
+                                of all indicators) trade dates before bgn_date, instead of the full history
+                                since default_bgn_date. Results of indicators with exponential smoothing
+                                may differ slightly from the full history.
+        :param threads: number of threads to read databases of instruments in the universe mode
+        """
         self.cfg = cfg
+        self.warmup_multiple = warmup_multiple
+        self.threads = threads
         super().__init__(factor_class=cfg.factor_class, factor_names=cfg.factor_names, **kwargs)
 
-    def __cal_macd(self, close: pd.Series) -> pd.Series:
-        fast, slow, diff = self.cfg.macd
-        macd, macdsignal, macdhist = ta.MACD(close, fastperiod=fast, slowperiod=slow, signalperiod=diff)
-        return macdhist
-
-    def __cal_bbands(self, close: pd.Series) -> list[float]:
-        timeperiod, up, dn = self.cfg.bbands
-        upper, middle, lower = ta.BBANDS(close, timeperiod=timeperiod, nbdevup=up, nbdevdn=dn, matype=0)
-        res = []
-        for u, m, l, c in zip(upper, middle, lower, close):
-            if c >= m:
-                res.append((u / c - 1) * 100)
-            else:
-                res.append((l / c - 1) * 100)
-        return res
-
-    def __cal_sar(self, high: pd.Series, low: pd.Series, close: pd.Series) -> pd.Series:
-        acceleration, maximum = self.cfg.sar
-        real = ta.SAR(high, low, acceleration=acceleration, maximum=maximum)
-        return (close / real - 1) * 100
-
-    def __cal_adx(self, high: pd.Series, low: pd.Series, close: pd.Series) -> pd.Series:
-        timeperiod = self.cfg.adx
-        return ta.ADX(high, low, close, timeperiod=timeperiod)
-
-    def __cal_bop(self, opn: pd.Series, high: pd.Series, low: pd.Series, close: pd.Series) -> pd.Series:
-        _ = self.cfg.bop
-        return ta.BOP(opn, high, low, close)
-
-    def __cal_cci(self, high: pd.Series, low: pd.Series, close: pd.Series) -> pd.Series:
-        timeperiod = self.cfg.cci
-        return ta.CCI(high, low, close, timeperiod=timeperiod)
-
-    def __cal_cmo(self, close: pd.Series) -> pd.Series:
-        timeperiod = self.cfg.cmo
-        return ta.CMO(close, timeperiod=timeperiod)
-
-    def __cal_rsi(self, close: pd.Series) -> pd.Series:
-        timeperiod = self.cfg.rsi
-        return ta.RSI(close, timeperiod=timeperiod)
-
-    def __cal_mfi(self, high: pd.Series, low: pd.Series, close: pd.Series, volume: pd.Series) -> pd.Series:
-        timeperiod = self.cfg.mfi
-        return ta.MFI(high, low, close, volume, timeperiod=timeperiod)
-
-    def __cal_willr(self, high: pd.Series, low: pd.Series, close: pd.Series) -> pd.Series:
-        timeperiod = self.cfg.willr
-        return ta.WILLR(high, low, close, timeperiod=timeperiod)
-
-    def __cal_adosc(self, high: pd.Series, low: pd.Series, close: pd.Series, volume: pd.Series) -> pd.Series:
-        fast, slow = self.cfg.adosc
-        adosc = ta.ADOSC(high, low, close, volume, fastperiod=fast, slowperiod=slow)
-        vol_ma = volume.rolling(slow).mean()
-        return adosc / vol_ma
-
-    def __cal_obv(self, close: pd.Series, volume: pd.Series) -> pd.Series:
-        timeperiod = self.cfg.obv
-        obv = ta.OBV(close, volume)
-        diff_obv = obv - obv.shift(timeperiod)
-        vol_ma = volume.rolling(timeperiod).mean()
-        return diff_obv / vol_ma
-
-    def __cal_natr(self, high: pd.Series, low: pd.Series, close: pd.Series) -> pd.Series:
-        timeperiod = self.cfg.natr
-        return ta.NATR(high, low, close, timeperiod=timeperiod)
+    def get_win_start_date(self, bgn_date: str, calendar: CCalendar) -> str:
+        if self.warmup_multiple is None:
+            return self.default_bgn_date
+        warmup = get_ta_lookback(self.cfg) * self.warmup_multiple
+        return max(self.default_bgn_date, calendar.get_start_date(bgn_date, warmup, -5))
 
     def cal_factor_by_instru(self, instru: str, bgn_date: str, stp_date: str, calendar: CCalendar) -> pd.DataFrame:
-        win_start_date = "20120104"
+        win_start_date = self.get_ckp_bgn_date(
+            self.db_struct_preprocess.copy_to_another(another_db_name=f"{instru}.db"),
+            default=self.get_win_start_date(bgn_date, calendar),
+        )
         major_data = self.load_preprocess(
             instru, bgn_date=win_start_date, stp_date=stp_date,
             values=[
@@ -1032,24 +931,21 @@ class CFactorTA(CFactorRaw):
                 "vol_major", "amount_major", "oi_major"
             ],
         )
-        opn, close = major_data["openI"], major_data["closeI"]
-        high, low = major_data["highI"], major_data["lowI"]
-        volume, amount = major_data["vol_major"], major_data["amount_major"]
-
-        major_data[self.cfg.name_macd] = self.__cal_macd(close=close)
-        major_data[self.cfg.name_bbands] = self.__cal_bbands(close=close)
-        major_data[self.cfg.name_sar] = self.__cal_sar(high=high, low=low, close=close)
-        major_data[self.cfg.name_adx] = self.__cal_adx(high=high, low=low, close=close)
-        major_data[self.cfg.name_bop] = self.__cal_bop(opn=opn, high=high, low=low, close=close)
-        major_data[self.cfg.name_cci] = self.__cal_cci(high=high, low=low, close=close)
-        major_data[self.cfg.name_cmo] = self.__cal_cmo(close=close)
-        major_data[self.cfg.name_rsi] = self.__cal_rsi(close=close)
-        major_data[self.cfg.name_mfi] = self.__cal_mfi(high=high, low=low, close=close, volume=volume)
-        major_data[self.cfg.name_willr] = self.__cal_willr(high=high, low=low, close=close)
-        major_data[self.cfg.name_adosc] = self.__cal_adosc(high=high, low=low, close=close, volume=volume)
-        major_data[self.cfg.name_obv] = self.__cal_obv(close=close, volume=volume)
-        major_data[self.cfg.name_natr] = self.__cal_natr(high=high, low=low, close=close)
+        opn, high, low, close, volume = [
+            major_data[z].to_numpy(np.float64) for z in ["openI", "highI", "lowI", "closeI", "vol_major"]
+        ]
+        for factor_name, values in cal_ta_indicators(self.cfg, opn, high, low, close, volume).items():
+            major_data[factor_name] = values
 
         self.rename_ticker(major_data)
         factor_data = self.get_factor_data(major_data, bgn_date)
         return factor_data
+
+    def cal_factor_for_universe(self, bgn_date: str, stp_date: str, calendar: CCalendar) -> dict[str, pd.DataFrame]:
+        panel = self.load_preprocess_panel(
+            bgn_date=self.get_win_start_date(bgn_date, calendar), stp_date=stp_date,
+            values=["trade_date", "ticker_major", "openI", "highI", "lowI", "closeI", "vol_major"],
+            threads=self.threads,
+        )
+        factor_panel = cal_ta_for_panel(self.cfg, panel)
+        return self.get_factor_data_from_panel(panel, factor_panel, bgn_date)
@@ -0,0 +1,126 @@
+import pandas as pd
+from dataclasses import dataclass
+from husfort.qsqlite import CDbStruct
+from solutions.storage import gen_db_mgr
+
+"""
+-------------------------------------------------------------
+Part I: read-through cache for inputs of factors, shared by
+        all factor classes working on the same instrument
+-------------------------------------------------------------
+"""
+
+
+@dataclass
+class CCacheStats:
+    read_rows: int = 0  # rows read from sqlite
+    read_bytes: int = 0  # bytes read from sqlite
+    served_rows: int = 0  # rows served to factors, which would be read from sqlite without cache
+    served_bytes: int = 0  # bytes served to factors, which would be read from sqlite without cache
+
+    def __add__(self, other: "CCacheStats") -> "CCacheStats":
+        return CCacheStats(
+            read_rows=self.read_rows + other.read_rows,
+            read_bytes=self.read_bytes + other.read_bytes,
+            served_rows=self.served_rows + other.served_rows,
+            served_bytes=self.served_bytes + other.served_bytes,
+        )
+
+    @property
+    def saved_rows(self) -> int:
+        return self.served_rows - self.read_rows
+
+    @property
+    def saved_bytes(self) -> int:
+        return self.served_bytes - self.read_bytes
+
+
+@dataclass(frozen=True)
+class CReadRange:
+    bgn_date: str
+    stp_date: str
+    columns: tuple[str, ...] | None  # None for all columns
+
+    def covers(self, other: "CReadRange") -> bool:
+        if not (self.bgn_date <= other.bgn_date and other.stp_date <= self.stp_date):
+            return False
+        if self.columns is None:
+            return True
+        return (other.columns is not None) and set(other.columns).issubset(self.columns)
+
+    def union(self, other: "CReadRange") -> "CReadRange":
+        if self.columns is None or other.columns is None:
+            columns = None
+        else:
+            columns = tuple(dict.fromkeys(self.columns + other.columns))
+        return CReadRange(
+            bgn_date=min(self.bgn_date, other.bgn_date),
+            stp_date=max(self.stp_date, other.stp_date),
+            columns=columns,
+        )
+
+
+"""
+key of a table: (db_save_dir, db_name, table_name)
+key of a plan : (db_save_dir, table_name), tables of different instruments share the same plan
+"""
+TTableKey = tuple[str, str, str]
+TPlanKey = tuple[str, str]
+TReadPlan = dict[TPlanKey, CReadRange]
+
+
+class CInstruDataCache:
+    def __init__(self, plan: TReadPlan = None):
+        """
+
+        :param plan: the union of ranges and columns requested by all factor classes
+                     for each kind of table, usually learned from the first instrument.
+                     With it, each table is read only once. Requests out of the cached
+                     range or columns make the table be read again with the union of both.
+        """
+        self.data: dict[TTableKey, tuple[CReadRange, pd.DataFrame]] = {}
+        self.plan: TReadPlan = dict(plan) if plan else {}
+        self.stats = CCacheStats()
+
+    def read_by_range(
+            self, db_struct: CDbStruct, bgn_date: str, stp_date: str, value_columns: list[str] = None
+    ) -> pd.DataFrame:
+        table_key = (db_struct.db_save_dir, db_struct.db_name, db_struct.table.name)
+        plan_key = (db_struct.db_save_dir, db_struct.table.name)
+        request = CReadRange(bgn_date, stp_date, tuple(value_columns) if value_columns else None)
+        self.plan[plan_key] = self.plan[plan_key].union(request) if plan_key in self.plan else request
+
+        if table_key in self.data and self.data[table_key][0].covers(request):
+            cached_range, cached_data = self.data[table_key]
+        else:
+            cached_range = self.plan[plan_key]
+            if table_key in self.data:
+                cached_range = cached_range.union(self.data[table_key][0])
+            cached_data = self.read_from_db(db_struct, cached_range)
+            self.data[table_key] = (cached_range, cached_data)
+
+        mask = (cached_data["trade_date"] >= bgn_date) & (cached_data["trade_date"] < stp_date)
+        columns = value_columns or cached_data.columns.tolist()
+        res = cached_data.loc[mask, columns].reset_index(drop=True)
+        self.stats.served_rows += len(res)
+        self.stats.served_bytes += int(res.memory_usage(index=False, deep=True).sum())
+        return res
+
+    def read_from_db(self, db_struct: CDbStruct, read_range: CReadRange) -> pd.DataFrame:
+        sqldb = gen_db_mgr(
+            db_save_dir=db_struct.db_save_dir,
+            db_name=db_struct.db_name,
+            table=db_struct.table,
+            mode="r",
+        )
+        if read_range.columns is None:
+            value_columns = None
+        else:
+            value_columns = list(dict.fromkeys(("trade_date",) + read_range.columns))
+        data = sqldb.read_by_range(read_range.bgn_date, read_range.stp_date, value_columns=value_columns)
+        self.stats.read_rows += len(data)
+        self.stats.read_bytes += int(data.memory_usage(index=False, deep=True).sum())
+        return data
+
+    def clear(self):
+        self.data.clear()
@@ -0,0 +1,158 @@
+import os
+import pandas as pd
+from husfort.qsqlite import CDbStruct
+from husfort.qcalendar import CCalendar
+from husfort.qutility import check_and_makedirs
+from solutions.factorCache import TTableKey
+from solutions.storage import gen_db_mgr
+
+"""
+----------------------------------------------------------------
+Part I: checkpoints of factor inputs, one file for each pair of
+        (factor class, instrument). A checkpoint keeps the last
+        rows of every table read by the factor class, which are
+        enough to cover the lookback of the next run. Then the
+        next run only needs to read new rows from sqlite.
+----------------------------------------------------------------
+"""
+
+
+# rows of the last dates of each tail are compared with sqlite, to find sources rebuilt or revised
+FINGERPRINT_DATES = 3
+
+
+def get_table_key(db_struct: CDbStruct) -> TTableKey:
+    return db_struct.db_save_dir, db_struct.db_name, db_struct.table.name
+
+
+class CInputTail:
+    def __init__(self, bgn_date: str, all_columns: bool, data: pd.DataFrame):
+        """
+
+        :param bgn_date: the first date this tail covers, data may have no rows on it
+        :param all_columns: whether data is read with all columns of the table
+        :param data: rows with trade_date in [bgn_date, last_date of checkpoint]
+        """
+        self.bgn_date = bgn_date
+        self.all_columns = all_columns
+        self.data = data
+
+    def covers(self, bgn_date: str, values: list[str] | None) -> bool:
+        if bgn_date < self.bgn_date:
+            return False
+        if values is None:
+            return self.all_columns
+        return set(values).issubset(self.data.columns)
+
+    def get(self, bgn_date: str, values: list[str] | None) -> pd.DataFrame:
+        columns = values or self.data.columns.tolist()
+        return self.data.loc[self.data["trade_date"] >= bgn_date, columns].reset_index(drop=True)
+
+
+class CInputCheckpoint:
+    def __init__(self, save_dir: str, instru: str, signature: list[str]):
+        """
+
+        :param save_dir: directory to save checkpoints of a factor class
+        :param instru:
+        :param signature: a checkpoint is stale if its signature is different, like factor names
+        """
+        self.save_dir = save_dir
+        self.instru = instru
+        self.signature = list(signature)
+        self.last_date: str | None = None
+        self.next_date: str | None = None  # rows since next_date must be read from sqlite
+        self.tails: dict[TTableKey, CInputTail] = {}
+        self.records: dict[TTableKey, tuple[CDbStruct, str, bool, pd.DataFrame]] = {}
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.save_dir, f"{self.instru}.pkl")
+
+    def load(self, bgn_date: str, calendar: CCalendar) -> bool:
+        """
+        load tails from file, a checkpoint is valid only if its last date is
+        exactly the previous trade date of bgn_date, its signature is the same,
+        and rows of the last dates of each tail are still the same in sqlite.
+
+        :return: whether a valid checkpoint is loaded
+        """
+        self.last_date, self.next_date, self.tails = None, None, {}
+        if not os.path.exists(self.path):
+            return False
+        ckp = pd.read_pickle(self.path)
+        if ckp["signature"] != self.signature or ckp["last_date"] != calendar.get_next_date(bgn_date, -1):
+            return False
+        if (fingerprints := ckp.get("fingerprints")) is None:
+            return False
+        if not all(self.is_source_unchanged(*v, stp_date=bgn_date) for v in fingerprints.values()):
+            return False
+        self.last_date, self.next_date = ckp["last_date"], bgn_date
+        self.tails = {k: CInputTail(*v) for k, v in ckp["tails"].items()}
+        return True
+
+    @staticmethod
+    def is_source_unchanged(db_struct: CDbStruct, bgn_date: str, rows: pd.DataFrame, stp_date: str) -> bool:
+        """
+
+        :param rows: rows in [bgn_date, stp_date) read when the checkpoint was saved
+        """
+        sqldb = gen_db_mgr(
+            db_save_dir=db_struct.db_save_dir,
+            db_name=db_struct.db_name,
+            table=db_struct.table,
+            mode="r",
+        )
+        src_rows = sqldb.read_by_range(bgn_date, stp_date, value_columns=rows.columns.tolist())
+        if src_rows.shape != rows.shape:
+            return False
+        try:
+            src_rows = src_rows.astype(rows.dtypes.to_dict())
+        except (ValueError, TypeError):
+            return False
+        return src_rows.reset_index(drop=True).equals(rows.reset_index(drop=True))
+
+    def get_tail(self, table_key: TTableKey, bgn_date: str, values: list[str] | None) -> CInputTail | None:
+        if (tail := self.tails.get(table_key)) is not None and tail.covers(bgn_date, values):
+            return tail
+        return None
+
+    def get_bgn_date(self, table_key: TTableKey) -> str | None:
+        return tail.bgn_date if (tail := self.tails.get(table_key)) is not None else None
+
+    def record(self, db_struct: CDbStruct, bgn_date: str, values: list[str] | None, data: pd.DataFrame):
+        """
+        record data read in this run, new tails are cut from them when saving
+
+        """
+        self.records[get_table_key(db_struct)] = (db_struct, bgn_date, values is None, data.copy())
+
+    def save(self, bgn_date: str, stp_date: str, calendar: CCalendar, max_lookback: int | None = None):
+        """
+        For each table, the lookback of this run is the number of trade dates in
+        [bgn date of reading, bgn_date). The next run will start from the next trade date
+        after stp_date, so the same number of trade dates before it are kept.
+
+        :param max_lookback: max number of trade dates to keep for each table, None for no limit
+        """
+        if not (iter_dates := calendar.get_iter_list(bgn_date, stp_date)):
+            return 0
+        last_date = iter_dates[-1]
+        tails, fingerprints = {}, {}
+        fingerprint_bgn_date = calendar.get_next_date(last_date, 1 - FINGERPRINT_DATES)
+        for table_key, (db_struct, read_bgn_date, all_columns, data) in self.records.items():
+            lookback = len(calendar.get_iter_list(read_bgn_date, bgn_date))
+            if max_lookback is not None:
+                lookback = min(lookback, max_lookback)
+            tail_bgn_date = calendar.get_next_date(last_date, 1 - lookback)
+            tail_data = data.loc[data["trade_date"] >= tail_bgn_date].reset_index(drop=True)
+            tails[table_key] = (tail_bgn_date, all_columns, tail_data)
+            fp_bgn_date = max(fingerprint_bgn_date, tail_bgn_date)
+            fp_rows = tail_data.loc[tail_data["trade_date"] >= fp_bgn_date].reset_index(drop=True)
+            fingerprints[table_key] = (db_struct, fp_bgn_date, fp_rows)
+        check_and_makedirs(self.save_dir)
+        pd.to_pickle(
+            {"signature": self.signature, "last_date": last_date, "tails": tails, "fingerprints": fingerprints},
+            self.path,
+        )
+        return 0
@@ -0,0 +1,199 @@
+import numpy as np
+import pandas as pd
+
+"""
+---------------------------------------------------------
+Part I: segments of minute bars
+        minute bars of one day form a contiguous segment,
+        segment k = [offsets[k], offsets[k + 1])
+---------------------------------------------------------
+"""
+
+
+def split_segments(keys: pd.Series) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    The same grouping as pd.DataFrame.groupby(by=keys): groups are sorted by key and
+    rows keep their original order in each group.
+
+    :param keys: like minute_bar_data["trade_date"]
+    :return: (order, unique_keys, offsets), data.iloc[order] is contiguous by key,
+             offsets is a 1-D int array with length = len(unique_keys) + 1
+    """
+    k = keys.to_numpy()
+    order = np.argsort(k, kind="stable")
+    unique_keys, index = np.unique(k[order], return_index=True)
+    offsets = np.append(index, len(k))
+    return order, unique_keys, offsets
+
+
+def segment_ids(offsets: np.ndarray) -> np.ndarray:
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+
+def segment_positions(offsets: np.ndarray) -> np.ndarray:
+    """
+
+    :return: position of each row in its segment, starting from 0
+    """
+    return np.arange(offsets[-1]) - np.repeat(offsets[:-1], np.diff(offsets))
+
+
+def segment_sum(a: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """
+    nan is propagated, which is the same as pd.Series.__matmul__
+
+    """
+    return np.add.reduceat(a, offsets[:-1]) if len(a) > 0 else np.zeros(0)
+
+
+def segment_nansum(a: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """
+    nan is skipped, which is the same as pd.Series.sum()
+
+    """
+    return segment_sum(np.where(np.isnan(a), 0, a), offsets)
+
+
+def segment_first_true(mask: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """
+
+    :return: the first position of True in each segment, -1 if not found
+    """
+    pos = np.where(mask, segment_positions(offsets), np.iinfo(np.int64).max)
+    r = np.minimum.reduceat(pos, offsets[:-1]) if len(mask) > 0 else np.zeros(0, dtype=np.int64)
+    return np.where(r == np.iinfo(np.int64).max, -1, r)
+
+
+"""
+--------------------------------------------
+Part II: intraday factors from minute bars
+         all functions return one value per
+         segment, inputs are not modified
+--------------------------------------------
+"""
+
+
+def cal_extreme_return(ret: np.ndarray, offsets: np.ndarray, dfts: list[int]) -> pd.DataFrame:
+    """
+    extreme return of each segment: the max if max + min > 2 * median else the min,
+    the first one is used if there are more than one. dxr of shift d is the return
+    d bars before the extreme one, or the extreme one if it does not exist.
+    Both are multiplied by -1.
+
+    :param ret: 1-D array, minute return without nan
+    :param offsets:
+    :param dfts: shifts of dxr
+    :return: pd.DataFrame with columns = ["EXR_RAW", "DXR{d:02d}_RAW", ...], one row per segment
+    """
+    if len(ret) == 0:
+        return pd.DataFrame(columns=["EXR_RAW"] + [f"DXR{d:02d}_RAW" for d in dfts], dtype=np.float64)
+    seg_len, starts = np.diff(offsets), offsets[:-1]
+    ret_max = np.maximum.reduceat(ret, starts)
+    ret_min = np.minimum.reduceat(ret, starts)
+    srt_ret = ret[np.lexsort((ret, segment_ids(offsets)))]
+    ret_median = (srt_ret[starts + (seg_len - 1) // 2] + srt_ret[starts + seg_len // 2]) / 2
+
+    seg_ret_max, seg_ret_min = np.repeat(ret_max, seg_len), np.repeat(ret_min, seg_len)
+    with np.errstate(invalid="ignore"):
+        use_max = (ret_max + ret_min) > (2 * ret_median)
+    idx_exr = np.where(
+        use_max,
+        segment_first_true(ret == seg_ret_max, offsets),
+        segment_first_true(ret == seg_ret_min, offsets),
+    )
+    exr = np.where(use_max, -ret_max, -ret_min)
+    res = {"EXR_RAW": exr}
+    for d in dfts:
+        idx_dxr = idx_exr - d
+        res[f"DXR{d:02d}_RAW"] = np.where(idx_dxr >= 0, -ret[starts + np.maximum(idx_dxr, 0)], exr)
+    return pd.DataFrame(res)
+
+
+def cal_smart_idx(ret: np.ndarray, vol: np.ndarray) -> np.ndarray:
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(vol > 1, np.abs(ret) / np.log(vol) * 1e4, 0)
+
+
+def cal_smart_money(
+        ret: np.ndarray, vol: np.ndarray, amount: np.ndarray, prc: np.ndarray,
+        smart_idx: np.ndarray, offsets: np.ndarray, lbds: list[float],
+) -> dict[float, tuple[np.ndarray, np.ndarray]]:
+    """
+    rows in each segment are sorted by smart_idx in descending order(stable) first,
+    then the first rows whose cumulative volume reach lbd of the total volume are
+    selected as smart money. Prices and returns of smart money and of all rows are
+    weighted by amount, smt_p and smt_r are the differences between them in bp.
+
+    :param ret: 1-D array, minute return
+    :param vol: 1-D array, minute volume
+    :param amount: 1-D array, minute amount
+    :param prc: 1-D array, minute price, like vwap
+    :param smart_idx: 1-D array, output of cal_smart_idx
+    :param offsets:
+    :param lbds: ratio of volume selected as smart money
+    :return: a dict with key = lbd, value = (smt_p, smt_r), each is a 1-D array, one value per segment
+    """
+    sid = segment_ids(offsets)
+    order = np.lexsort((-smart_idx, sid))
+    ret, vol, amount, prc = ret[order], vol[order], amount[order], prc[order]
+    seg_len = np.diff(offsets)
+
+    # total price and ret
+    tot_amt_sum = segment_nansum(amount, offsets)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        tot_w = amount / np.repeat(tot_amt_sum, seg_len)
+        tot_prc = segment_sum(prc * tot_w, offsets)
+        tot_ret = segment_sum(ret * tot_w, offsets)
+
+    # cumulative volume in each segment, nan is skipped like pd.Series.cumsum()
+    vol_valid = ~np.isnan(vol)
+    vol_0 = np.where(vol_valid, vol, 0)
+    cum_vol = np.cumsum(vol_0)
+    cum_vol = cum_vol - np.repeat(cum_vol[offsets[:-1]] - vol_0[offsets[:-1]], seg_len)
+    tot_vol = segment_sum(vol_0, offsets)
+    pos = segment_positions(offsets)
+
+    res: dict[float, tuple[np.ndarray, np.ndarray]] = {}
+    for lbd in lbds:
+        # select smart data from total
+        volume_threshold = np.repeat(tot_vol * lbd, seg_len)
+        n = segment_sum((vol_valid & (cum_vol < volume_threshold)).astype(np.int64), offsets) + 1
+        in_smt = pos < np.repeat(n, seg_len)
+
+        # smart price and ret
+        smt_amt_sum = segment_nansum(np.where(in_smt, amount, 0), offsets)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            smt_w = np.where(in_smt, amount / np.repeat(smt_amt_sum, seg_len), 0)
+            smt_prc = segment_sum(np.where(in_smt, prc * smt_w, 0), offsets)
+            smt_ret = segment_sum(np.where(in_smt, ret * smt_w, 0), offsets)
+            smt_p = np.where(tot_prc > 0, (smt_prc / tot_prc - 1) * 1e4, 0)
+            smt_r = np.where(np.isinf(tot_ret), 0, (smt_ret - tot_ret) * 1e4)
+        available = (tot_amt_sum > 0) & (smt_amt_sum > 0)
+        res[lbd] = (np.where(available, smt_p, np.nan), np.where(available, smt_r, np.nan))
+    return res
+
+
+def cal_range_weighted_time_center(ret: np.ndarray, offsets: np.ndarray) -> pd.DataFrame:
+    """
+    time center of bars with positive(negative) returns in each segment, weighted by
+    absolute return and scaled by segment length. It is 0 if no such bars.
+
+    :param ret: 1-D array, minute return
+    :param offsets:
+    :return: pd.DataFrame with columns = ["RWTCU", "RWTCD", "RWTCT", "RWTCV"], one row per segment
+    """
+    seg_len = np.diff(offsets)
+    pos = segment_positions(offsets).astype(np.float64)
+    abs_ret = np.abs(ret)
+
+    def time_center(mask: np.ndarray) -> np.ndarray:
+        w_sum = segment_sum(np.where(mask, abs_ret, 0), offsets)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            w = np.where(mask, abs_ret / np.repeat(w_sum, seg_len), 0)
+        tc = segment_sum(pos * w, offsets) / seg_len
+        return np.where(segment_sum(mask.astype(np.int64), offsets) > 0, tc, 0)
+
+    rwtc_u, rwtc_d = time_center(ret > 0), time_center(ret < 0)
+    rwtc_t = rwtc_u - rwtc_d
+    rwtc_v = np.abs(rwtc_t)
+    return pd.DataFrame({"RWTCU": rwtc_u, "RWTCD": rwtc_d, "RWTCT": rwtc_t, "RWTCV": rwtc_v})
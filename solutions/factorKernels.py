@@ -0,0 +1,460 @@
+import warnings
+import numpy as np
+import scipy.stats as sps
+from numpy.lib.stride_tricks import sliding_window_view
+
+"""
+-------------------------------------------------------
+Part I: array kernels shared by factor classes
+        all functions in this module never modify inputs
+-------------------------------------------------------
+"""
+
+
+def rolling_windows(a: np.ndarray, win: int) -> np.ndarray:
+    """
+
+    :param a: array with shape = (n, ...), windows are along the first axis
+    :param win: window size
+    :return: a read-only strided view with shape = (n - win + 1, ..., win),
+             element j = a[j: j + win], which is the window ending at position j + win - 1
+    """
+    return sliding_window_view(a, win, axis=0)
+
+
+def argsort_descending(a: np.ndarray) -> np.ndarray:
+    """
+    Row-wise indexer of sorting in descending order, nan last. The order of ties is
+    the same as pd.DataFrame.sort_values(by=..., ascending=False), which reverses
+    the data, sorts it with quicksort and reverses the result.
+
+    :param a: 2-D array with shape = (n, k)
+    :return: 2-D int array with shape = (n, k)
+    """
+    k = a.shape[1]
+    order = (k - 1 - np.argsort(a[:, ::-1], axis=1, kind="quicksort"))[:, ::-1]
+    for j in np.flatnonzero(np.isnan(a).any(axis=1)):
+        row, mask = a[j], np.isnan(a[j])
+        non_nan_idx = np.flatnonzero(~mask)[::-1]
+        srt_idx = non_nan_idx[np.argsort(row[non_nan_idx], kind="quicksort")][::-1]
+        order[j] = np.concatenate([srt_idx, np.flatnonzero(mask)])
+    return order
+
+
+def cal_spearman_corr(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """
+    Spearman correlation along the last axis, rows with nan in x or y are excluded
+    pair-wisely, which is the same as pd.DataFrame.corr(method="spearman")
+
+    :param x: array with shape = (..., k)
+    :param y: array with shape = (..., k)
+    :return: array with shape = (...,), nan if less than 2 valid pairs or zero variance
+    """
+    valid = ~(np.isnan(x) | np.isnan(y))
+    rx = sps.rankdata(np.where(valid, x, np.nan), axis=-1, nan_policy="omit")
+    ry = sps.rankdata(np.where(valid, y, np.nan), axis=-1, nan_policy="omit")
+    n = valid.sum(axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        dx = np.where(valid, rx - (np.nansum(rx, axis=-1) / n)[..., None], 0)
+        dy = np.where(valid, ry - (np.nansum(ry, axis=-1) / n)[..., None], 0)
+        sxy, sxx, syy = (dx * dy).sum(axis=-1), (dx * dx).sum(axis=-1), (dy * dy).sum(axis=-1)
+        divisor = np.sqrt(sxx * syy)
+        r = np.where((n >= 2) & (divisor > 0), sxy / divisor, np.nan)
+    return r
+
+
+def cal_rolling_top_corr_batch(
+        x: np.ndarray, y: np.ndarray, sort_var: np.ndarray,
+        wins: list[int], tops: list[float],
+        bgn_pos: int = 0, stp_pos: int | None = None,
+) -> dict[tuple[int, float], np.ndarray]:
+    """
+    For each position i, window = [i - win + 1, i], select top_size = int(win * top) + 1 rows
+    with the largest sort_var (same tie order as pandas, nan last), then calculate the
+    Spearman correlation between x and y of the selected rows.
+
+    :param x: 1-D array
+    :param y: 1-D array
+    :param sort_var: 1-D array
+    :param wins:
+    :param tops:
+    :param bgn_pos: first position to calculate
+    :param stp_pos: stop position(not included) to calculate, None for all
+    :return: a dict with key = (win, top), value = 1-D array with the same length as x,
+             positions out of [max(bgn_pos, win - 1), stp_pos) are nan
+    """
+    n = len(x)
+    stp_pos = n if stp_pos is None else min(stp_pos, n)
+    res: dict[tuple[int, float], np.ndarray] = {}
+    for win in wins:
+        # windows ending at position i in [i0, stp_pos)
+        i0 = max(bgn_pos, win - 1)
+        j0, j1 = i0 - win + 1, stp_pos - win + 1
+        if j1 <= j0:
+            for top in tops:
+                res[(win, top)] = np.full(n, np.nan)
+            continue
+
+        wx, wy = rolling_windows(x, win)[j0:j1], rolling_windows(y, win)[j0:j1]
+        ws = rolling_windows(sort_var, win)[j0:j1]
+        order = argsort_descending(ws)
+        for top in tops:
+            top_size = int(win * top) + 1
+            idx = order[:, :top_size]
+            r = cal_spearman_corr(np.take_along_axis(wx, idx, axis=1), np.take_along_axis(wy, idx, axis=1))
+            out = np.full(n, np.nan)
+            out[i0:stp_pos] = r
+            res[(win, top)] = out
+    return res
+
+
+def cal_rolling_top_bottom_mean_batch(
+        x: np.ndarray, sort_var: np.ndarray,
+        wins: list[int], lbds: list[float],
+        bgn_pos: int = 0, stp_pos: int | None = None,
+) -> dict[tuple[int, float], tuple[np.ndarray, np.ndarray]]:
+    """
+    For each position i, window = [i - win + 1, i], sort rows by sort_var in descending
+    order (same tie order as pandas, nan last), then calculate the mean of x of the first
+    top_size = int(win * lbd) + 1 rows and the mean of x of the last top_size rows.
+    Each window is sorted only once and shared by all lbds.
+
+    :param x: 1-D array
+    :param sort_var: 1-D array
+    :param wins:
+    :param lbds:
+    :param bgn_pos: first position to calculate
+    :param stp_pos: stop position(not included) to calculate, None for all
+    :return: a dict with key = (win, lbd), value = (mean of head, mean of tail),
+             each is a 1-D array with the same length as x,
+             positions out of [max(bgn_pos, win - 1), stp_pos) are nan
+    """
+    n = len(x)
+    stp_pos = n if stp_pos is None else min(stp_pos, n)
+    res: dict[tuple[int, float], tuple[np.ndarray, np.ndarray]] = {}
+    for win in wins:
+        i0 = max(bgn_pos, win - 1)
+        j0, j1 = i0 - win + 1, stp_pos - win + 1
+        if j1 <= j0:
+            for lbd in lbds:
+                res[(win, lbd)] = (np.full(n, np.nan), np.full(n, np.nan))
+            continue
+
+        wx = rolling_windows(x, win)[j0:j1]
+        order = argsort_descending(rolling_windows(sort_var, win)[j0:j1])
+        sorted_x = np.take_along_axis(wx, order, axis=1)
+        for lbd in lbds:
+            top_size = int(win * lbd) + 1
+            h, l = np.full(n, np.nan), np.full(n, np.nan)
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", category=RuntimeWarning)  # mean of empty slice
+                h[i0:stp_pos] = np.nanmean(sorted_x[:, :top_size], axis=1)
+                l[i0:stp_pos] = np.nanmean(sorted_x[:, -top_size:], axis=1)
+            res[(win, lbd)] = (h, l)
+    return res
+
+
+"""
+-------------------------------------------------------
+Part II: rolling beta and std
+         moments are calculated from prefix sums of data
+         shifted by its mean, instead of E[xy] - E[x]E[y].
+         Windows whose variance is tiny relative to the
+         second moment are ill-conditioned for this
+         formulation, they are recalculated by two-pass
+         centered sums over the strided windows.
+-------------------------------------------------------
+"""
+
+ILL_CONDITIONED_TOL = 1e-4
+
+
+def compensated_cumsum(a: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Prefix sums with a leading 0. The rounding error of every step of np.cumsum
+    is recovered exactly by TwoSum and accumulated separately, so the error of
+    window sums does not grow with the length of a.
+
+    :param a: array with shape = (n, ...), without nan, prefix sums are along the first axis
+    :return: (prefix, prefix_err), each is an array with shape = (n + 1, ...)
+    """
+    c, err = np.zeros((len(a) + 1,) + a.shape[1:]), np.zeros((len(a) + 1,) + a.shape[1:])
+    np.cumsum(a, axis=0, out=c[1:])
+    prv, cur = c[:-1], c[1:]
+    bb = cur - prv
+    e = np.subtract(prv, cur - bb)  # (prv - (cur - bb)) + (a - bb), without temporary arrays
+    e += np.subtract(a, bb, out=bb)
+    np.cumsum(e, axis=0, out=err[1:])
+    return c, err
+
+
+def window_sums(prefix: tuple[np.ndarray, np.ndarray], win: int) -> np.ndarray:
+    """
+
+    :param prefix: output of compensated_cumsum(a)
+    :param win: window size
+    :return: array with shape = (n - win + 1, ...), element j = a[j: j + win].sum(axis=0)
+    """
+    c, err = prefix
+    res = c[win:] - c[:-win]
+    res += err[win:] - err[:-win]
+    return res
+
+
+def rolling_centered_moments(
+        x: np.ndarray, y: np.ndarray, wins: list[int]
+) -> dict[int, tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Population moments of every full window, a window is valid only if all
+    pairs in it are not nan, which is the same as pd.Series.rolling(window=win).mean()
+    applied on x, y, x * y and so on. Prefix sums are shared by all wins.
+
+    :param x: 1-D array with length = n
+    :param y: 1-D array with length = n
+    :param wins:
+    :return: a dict with key = win, value = (var_x, var_y, cov_xy, const_x, const_y),
+             each is a 1-D array with length = n, var and cov are nan for invalid windows
+             and the first win - 1 positions, const_x(y) is True if x(y) does not change
+             in the window, var of a constant window is 0 exactly.
+    """
+    n = len(x)
+    invalid = np.isnan(x) | np.isnan(y)
+    x0 = np.where(invalid, 0, x - (np.mean(x[~invalid]) if not invalid.all() else 0))
+    y0 = np.where(invalid, 0, y - (np.mean(y[~invalid]) if not invalid.all() else 0))
+    prefixes = {
+        k: compensated_cumsum(v) for k, v in
+        {"x": x0, "y": y0, "xx": x0 * x0, "yy": y0 * y0, "xy": x0 * y0, "invalid": invalid.astype(np.float64)}.items()
+    }
+
+    res = {}
+    for win in wins:
+        var_x, var_y, cov_xy = np.full(n, np.nan), np.full(n, np.nan), np.full(n, np.nan)
+        const_x, const_y = np.zeros(n, dtype=bool), np.zeros(n, dtype=bool)
+        if n < win:
+            res[win] = (var_x, var_y, cov_xy, const_x, const_y)
+            continue
+
+        s = {k: window_sums(v, win) for k, v in prefixes.items()}
+        valid_win = s.pop("invalid") == 0
+        mx, my = s["x"] / win, s["y"] / win
+        exx, eyy = s["xx"] / win, s["yy"] / win
+        vx, vy, cv = exx - mx * mx, eyy - my * my, s["xy"] / win - mx * my
+        ill_x, ill_y = vx <= ILL_CONDITIONED_TOL * exx, vy <= ILL_CONDITIONED_TOL * eyy
+        cx, cy = np.zeros(len(vx), dtype=bool), np.zeros(len(vy), dtype=bool)
+
+        # recalculate ill-conditioned windows, constant windows are always among them
+        if (ill := np.flatnonzero(valid_win & (ill_x | ill_y))).size > 0:
+            wx, wy = rolling_windows(x0, win)[ill], rolling_windows(y0, win)[ill]
+            dx = wx - wx.mean(axis=1, keepdims=True)
+            dy = wy - wy.mean(axis=1, keepdims=True)
+            vx[ill], vy[ill], cv[ill] = (dx * dx).mean(axis=1), (dy * dy).mean(axis=1), (dx * dy).mean(axis=1)
+            cx[ill], cy[ill] = np.ptp(wx, axis=1) == 0, np.ptp(wy, axis=1) == 0
+        vx, vy = np.where(cx, 0, vx), np.where(cy, 0, vy)
+        cv = np.where(cx | cy, 0, cv)
+
+        var_x[win - 1:] = np.where(valid_win, vx, np.nan)
+        var_y[win - 1:] = np.where(valid_win, vy, np.nan)
+        cov_xy[win - 1:] = np.where(valid_win, cv, np.nan)
+        const_x[win - 1:], const_y[win - 1:] = cx, cy
+        res[win] = (var_x, var_y, cov_xy, const_x, const_y)
+    return res
+
+
+def cal_rolling_std(a: np.ndarray, win: int, min_periods: int) -> np.ndarray:
+    """
+    Sample(ddof = 1) std with the same window rules as
+    pd.Series.rolling(window=win, min_periods=min_periods).std(),
+    leading positions with less than win rows are calculated as partial windows.
+
+    :param a: 1-D array with length = n
+    :param win: window size
+    :param min_periods: minimum number of non-nan values in a window
+    :return: 1-D array with length = n
+    """
+    n = len(a)
+    pad = np.concatenate([np.full(win - 1, np.nan), a])
+    valid = ~np.isnan(pad)
+    res = np.full(n, np.nan)
+    if not valid.any():
+        return res
+    a0 = np.where(valid, pad - np.mean(pad[valid]), 0)
+    cnt = window_sums(compensated_cumsum(valid.astype(np.float64)), win)
+    s1, s2 = window_sums(compensated_cumsum(a0), win), window_sums(compensated_cumsum(a0 * a0), win)
+    ok = cnt >= max(min_periods, 2)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        m2 = s2 - s1 * s1 / cnt
+        var = m2 / (cnt - 1)
+
+    # recalculate ill-conditioned windows, constant windows are always among them
+    if (ill := np.flatnonzero(ok & (m2 <= ILL_CONDITIONED_TOL * s2))).size > 0:
+        wa = rolling_windows(np.where(valid, a0, np.nan), win)[ill]
+        d = wa - np.nanmean(wa, axis=1, keepdims=True)
+        const = np.nanmax(wa, axis=1) == np.nanmin(wa, axis=1)
+        var[ill] = np.where(const, 0, np.nansum(d * d, axis=1) / (cnt[ill] - 1))
+    res[ok] = np.sqrt(var[ok])
+    return res
+
+
+def cal_rolling_beta_batch(
+        x: np.ndarray, y: np.ndarray, wins: list[int], res_std_min_periods_ratio: float = 0.6,
+) -> dict[int, tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    For each win, regress y on x in the rolling window: y = beta * x + res
+
+    :param x: 1-D array
+    :param y: 1-D array
+    :param wins:
+    :param res_std_min_periods_ratio: res std is calculated with
+                                      rolling(window=win, min_periods=int(win * ratio))
+    :return: a dict with key = win, value = (beta, res, res_std), each is a 1-D array
+             with the same length as x. beta is nan if x is constant in the window.
+    """
+    res: dict[int, tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+    for win, (var_x, _, cov_xy, const_x, _) in rolling_centered_moments(x, y, wins).items():
+        with np.errstate(invalid="ignore", divide="ignore"):
+            beta = np.where(const_x, np.nan, cov_xy / var_x)
+        r = y - x * beta
+        r_std = cal_rolling_std(r, win, min_periods=int(win * res_std_min_periods_ratio))
+        res[win] = (beta, r, r_std)
+    return res
+
+
+"""
+-------------------------------------------------------------
+Part III: rolling sum, mean and skewness of many windows
+          rows of a 2-D array are dates and columns are
+          independent series, like instruments. Prefix sums of
+          x, x^2 and x^3 are shared by all windows. Window rules
+          are the same as pd.DataFrame.rolling(window=win,
+          min_periods=...), leading positions with less than win
+          rows are calculated as partial windows.
+-------------------------------------------------------------
+"""
+
+SKEW_VAR_TOL = 1e-14  # pandas returns nan for skewness if the variance is not greater than this
+
+
+def rolling_power_sums(
+        a: np.ndarray, wins: list[int], max_power: int, center: bool = False,
+) -> tuple[np.ndarray, dict[int, list[np.ndarray]]]:
+    """
+
+    :param a: 2-D array with shape = (n, k)
+    :param wins:
+    :param max_power: sums of a ** p for p in [0, max_power] are calculated, p = 0 is the count of non-nan
+    :param center: if True, each column is shifted by its mean at first
+    :return: (padded, {win: [cnt, s1, s2, ...]}), padded is the (shifted) a with max(wins) - 1 rows of
+             nan at the top, row i of cnt and sums is for the window ending at row i, shape = (n, k).
+    """
+    n, k = a.shape
+    pad = max(wins) - 1
+    padded = np.concatenate([np.full((pad, k), np.nan), a])
+    valid = ~np.isnan(padded)
+    if center and valid.any():
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=RuntimeWarning)  # mean of empty slice
+            padded -= np.nan_to_num(np.nanmean(padded, axis=0))
+    a0 = np.where(valid, padded, 0)
+    cnt_prefix = np.concatenate([np.zeros((1, k), dtype=np.int64), np.cumsum(valid, axis=0)])
+    prefixes, power = [], a0
+    for p in range(max_power):
+        prefixes.append(compensated_cumsum(power))
+        if p < max_power - 1:
+            power = power * a0
+
+    # windows ending at the first row of a start from row pad - win + 1 of padded
+    res: dict[int, list[np.ndarray]] = {}
+    for win in wins:
+        j = pad - win + 1
+        res[win] = [cnt_prefix[j + win:] - cnt_prefix[j:j + n]]
+        res[win] += [window_sums((c[j:], err[j:]), win) for c, err in prefixes]
+    return padded, res
+
+
+def get_windows(padded: np.ndarray, n: int, win: int, ill: tuple[np.ndarray, np.ndarray]) -> np.ndarray:
+    """
+
+    :param padded: the first output of rolling_power_sums
+    :param n: number of rows of a
+    :param win: window size
+    :param ill: (rows, cols) of a, where the windows end
+    :return: 2-D array with shape = (len(rows), win), nan is kept
+    """
+    rows, cols = ill
+    pad = padded.shape[0] - n
+    return rolling_windows(padded, win)[rows + pad - win + 1, cols]
+
+
+def cal_rolling_sum_mean_batch(
+        a: np.ndarray, wins: list[int], min_periods: dict[int, int] | None = None,
+) -> dict[int, tuple[np.ndarray, np.ndarray]]:
+    """
+    The same as pd.DataFrame(a).rolling(window=win, min_periods=min_periods[win]).sum() and .mean(),
+    a window whose non-nan values are all equal has the mean of that value exactly, like pandas.
+
+    :param a: 2-D array with shape = (n, k)
+    :param wins:
+    :param min_periods: a dict with key = win, value = minimum number of non-nan values, default is win
+    :return: a dict with key = win, value = (sum, mean), each is a 2-D array with shape = (n, k)
+    """
+    n = a.shape[0]
+    padded, sums = rolling_power_sums(a, wins, max_power=1)
+    # sums of squares are only used to find candidates of constant windows, so they are not compensated
+    sq = np.nan_to_num(padded * padded)
+    sq_prefix = np.concatenate([np.zeros((1,) + sq.shape[1:]), np.cumsum(sq, axis=0)])
+    res: dict[int, tuple[np.ndarray, np.ndarray]] = {}
+    for win, (cnt, s1) in sums.items():
+        ok = cnt >= (min_periods or {}).get(win, win)
+        s1[~ok] = np.nan
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = s1 / cnt
+        j = padded.shape[0] - n - win + 1
+        s2 = sq_prefix[j + win:] - sq_prefix[j:j + n]
+        if (ill := np.nonzero(s2 - s1 * mean <= ILL_CONDITIONED_TOL * s2))[0].size > 0:
+            wa = get_windows(padded, n, win, ill)
+            hi, lo = np.nanmax(wa, axis=1), np.nanmin(wa, axis=1)
+            mean[ill] = np.where(hi == lo, hi, mean[ill])
+        res[win] = (s1, mean)
+    return res
+
+
+def cal_rolling_skew_batch(
+        a: np.ndarray, wins: list[int], min_periods: dict[int, int] | None = None,
+) -> dict[int, np.ndarray]:
+    """
+    The same as pd.DataFrame(a).rolling(window=win, min_periods=min_periods[win]).skew(),
+    which is nan if less than 3 non-nan values or the variance is not greater than SKEW_VAR_TOL,
+    and 0 if all non-nan values are equal.
+
+    :param a: 2-D array with shape = (n, k)
+    :param wins:
+    :param min_periods: a dict with key = win, value = minimum number of non-nan values, default is win
+    :return: a dict with key = win, value = 2-D array with shape = (n, k)
+    """
+    n = a.shape[0]
+    padded, sums = rolling_power_sums(a, wins, max_power=3, center=True)
+    res: dict[int, np.ndarray] = {}
+    for win, (cnt, s1, s2, s3) in sums.items():
+        with np.errstate(invalid="ignore", divide="ignore"):
+            # sqrt(n * (n - 1)) / (n - 2) of all possible n in a window, nan for n < min periods
+            adj = np.sqrt(np.arange(win + 1) * np.arange(-1, win)) / np.arange(-2, win - 1)
+            adj[:max((min_periods or {}).get(win, win), 3)] = np.nan
+            adj = adj[cnt]
+            inv = 1.0 / cnt
+            m1, m2 = s1 * inv, s2 * inv
+            var = m2 - m1 * m1
+            m3 = s3 * inv - m1 * (m1 * m1 + 3 * var)
+
+            # recalculate ill-conditioned windows, constant windows are always among them
+            if (ill := np.nonzero((var <= ILL_CONDITIONED_TOL * m2) & (adj == adj)))[0].size > 0:
+                wa = get_windows(padded, n, win, ill)
+                d = wa - np.nanmean(wa, axis=1, keepdims=True)
+                var[ill], m3[ill] = np.nanmean(d * d, axis=1), np.nanmean(d * d * d, axis=1)
+                const = np.nanmax(wa, axis=1) == np.nanmin(wa, axis=1)
+            r = np.sqrt(var)
+            skew = m3 / (r * r * r) * adj
+        skew[var <= SKEW_VAR_TOL] = np.nan
+        if ill[0].size > 0:
+            skew[ill[0][const], ill[1][const]] = 0.0
+        res[win] = skew
+    return res
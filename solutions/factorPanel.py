@@ -0,0 +1,84 @@
+import functools
+import numpy as np
+import pandas as pd
+from dataclasses import dataclass
+
+"""
+------------------------------------------------------------
+Part I: inputs of all instruments aligned by trade date, for
+        factors calculated for the whole universe at once
+------------------------------------------------------------
+"""
+
+
+@dataclass
+class CInputPanel:
+    dates: np.ndarray  # 1-D array of sorted trade dates
+    instruments: list[str]
+    mask: np.ndarray  # 2-D bool array of dates x instruments, True if the instrument has data at the date
+    data: dict[str, np.ndarray]  # column -> 2-D array of dates x instruments
+
+    @staticmethod
+    def from_instru_data(instru_data: dict[str, pd.DataFrame]) -> "CInputPanel":
+        """
+
+        :param instru_data: a dict with key = instrument, value = data loaded by instrument,
+                            with column "trade_date" and unique dates
+        """
+        instruments = list(instru_data)
+        dates = np.unique(np.concatenate([df["trade_date"].to_numpy(dtype=object) for df in instru_data.values()]))
+        mask = np.zeros(shape=(len(dates), len(instruments)), dtype=bool)
+        columns = [z for z in next(iter(instru_data.values())).columns if z != "trade_date"] if instruments else []
+        data: dict[str, np.ndarray] = {}
+        for j, df in enumerate(instru_data.values()):
+            rows = np.searchsorted(dates, df["trade_date"].to_numpy(dtype=object))
+            mask[rows, j] = True
+            for z in columns:
+                values = df[z].to_numpy()
+                if z not in data:
+                    if values.dtype.kind in "iuf":
+                        data[z] = np.full(mask.shape, np.nan)
+                    else:
+                        data[z] = np.full(mask.shape, None, dtype=object)
+                data[z][rows, j] = values
+        return CInputPanel(dates=dates, instruments=instruments, mask=mask, data=data)
+
+    def get_by_instru(self, instru: str, columns: list[str] = None) -> pd.DataFrame:
+        """
+
+        :return: the same data as loaded by instrument
+        """
+        j = self.instruments.index(instru)
+        rows = self.mask[:, j]
+        res = pd.DataFrame({"trade_date": self.dates[rows]})
+        for z in columns or list(self.data):
+            res[z] = self.data[z][rows, j]
+        return res
+
+    @functools.cached_property
+    def compact_order(self) -> np.ndarray:
+        """
+
+        :return: 2-D int array, row indexer of each column, which moves dates of the instrument
+                 to the top of the column in order, and dates without data to the bottom
+        """
+        return np.argsort(~self.mask, axis=0, kind="stable")
+
+    def compact(self, values: np.ndarray) -> np.ndarray:
+        """
+
+        :param values: 2-D array of dates x instruments, like data[column]
+        :return: row i of column j is the i-th date of instrument j, so rolling along the first
+                 axis is the same as rolling the data loaded by instrument
+        """
+        return np.take_along_axis(values, self.compact_order, axis=0)
+
+    def expand(self, values: np.ndarray) -> np.ndarray:
+        """
+
+        :param values: 2-D float array in the layout of compact
+        :return: 2-D array of dates x instruments, NaN if the instrument has no data at that date
+        """
+        res = np.empty_like(values)
+        np.put_along_axis(res, self.compact_order, values, axis=0)
+        return np.where(self.mask, res, np.nan)
@@ -0,0 +1,130 @@
+import numpy as np
+import pandas as pd
+import talib as ta
+import talib.abstract as ta_abstract
+from typedef import CCfgFactorTA, TFactorName
+from solutions.factorPanel import CInputPanel
+
+"""
+-----------------------------------------------------------
+Part I: TA indicators of one instrument, on 1-D float arrays
+-----------------------------------------------------------
+"""
+
+
+def rolling_mean(x: np.ndarray, win: int) -> np.ndarray:
+    return pd.Series(x).rolling(win).mean().to_numpy()
+
+
+def cal_bbands(close: np.ndarray, timeperiod: int, up: int, dn: int) -> np.ndarray:
+    upper, middle, lower = ta.BBANDS(close, timeperiod=timeperiod, nbdevup=up, nbdevdn=dn, matype=0)
+    return np.where(close >= middle, upper / close - 1, lower / close - 1) * 100
+
+
+def cal_ta_indicators(
+        cfg: CCfgFactorTA,
+        opn: np.ndarray, high: np.ndarray, low: np.ndarray, close: np.ndarray, volume: np.ndarray,
+) -> dict[TFactorName, np.ndarray]:
+    """
+
+    :param cfg: config of TA
+    :param opn: open price, 1-D float64 array, so are high, low, close and volume
+    :return: a dict with key = factor name, value = 1-D array with the same length as inputs
+    """
+    res: dict[TFactorName, np.ndarray] = {}
+
+    fast, slow, diff = cfg.macd
+    _, _, res[cfg.name_macd] = ta.MACD(close, fastperiod=fast, slowperiod=slow, signalperiod=diff)
+
+    timeperiod, up, dn = cfg.bbands
+    res[cfg.name_bbands] = cal_bbands(close, timeperiod=timeperiod, up=up, dn=dn)
+
+    acceleration, maximum = cfg.sar
+    res[cfg.name_sar] = (close / ta.SAR(high, low, acceleration=acceleration, maximum=maximum) - 1) * 100
+
+    res[cfg.name_adx] = ta.ADX(high, low, close, timeperiod=cfg.adx)
+    res[cfg.name_bop] = ta.BOP(opn, high, low, close)
+    res[cfg.name_cci] = ta.CCI(high, low, close, timeperiod=cfg.cci)
+    res[cfg.name_cmo] = ta.CMO(close, timeperiod=cfg.cmo)
+    res[cfg.name_rsi] = ta.RSI(close, timeperiod=cfg.rsi)
+    res[cfg.name_mfi] = ta.MFI(high, low, close, volume, timeperiod=cfg.mfi)
+    res[cfg.name_willr] = ta.WILLR(high, low, close, timeperiod=cfg.willr)
+
+    fast, slow = cfg.adosc
+    adosc = ta.ADOSC(high, low, close, volume, fastperiod=fast, slowperiod=slow)
+    res[cfg.name_adosc] = adosc / rolling_mean(volume, slow)
+
+    obv = ta.OBV(close, volume)
+    diff_obv = np.full_like(obv, np.nan)
+    diff_obv[cfg.obv:] = obv[cfg.obv:] - obv[:-cfg.obv]
+    res[cfg.name_obv] = diff_obv / rolling_mean(volume, cfg.obv)
+
+    res[cfg.name_natr] = ta.NATR(high, low, close, timeperiod=cfg.natr)
+    return res
+
+
+def get_ta_lookback(cfg: CCfgFactorTA) -> int:
+    """
+
+    :return: the max number of leading dates without valid output among all indicators,
+             which is the lookback of TA-Lib, or window of moving average of volume.
+             Indicators with exponential smoothing, like MACD, ADX and RSI, need a warm-up
+             several times longer than this to converge.
+    """
+    fast, slow, diff = cfg.macd
+    timeperiod, _, _ = cfg.bbands
+    acceleration, maximum = cfg.sar
+    adosc_fast, adosc_slow = cfg.adosc
+    functions: list[tuple[str, dict]] = [
+        ("MACD", {"fastperiod": fast, "slowperiod": slow, "signalperiod": diff}),
+        ("BBANDS", {"timeperiod": timeperiod}),
+        ("SAR", {"acceleration": float(acceleration), "maximum": float(maximum)}),
+        ("ADX", {"timeperiod": cfg.adx}),
+        ("BOP", {}),
+        ("CCI", {"timeperiod": cfg.cci}),
+        ("CMO", {"timeperiod": cfg.cmo}),
+        ("RSI", {"timeperiod": cfg.rsi}),
+        ("MFI", {"timeperiod": cfg.mfi}),
+        ("WILLR", {"timeperiod": cfg.willr}),
+        ("ADOSC", {"fastperiod": adosc_fast, "slowperiod": adosc_slow}),
+        ("NATR", {"timeperiod": cfg.natr}),
+    ]
+    lookbacks = [adosc_slow - 1, cfg.obv]
+    for name, parameters in functions:
+        function = ta_abstract.Function(name)
+        function.set_parameters(**parameters)
+        lookbacks.append(function.lookback)
+    return max(lookbacks)
+
+
+"""
+----------------------------------------------------------
+Part II: TA indicators of all instruments in a panel, each
+         instrument is calculated on its own dates, so
+         results are the same as calculated one by one
+----------------------------------------------------------
+"""
+
+
+def cal_ta_for_panel(cfg: CCfgFactorTA, panel: CInputPanel) -> dict[TFactorName, np.ndarray]:
+    """
+    instruments are calculated one by one in this process, parallel runs use the
+    process pool of the per-instrument mode instead
+
+    :param cfg: config of TA
+    :param panel: with "openI", "highI", "lowI", "closeI" and "vol_major"
+    :return: a dict with key = factor name, value = 2-D array of dates x instruments,
+             NaN if the instrument has no data at that date
+    """
+    res = {z: np.full(panel.mask.shape, np.nan) for z in cfg.factor_names}
+
+    for j in range(len(panel.instruments)):
+        if not (rows := panel.mask[:, j]).any():
+            continue
+        opn, high, low, close, volume = [
+            np.ascontiguousarray(panel.data[z][rows, j], dtype=np.float64)
+            for z in ["openI", "highI", "lowI", "closeI", "vol_major"]
+        ]
+        for factor_name, values in cal_ta_indicators(cfg, opn, high, low, close, volume).items():
+            res[factor_name][rows, j] = values
+    return res
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+from functools import lru_cache
+
+"""
+----------------------------------------------
+Part I: term structure tools for CFactorTS
+        tickers are like "cu2401.SHF", "MA401.ZCE"
+----------------------------------------------
+"""
+
+
+@lru_cache(maxsize=None)
+def parse_contract_month(ticker: str) -> float:
+    """
+
+    :param ticker: like "cu2401.SHF"
+    :return: contract month, 1 for "cu2401.SHF", nan for empty ticker
+    """
+    if ticker == "":
+        return np.nan
+    contract = ticker.split(".")[0]
+    return float(int(contract[-2:]))
+
+
+def parse_contract_months(tickers: pd.Series) -> np.ndarray:
+    """
+    parse each unique ticker only once, parsed results are cached for later calls
+
+    :param tickers: a series of tickers, nan or "" for no contract
+    :return: 1-D float array with the same length as tickers
+    """
+    uniq, inv = np.unique(tickers.fillna("").to_numpy(dtype=str), return_inverse=True)
+    months = np.array([parse_contract_month(t) for t in uniq], dtype=np.float64)
+    return months[inv]
+
+
+def cal_roll_return(
+        ticker_n: pd.Series, ticker_d: pd.Series, prc_n: pd.Series, prc_d: pd.Series
+) -> np.ndarray:
+    """
+    annualized roll return in percentage: (prc_n / prc_d - 1) / dlt_month * 12 * 100,
+    dlt_month = month_d - month_n, plus 12 if it is not positive.
+
+    :param ticker_n: tickers of near contract
+    :param ticker_d: tickers of distant contract
+    :param prc_n: prices of near contract
+    :param prc_d: prices of distant contract
+    :return: 1-D float array, nan if any ticker is empty or prc_d is not positive
+    """
+    month_n, month_d = parse_contract_months(ticker_n), parse_contract_months(ticker_d)
+    dlt_month = month_d - month_n
+    dlt_month = np.where(dlt_month <= 0, dlt_month + 12, dlt_month)
+    pn, pd_ = prc_n.to_numpy(dtype=np.float64), prc_d.to_numpy(dtype=np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ts = (pn / pd_ - 1) / dlt_month * 12 * 100
+    return np.where(pd_ > 0, ts, np.nan)
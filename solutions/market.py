@@ -1,14 +1,18 @@
+import os
+import json
+import hashlib
 import numpy as np
 import pandas as pd
 from loguru import logger
 from husfort.qutility import check_and_makedirs
 from husfort.qcalendar import CCalendar
-from husfort.qsqlite import CDbStruct, CMgrSqlDb
+from husfort.qsqlite import CDbStruct
+from solutions.storage import gen_db_mgr
 from solutions.shared import convert_mkt_idx
 
 
 def load_available(db_struct: CDbStruct, bgn_date: str, stp_date: str) -> pd.DataFrame:
-    sqldb = CMgrSqlDb(
+    sqldb = gen_db_mgr(
         db_save_dir=db_struct.db_save_dir,
         db_name=db_struct.db_name,
         table=db_struct.table,
@@ -18,10 +22,38 @@ def load_available(db_struct: CDbStruct, bgn_date: str, stp_date: str) -> pd.Dat
     return avlb_data
 
 
-def cal_market_return_by_date(sub_data: pd.DataFrame) -> float:
-    wgt = sub_data["rel_wgt"] / sub_data["rel_wgt"].sum()
-    ret = sub_data["return"] @ wgt
-    return ret
+def cal_market_return_by_group(input_for_return: pd.DataFrame, levels: list[str]) -> pd.DataFrame:
+    """
+    return of each group weighted by sqrt(amount), for all levels in one groupby.
+    Return of a group at a date is NaN if any return or weight in it is NaN.
+
+    :param input_for_return: with columns ["trade_date", "return", "amount"] + levels
+    :param levels: like ["sectorL0", "sectorL1"], the whole market is always included as "market"
+    :return: a DataFrame with index = "trade_date", columns = "market" + groups of all levels,
+             a group is NaN at dates without any instrument in it
+    """
+    rel_wgt = np.sqrt(input_for_return["amount"].to_numpy(np.float64))
+    wgt_ret = input_for_return["return"].to_numpy(np.float64) * rel_wgt
+    products = pd.DataFrame({
+        "trade_date": input_for_return["trade_date"].to_numpy(),
+        "wgt_ret": wgt_ret,
+        "rel_wgt": rel_wgt,
+        "invalid": np.isnan(wgt_ret).astype(np.int64),
+    })
+    stacked = pd.concat(
+        [products.assign(level="market", group="market")] +
+        [products.assign(level=level, group=input_for_return[level].to_numpy()) for level in levels],
+        axis=0, ignore_index=True,
+    )
+    sums = stacked.groupby(by=["trade_date", "level", "group"], sort=False).sum()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ret = (sums["wgt_ret"] / sums["rel_wgt"]).where(sums["invalid"] == 0)
+    ret = ret.unstack(level=["level", "group"]).sort_index()
+    res = {}
+    for level in ["market"] + levels:  # groups of finer levels overwrite groups of coarser levels with the same name
+        for group in ret[level].columns:
+            res[group] = ret[(level, group)]
+    return pd.DataFrame(res).rename_axis(index="trade_date")
 
 
 def cal_market_return(
@@ -31,14 +63,7 @@ def cal_market_return(
         sectors: list[str]
 ) -> pd.DataFrame:
     available_data = load_available(db_struct=db_struct_avlb, bgn_date=bgn_date, stp_date=stp_date)
-    input_for_return = available_data.set_index("trade_date")
-    input_for_return["rel_wgt"] = np.sqrt(input_for_return["amount"])
-    ret = {"market": input_for_return.groupby(by="trade_date").apply(cal_market_return_by_date)}
-    for sector, sector_df in input_for_return.groupby(by="sectorL0"):
-        ret[sector] = sector_df.groupby(by="trade_date").apply(cal_market_return_by_date)
-    for sector, sector_df in input_for_return.groupby(by="sectorL1"):
-        ret[sector] = sector_df.groupby(by="trade_date").apply(cal_market_return_by_date)
-    ret_by_sector = pd.DataFrame(ret).reset_index()
+    ret_by_sector = cal_market_return_by_group(available_data, levels=["sectorL0", "sectorL1"]).reset_index()
     # --- reformat
     mkt_cols = ["market"]
     sec0_cols, sec1_cols = ["C"], sectors
@@ -46,14 +71,92 @@ def cal_market_return(
     return ret_by_sector
 
 
-def load_market_index(bgn_date: str, stp_date: str, path_mkt_idx_data: str, mkt_idxes: list[str]) -> pd.DataFrame:
+def get_file_sha1(path: str) -> str:
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def parse_market_index(path_mkt_idx_data: str, mkt_idxes: list[str]) -> dict[str, pd.DataFrame]:
+    """
+
+    :return: a dict with key = sheet name, value = pd.DataFrame with columns ["trade_date", "pct_chg"]
+    """
+    sheets = pd.read_excel(path_mkt_idx_data, sheet_name=mkt_idxes, header=1)
+    res = {}
+    for mkt_idx, df in sheets.items():
+        trade_date = pd.to_datetime(df["Date"]).dt.strftime("%Y%m%d")
+        res[mkt_idx] = pd.DataFrame({"trade_date": trade_date, "pct_chg": df["pct_chg"]})
+    return res
+
+
+def save_market_index_meta(meta: dict, meta_path: str):
+    tmp_path = f"{meta_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+
+
+def load_market_index_cache(
+        path_mkt_idx_data: str, mkt_idxes: list[str], cache_dir: str, bgn_date: str, stp_date: str,
+) -> dict[str, pd.DataFrame]:
+    """
+    Sheets of the workbook are cached as parquet files in cache_dir. The cache is valid
+    if it has all sheets and the mtime or the sha1 of the workbook is not changed, else
+    the workbook is parsed again.
+
+    :return: the same as parse_market_index, only with dates in [bgn_date, stp_date)
+    """
+    meta_path = os.path.join(cache_dir, "meta.json")
+    meta = {"mtime": None, "sha1": None, "sheets": []}
+    if os.path.exists(meta_path):
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+
+    mtime = os.path.getmtime(path_mkt_idx_data)
+    valid = set(mkt_idxes).issubset(meta["sheets"])
+    if valid and meta["mtime"] != mtime:
+        if valid := (meta["sha1"] == get_file_sha1(path_mkt_idx_data)):
+            meta["mtime"] = mtime
+            save_market_index_meta(meta, meta_path)
+
+    if not valid:
+        # only sheets in need, sheets cached before may be dropped from the workbook or config
+        sheets = list(dict.fromkeys(mkt_idxes))
+        logger.info(f"Parsing {path_mkt_idx_data} for sheets {sheets}")
+        data = parse_market_index(path_mkt_idx_data, sheets)
+        try:
+            check_and_makedirs(cache_dir)
+            for mkt_idx, df in data.items():
+                df.to_parquet(os.path.join(cache_dir, f"{mkt_idx}.parquet"), index=False)
+        except ImportError:
+            logger.warning("pyarrow is not installed, market index is not cached")
+        else:
+            meta = {"mtime": mtime, "sha1": get_file_sha1(path_mkt_idx_data), "sheets": sheets}
+            save_market_index_meta(meta, meta_path)
+        return {
+            mkt_idx: df.query(f"trade_date >= '{bgn_date}' & trade_date < '{stp_date}'")
+            for mkt_idx, df in data.items()
+        }
+
+    filters = [("trade_date", ">=", bgn_date), ("trade_date", "<", stp_date)]
+    return {
+        mkt_idx: pd.read_parquet(os.path.join(cache_dir, f"{mkt_idx}.parquet"), filters=filters)
+        for mkt_idx in mkt_idxes
+    }
+
+
+def load_market_index(
+        bgn_date: str, stp_date: str, path_mkt_idx_data: str, mkt_idxes: list[str], cache_dir: str,
+) -> pd.DataFrame:
     mkt_idx_data = {}
+    sheets = load_market_index_cache(path_mkt_idx_data, mkt_idxes, cache_dir, bgn_date, stp_date)
     for mkt_idx in mkt_idxes:
-        df = pd.read_excel(path_mkt_idx_data, sheet_name=mkt_idx, header=1)
-        df["trade_date"] = df["Date"].map(lambda _: _.strftime("%Y%m%d"))
+        df = sheets[mkt_idx]
         mkt_idx_data[convert_mkt_idx(mkt_idx)] = df.set_index("trade_date")["pct_chg"] / 100
     mkt_idx_df = pd.DataFrame(mkt_idx_data).reset_index()
-    mkt_idx_df = mkt_idx_df.query(expr=f"trade_date >= '{bgn_date}' & trade_date < '{stp_date}'")
     return mkt_idx_df
 
 
@@ -88,7 +191,7 @@ def main_market(
         sectors: list[str],
 ):
     check_and_makedirs(db_struct_mkt.db_save_dir)
-    sqldb = CMgrSqlDb(
+    sqldb = gen_db_mgr(
         db_save_dir=db_struct_mkt.db_save_dir,
         db_name=db_struct_mkt.db_name,
         table=db_struct_mkt.table,
@@ -97,7 +200,10 @@ def main_market(
 
     if sqldb.check_continuity(bgn_date, calendar) == 0:
         ret_by_sector = cal_market_return(bgn_date, stp_date, db_struct_avlb, sectors=sectors)
-        mkt_idx_df = load_market_index(bgn_date, stp_date, path_mkt_idx_data, mkt_idxes)
+        mkt_idx_df = load_market_index(
+            bgn_date, stp_date, path_mkt_idx_data, mkt_idxes,
+            cache_dir=os.path.join(db_struct_mkt.db_save_dir, "market_index_cache"),
+        )
         new_data = merge_mkt_idx(ret_by_sector, mkt_idx_df)
         new_data = sort_columns(new_data, db_struct_mkt)
         print(new_data)
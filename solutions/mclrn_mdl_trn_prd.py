@@ -1,21 +1,24 @@
 import os
-import multiprocessing as mp
 import numpy as np
 import pandas as pd
 import skops.io as sio
 from loguru import logger
-from rich.progress import track, Progress
+from rich.progress import track
 import lightgbm as lgb
 import xgboost as xgb
 from sklearn.model_selection import GridSearchCV
 from sklearn.linear_model import Ridge
 from husfort.qcalendar import CCalendar
-from husfort.qsqlite import CDbStruct, CMgrSqlDb
-from husfort.qutility import SFG, SFY, check_and_makedirs, error_handler
+from husfort.qsqlite import CDbStruct
+from husfort.qutility import SFG, SFY, check_and_makedirs
 from typedef import TUniverse, TReturnName
 from typedef import TFactorClass, TFactorNames
 from typedef import CTestMdl
+from solutions.storage import gen_db_mgr
 from solutions.shared import gen_fac_neu_db, gen_tst_ret_neu_db, gen_prdct_db
+from solutions.panel import read_by_range_with_panel
+from solutions.executor import CPoolExecutor, use_executor
+from solutions.calendarIndex import get_calendar_index
 
 """
 Part I: Base class for Machine Learning
@@ -68,14 +71,8 @@ class __CMclrn:
             self, factor_class: TFactorClass, factor_names: TFactorNames, bgn_date: str, stp_date: str
     ) -> pd.DataFrame:
         db_struct_fac = gen_fac_neu_db(self.factors_save_root_dir, factor_class, factor_names)
-        sqldb = CMgrSqlDb(
-            db_save_dir=db_struct_fac.db_save_dir,
-            db_name=db_struct_fac.db_name,
-            table=db_struct_fac.table,
-            mode="r",
-        )
-        instru_data = sqldb.read_by_range(
-            bgn_date, stp_date, value_columns=["trade_date", "instrument"] + factor_names
+        instru_data = read_by_range_with_panel(
+            db_struct_fac, bgn_date, stp_date, value_columns=["trade_date", "instrument"] + factor_names
         )
         instru_data[factor_names] = instru_data[factor_names].astype(np.float64).fillna(np.nan)
         return instru_data
@@ -94,14 +91,8 @@ class __CMclrn:
             save_id=self.test.ret.save_id,
             rets=[self.test.ret.ret_name],
         )
-        sqldb = CMgrSqlDb(
-            db_save_dir=db_struct_ref.db_save_dir,
-            db_name=db_struct_ref.db_name,
-            table=db_struct_ref.table,
-            mode="r"
-        )
-        ret_data = sqldb.read_by_range(
-            bgn_date, stp_date, value_columns=["trade_date", "instrument", self.test.ret.ret_name]
+        ret_data = read_by_range_with_panel(
+            db_struct_ref, bgn_date, stp_date, value_columns=["trade_date", "instrument", self.test.ret.ret_name]
         )
         ret_data[self.test.ret.ret_name] = ret_data[self.test.ret.ret_name].astype(np.float64).fillna(np.nan)
         return ret_data
@@ -112,7 +103,7 @@ class __CMclrn:
         return ret_data
 
     def load_available(self) -> pd.DataFrame:
-        sqldb = CMgrSqlDb(
+        sqldb = gen_db_mgr(
             db_save_dir=self.db_struct_avlb.db_save_dir,
             db_name=self.db_struct_avlb.db_name,
             table=self.db_struct_avlb.table,
@@ -218,9 +209,10 @@ class __CMclrn:
     def load_all_data(
             self, head_model_update_day: str, tail_model_update_day: str, calendar: CCalendar,
     ) -> tuple[pd.DataFrame, pd.DataFrame]:
-        trn_b_date = calendar.get_next_date(head_model_update_day, shift=-self.test.ret.shift - self.test.trn_win + 1)
-        trn_e_date = calendar.get_next_date(tail_model_update_day, shift=-self.test.ret.shift)
-        trn_s_date = calendar.get_next_date(trn_e_date, shift=1)
+        calendar_index = get_calendar_index(calendar)
+        trn_b_date = calendar_index.next_date(head_model_update_day, shift=-self.test.ret.shift - self.test.trn_win + 1)
+        trn_e_date = calendar_index.next_date(tail_model_update_day, shift=-self.test.ret.shift)
+        trn_s_date = calendar_index.next_date(trn_e_date, shift=1)
         all_x_data, all_y_data = self.load_x(trn_b_date, trn_s_date), self.load_y(trn_b_date, trn_s_date)
         return all_x_data, all_y_data
 
@@ -232,8 +224,9 @@ class __CMclrn:
                 "program will skip it."
             )
             return 0
-        trn_b_date = calendar.get_next_date(model_update_day, shift=-self.test.ret.shift - self.test.trn_win + 1)
-        trn_e_date = calendar.get_next_date(model_update_day, shift=-self.test.ret.shift)
+        calendar_index = get_calendar_index(calendar)
+        trn_e_date = calendar_index.next_date(model_update_day, shift=-self.test.ret.shift)
+        trn_b_date = calendar_index.window_start([trn_e_date], self.test.trn_win)[0]
         trn_aligned_data = aligned_data.query(f"trade_date >= '{trn_b_date}' & trade_date <= '{trn_e_date}'")
         trn_aligned_data = self.drop_and_fill_nan(trn_aligned_data[self.x_cols + [self.y_col]])
         x, y = self.get_X_y(aligned_data=trn_aligned_data)
@@ -249,7 +242,7 @@ class __CMclrn:
         return 0
 
     def process_trn(self, bgn_date: str, stp_date: str, calendar: CCalendar, verbose: bool):
-        model_update_days = calendar.get_last_days_in_range(bgn_date=bgn_date, stp_date=stp_date)
+        model_update_days = get_calendar_index(calendar).month_ends(bgn_date=bgn_date, stp_date=stp_date)
         avlb_data = self.load_available()
         all_x_data, all_y_data = self.load_all_data(
             head_model_update_day=model_update_days[0],
@@ -274,8 +267,9 @@ class __CMclrn:
         trn_month_id = calendar.get_next_month(prd_month_id, -1)
         self.reset_estimator()
         if self.load_model(month_id=trn_month_id, verbose=verbose):
-            model_update_day = calendar.get_last_day_of_month(trn_month_id)
-            trn_e_date = calendar.get_next_date(model_update_day, shift=-self.test.ret.shift)
+            calendar_index = get_calendar_index(calendar)
+            model_update_day = calendar_index.last_day_of_month(trn_month_id)
+            trn_e_date = calendar_index.next_date(model_update_day, shift=-self.test.ret.shift)
             prd_b_date, prd_e_date = prd_month_days[0], prd_month_days[-1]
             prd_x_data = x_data.query(f"trade_date >= '{prd_b_date}' & trade_date <= '{prd_e_date}'")
             x_data = self.get_X(x_data=prd_x_data)
@@ -293,7 +287,7 @@ class __CMclrn:
             return pd.Series(dtype=np.float64)
 
     def process_prd(self, bgn_date: str, stp_date: str, calendar: CCalendar, verbose: bool) -> pd.DataFrame:
-        months_groups = calendar.split_by_month(dates=calendar.get_iter_list(bgn_date, stp_date))
+        months_groups = get_calendar_index(calendar).split_by_month(dates=calendar.get_iter_list(bgn_date, stp_date))
         avlb_data = self.load_available()
         all_x_data = self.load_x(bgn_date, stp_date)
         avlb_x_data = self.filter_by_avlb(all_x_data, avlb_data)
@@ -309,7 +303,7 @@ class __CMclrn:
     def process_save_prediction(self, prediction: pd.DataFrame, calendar: CCalendar):
         db_struct_prdct = gen_prdct_db(self.mclrn_prd_dir, self.test)
         check_and_makedirs(db_struct_prdct.db_save_dir)
-        sqldb = CMgrSqlDb(
+        sqldb = gen_db_mgr(
             db_save_dir=db_struct_prdct.db_save_dir,
             db_name=db_struct_prdct.db_name,
             table=db_struct_prdct.table,
@@ -482,34 +476,36 @@ def main_train_and_predict(
         call_multiprocess: bool,
         processes: int,
         verbose: bool,
+        executor: CPoolExecutor | None = None,
 ):
+    """
+
+    :param executor: a running pool shared by stages, with "calendar" in its shared objects.
+                     If None, a new pool is started for this stage.
+    """
     desc = "Training and predicting for machine learning"
     if call_multiprocess:
-        with Progress() as pb:
-            main_task = pb.add_task(description=desc, total=len(tests))
-            with mp.get_context("spawn").Pool(processes=processes) as pool:
-                for test in tests:
-                    pool.apply_async(
-                        process_for_cMclrn,
-                        kwds={
-                            "test": test,
-                            "cv": cv,
-                            "factors_save_root_dir": factors_save_root_dir,
-                            "tst_ret_save_root_dir": tst_ret_save_root_dir,
-                            "db_struct_avlb": db_struct_avlb,
-                            "mclrn_mdl_dir": mclrn_mdl_dir,
-                            "mclrn_prd_dir": mclrn_prd_dir,
-                            "universe": universe,
-                            "bgn_date": bgn_date,
-                            "stp_date": stp_date,
-                            "calendar": calendar,
-                            "verbose": verbose,
-                        },
-                        callback=lambda _: pb.update(task_id=main_task, advance=1),
-                        error_callback=error_handler,
-                    )
-                pool.close()
-                pool.join()
+        with use_executor(executor, processes, shared={"calendar": calendar}) as pool_executor:
+            pool_executor.run(
+                process_for_cMclrn,
+                [
+                    {
+                        "test": test,
+                        "cv": cv,
+                        "factors_save_root_dir": factors_save_root_dir,
+                        "tst_ret_save_root_dir": tst_ret_save_root_dir,
+                        "db_struct_avlb": db_struct_avlb,
+                        "mclrn_mdl_dir": mclrn_mdl_dir,
+                        "mclrn_prd_dir": mclrn_prd_dir,
+                        "universe": universe,
+                        "bgn_date": bgn_date,
+                        "stp_date": stp_date,
+                        "verbose": verbose,
+                    } for test in tests
+                ],
+                shared_kwargs=("calendar",),
+                description=desc,
+            )
     else:
         for test in track(tests, description=desc):
             process_for_cMclrn(
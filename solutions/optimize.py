@@ -2,10 +2,11 @@ import numpy as np
 import pandas as pd
 from rich.progress import track
 from husfort.qcalendar import CCalendar
-from husfort.qsqlite import CMgrSqlDb
 from husfort.qoptimization import COptimizerPortfolioUtility
 from husfort.qutility import check_and_makedirs
+from solutions.storage import gen_db_mgr
 from solutions.shared import gen_opt_wgt_db, gen_nav_db
+from solutions.calendarIndex import get_calendar_index
 from typedef import CSimArgs, TSimGrpIdByFacGrp, TRetPrc
 
 
@@ -46,7 +47,7 @@ class COptimizer:
         :param calendar:
         :return: a series with index = self.x.columns, ie weights for each instrument
         """
-        opt_b_date = calendar.get_next_date(model_update_day, shift=-self.win + 1)
+        opt_b_date = get_calendar_index(calendar).window_start([model_update_day], self.win)[0]
         opt_e_date = model_update_day
         ret_data = self.x.truncate(before=opt_b_date, after=opt_e_date)
         return self.core(ret_data)
@@ -69,7 +70,7 @@ class COptimizer:
             save_id=self.save_id,
             underlying_assets_names=self.x.columns.tolist(),
         )
-        sqldb = CMgrSqlDb(
+        sqldb = gen_db_mgr(
             db_save_dir=db_struct_opt.db_save_dir,
             db_name=db_struct_opt.db_name,
             table=db_struct_opt.table,
@@ -81,10 +82,11 @@ class COptimizer:
 
     def main(self, bgn_date: str, stp_date: str, calendar: CCalendar):
         base_bgn_date = calendar.get_next_date(bgn_date, -self.CONST_SAFE_SHIFT)
-        model_update_days = calendar.get_last_days_in_range(bgn_date=base_bgn_date, stp_date=stp_date)
+        calendar_index = get_calendar_index(calendar)
+        model_update_days = calendar_index.month_ends(bgn_date=base_bgn_date, stp_date=stp_date)
+        next_days = calendar_index.shift(model_update_days, 1)
         res: dict[str, pd.Series] = {}
-        for model_update_day in model_update_days:
-            next_day = calendar.get_next_date(model_update_day, shift=1)
+        for model_update_day, next_day in zip(model_update_days, next_days):
             res[next_day] = self.optimize_at_day(model_update_day, calendar)
         optimized_wgt = pd.DataFrame.from_dict(res, orient="index")
         new_data = self.merge_to_header(optimized_wgt, calendar, base_bgn_date, bgn_date, stp_date)
@@ -113,7 +115,7 @@ class COptimizerForGroupedSim(COptimizer):
         x_data = {}
         for sim_args in sim_args_list:
             db_struct_nav = gen_nav_db(db_save_dir=sim_save_dir, save_id=sim_args.sim_id)
-            sqldb = CMgrSqlDb(
+            sqldb = gen_db_mgr(
                 db_save_dir=db_struct_nav.db_save_dir,
                 db_name=db_struct_nav.db_name,
                 table=db_struct_nav.table,
@@ -0,0 +1,349 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from loguru import logger
+from husfort.qsqlite import CDbStruct, CMgrSqlDb
+from husfort.qcalendar import CCalendar
+from husfort.qutility import check_and_makedirs
+from solutions.storage import CMgrParquetDb, gen_db_mgr, get_db_stem
+
+"""
+-----------------------------------------------------------------
+Part I: dense panel of (trade_date, instrument), an append-only
+        alternative to long sqlite tables with primary keys =
+        ["trade_date", "instrument"].
+
+        files in panel_dir:
+            dates.bin       : trade dates, S8, one per row
+            instruments.json: instruments, one per column
+            mask.u1         : uint8 [n_dates, n_instru], 1 if the
+                              (trade_date, instrument) row exists
+            {value}.f64     : float64 [n_dates, n_instru], one file
+                              for each value column
+
+        all files are C-ordered and memory-mappable, reading a range
+        of dates is a zero-copy slice of rows.
+-----------------------------------------------------------------
+"""
+
+DATE_DTYPE = np.dtype("S8")
+MASK_DTYPE = np.dtype(np.uint8)
+VALUE_DTYPE = np.dtype(np.float64)
+
+
+class CPanelDb:
+    def __init__(self, panel_dir: str, value_columns: list[str]):
+        """
+
+        :param panel_dir: directory of this panel
+        :param value_columns: value columns to write, each one is saved in a file
+        """
+        self.panel_dir = panel_dir
+        self.value_columns = value_columns
+
+    def get_path(self, name: str) -> str:
+        return os.path.join(self.panel_dir, name)
+
+    @property
+    def dates_path(self) -> str:
+        return self.get_path("dates.bin")
+
+    @property
+    def instruments_path(self) -> str:
+        return self.get_path("instruments.json")
+
+    def get_value_path(self, value_column: str) -> str:
+        return self.get_path(f"{value_column}.f64")
+
+    @property
+    def exists(self) -> bool:
+        return os.path.exists(self.dates_path) and os.path.exists(self.instruments_path)
+
+    def has_columns(self, value_columns: list[str]) -> bool:
+        return self.exists and all(os.path.exists(self.get_value_path(z)) for z in value_columns)
+
+    @property
+    def instruments(self) -> list[str]:
+        if not self.exists:
+            return []
+        with open(self.instruments_path, "r") as f:
+            return json.load(f)
+
+    @property
+    def n_dates(self) -> int:
+        return os.path.getsize(self.dates_path) // DATE_DTYPE.itemsize if self.exists else 0
+
+    @property
+    def empty(self) -> bool:
+        return self.n_dates == 0
+
+    @property
+    def dates(self) -> np.ndarray:
+        if self.empty:
+            return np.array([], dtype=DATE_DTYPE)
+        return np.memmap(self.dates_path, dtype=DATE_DTYPE, mode="r", shape=(self.n_dates,))
+
+    @property
+    def last_date(self) -> str | None:
+        return None if self.empty else self.dates[-1].decode()
+
+    def memmap(self, path: str, dtype: np.dtype, n_dates: int = None, n_instru: int = None) -> np.ndarray:
+        n_dates = self.n_dates if n_dates is None else n_dates
+        n_instru = len(self.instruments) if n_instru is None else n_instru
+        if n_dates * n_instru == 0:
+            return np.empty(shape=(n_dates, n_instru), dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r", shape=(n_dates, n_instru))
+
+    # ---------------
+    # --- reading ---
+    # ---------------
+
+    def locate_dates(self, bgn_date: str, stp_date: str) -> slice:
+        dates = self.dates
+        i0 = np.searchsorted(dates, bgn_date.encode(), side="left")
+        i1 = np.searchsorted(dates, stp_date.encode(), side="left")
+        return slice(int(i0), int(i1))
+
+    def locate_instruments(self, instruments: list[str] | None) -> slice | np.ndarray:
+        """
+
+        :return: a slice if instruments are contiguous columns, so values are still a view,
+                 else an integer array
+        """
+        if instruments is None:
+            return slice(None)
+        idx = pd.Index(self.instruments).get_indexer(instruments)
+        if (idx < 0).any():
+            raise KeyError(f"{[z for z, i in zip(instruments, idx) if i < 0]} are not in panel {self.panel_dir}")
+        if len(idx) > 0 and np.array_equal(idx, np.arange(idx[0], idx[0] + len(idx))):
+            return slice(int(idx[0]), int(idx[0]) + len(idx))
+        return idx
+
+    def read_array(
+            self, value_column: str, bgn_date: str, stp_date: str, instruments: list[str] = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+
+        :param value_column:
+        :param bgn_date:
+        :param stp_date:
+        :param instruments: None for all instruments in the panel
+        :return: (dates, values), values is a read-only view of the memmap if instruments are
+                 None or contiguous columns, else a copy. Missing rows are nan.
+        """
+        rows, cols = self.locate_dates(bgn_date, stp_date), self.locate_instruments(instruments)
+        values = self.memmap(self.get_value_path(value_column), VALUE_DTYPE)
+        return self.dates[rows], values[rows, cols]
+
+    def read_mask(self, bgn_date: str, stp_date: str, instruments: list[str] = None) -> np.ndarray:
+        rows, cols = self.locate_dates(bgn_date, stp_date), self.locate_instruments(instruments)
+        return self.memmap(self.get_path("mask.u1"), MASK_DTYPE)[rows, cols].astype(bool)
+
+    def read_wide(
+            self, value_column: str, bgn_date: str, stp_date: str, instruments: list[str] = None
+    ) -> pd.DataFrame:
+        """
+
+        :return: pd.DataFrame with index = trade_date, columns = instruments, which shares
+                 memory with the memmap whenever read_array does.
+        """
+        dates, values = self.read_array(value_column, bgn_date, stp_date, instruments)
+        return pd.DataFrame(
+            values,
+            index=pd.Index(dates.astype(str), name="trade_date"),
+            columns=pd.Index(instruments or self.instruments, name="instrument"),
+            copy=False,
+        )
+
+    def read_by_range(self, bgn_date: str, stp_date: str, value_columns: list[str] = None) -> pd.DataFrame:
+        """
+        the same long format as CMgrSqlDb.read_by_range, only existing rows are returned,
+        sorted by ["trade_date", "instrument"].
+
+        :param value_columns: columns to read, "trade_date" and "instrument" are always returned.
+                              None for all value columns of this panel.
+        """
+        value_columns = [z for z in (value_columns or self.value_columns) if z not in ("trade_date", "instrument")]
+        rows = self.locate_dates(bgn_date, stp_date)
+        instruments = np.array(self.instruments, dtype=object)
+        mask = self.memmap(self.get_path("mask.u1"), MASK_DTYPE)[rows].astype(bool)
+        order = np.argsort(instruments, kind="stable")
+        mask = mask[:, order]
+        r, c = np.nonzero(mask)
+        data = {
+            "trade_date": self.dates[rows][r].astype(str).astype(object),
+            "instrument": instruments[order][c],
+        }
+        for z in value_columns:
+            data[z] = self.memmap(self.get_value_path(z), VALUE_DTYPE)[rows][:, order][mask]
+        return pd.DataFrame(data)
+
+    # ---------------
+    # --- writing ---
+    # ---------------
+
+    def check_continuity(self, incoming_date: str, calendar: CCalendar) -> int:
+        """
+        the same as CMgrSqlDb.check_continuity
+
+        :return: 0: incoming_date is the next trade date of the last date, or panel is empty
+                 1: there are missing dates between them
+                 2: incoming_date is not after the last date
+        """
+        if self.empty:
+            return 0
+        expected_date = calendar.get_next_date(self.last_date, shift=1)
+        if incoming_date == expected_date:
+            return 0
+        return 1 if incoming_date > expected_date else 2
+
+    def repair(self):
+        """
+        dates.bin is written last in update, so rows of other files beyond n_dates
+        are from an interrupted update and are truncated.
+
+        """
+        n = self.n_dates * len(self.instruments)
+        for path, dtype in [(self.get_path("mask.u1"), MASK_DTYPE)] + [
+            (self.get_value_path(z), VALUE_DTYPE) for z in self.value_columns
+        ]:
+            if os.path.exists(path) and os.path.getsize(path) > n * dtype.itemsize:
+                with open(path, "r+b") as f:
+                    f.truncate(n * dtype.itemsize)
+        return 0
+
+    def widen(self, new_instruments: list[str]):
+        """
+        add new instruments as new columns at the right side, all files are rewritten.
+
+        """
+        old_instruments = self.instruments
+        instruments = old_instruments + [z for z in new_instruments if z not in set(old_instruments)]
+        n_dates, k = self.n_dates, len(old_instruments)
+        for path, dtype, fill in [(self.get_path("mask.u1"), MASK_DTYPE, 0)] + [
+            (self.get_value_path(z), VALUE_DTYPE, np.nan) for z in self.value_columns
+        ]:
+            new_values = np.full(shape=(n_dates, len(instruments)), fill_value=fill, dtype=dtype)
+            if os.path.exists(path):
+                new_values[:, :k] = self.memmap(path, dtype, n_dates=n_dates, n_instru=k)
+            tmp_path = f"{path}.tmp"
+            new_values.tofile(tmp_path)
+            os.replace(tmp_path, path)
+        tmp_path = f"{self.instruments_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(instruments, f)
+        os.replace(tmp_path, self.instruments_path)
+        return 0
+
+    def update(self, update_data: pd.DataFrame):
+        """
+        append rows of new dates
+
+        :param update_data: pd.DataFrame with columns = ["trade_date", "instrument"] + value_columns,
+                            all trade dates must be after the last date of this panel.
+        """
+        if update_data.empty:
+            return 0
+        check_and_makedirs(self.panel_dir)
+        if not self.exists:
+            with open(self.instruments_path, "w") as f:
+                json.dump([], f)
+            open(self.dates_path, "wb").close()
+        self.repair()
+
+        dates = np.unique(update_data["trade_date"].to_numpy().astype(str))
+        if (last_date := self.last_date) is not None and dates[0] <= last_date:
+            raise ValueError(f"trade date {dates[0]} is not after the last date {last_date} of {self.panel_dir}")
+        if any(len(d) != DATE_DTYPE.itemsize for d in (dates[0], dates[-1])):
+            raise ValueError(f"trade date must be like 'YYYYMMDD', got {dates[0]} and {dates[-1]}")
+        if new_instruments := sorted(set(update_data["instrument"]) - set(self.instruments)):
+            self.widen(new_instruments)
+
+        instruments = self.instruments
+        r = pd.Index(dates).get_indexer(update_data["trade_date"].astype(str))
+        c = pd.Index(instruments).get_indexer(update_data["instrument"])
+        mask = np.zeros(shape=(len(dates), len(instruments)), dtype=MASK_DTYPE)
+        mask[r, c] = 1
+        with open(self.get_path("mask.u1"), "ab") as f:
+            f.write(mask.tobytes())
+        for z in self.value_columns:
+            values = np.full(shape=(len(dates), len(instruments)), fill_value=np.nan, dtype=VALUE_DTYPE)
+            values[r, c] = update_data[z].astype(np.float64).to_numpy()
+            with open(self.get_value_path(z), "ab") as f:
+                f.write(values.tobytes())
+        with open(self.dates_path, "ab") as f:
+            f.write(dates.astype(DATE_DTYPE).tobytes())
+        return 0
+
+    def rebuild(self, data: pd.DataFrame):
+        for name in os.listdir(self.panel_dir) if os.path.exists(self.panel_dir) else []:
+            os.remove(self.get_path(name))
+        return self.update(data)
+
+
+"""
+--------------------------------------------------------------
+Part II: panels as mirrors of database tables. A panel is saved
+         next to the database, like "{db_stem}.panel", and is
+         always an exact copy of the table.
+--------------------------------------------------------------
+"""
+
+
+def gen_panel_db(db_struct: CDbStruct) -> CPanelDb:
+    panel_name = get_db_stem(db_struct.db_name) + ".panel"
+    value_columns = [z for z in db_struct.table.vars.names if z not in ("trade_date", "instrument")]
+    return CPanelDb(panel_dir=os.path.join(db_struct.db_save_dir, panel_name), value_columns=value_columns)
+
+
+def is_panel_in_sync(panel: CPanelDb, sqldb: CMgrSqlDb | CMgrParquetDb) -> bool:
+    """
+    the panel is in sync if it has the same last date as the database, it is not if a
+    process stopped between the update of the database and the update of the panel.
+
+    """
+    db_last_date = None if sqldb.empty else sqldb.last_val(val="trade_date", val_if_none=None)
+    return panel.last_date == db_last_date
+
+
+def update_with_panel(db_struct: CDbStruct, sqldb: CMgrSqlDb | CMgrParquetDb, update_data: pd.DataFrame):
+    """
+    update the database and its panel. If the panel is out of sync with the database,
+    like it does not exist yet, it is rebuilt from the whole table.
+
+    :param db_struct: with primary keys = ["trade_date", "instrument"]
+    :param sqldb: CMgrSqlDb or CMgrParquetDb of db_struct, with mode = "a"
+    :param update_data:
+    """
+    panel = gen_panel_db(db_struct)
+    in_sync = is_panel_in_sync(panel, sqldb) and panel.has_columns(panel.value_columns)
+    sqldb.update(update_data=update_data)
+    if in_sync:
+        panel.update(update_data)
+    else:
+        panel.rebuild(sqldb.read())
+    return 0
+
+
+def read_by_range_with_panel(
+        db_struct: CDbStruct, bgn_date: str, stp_date: str, value_columns: list[str] = None
+) -> pd.DataFrame:
+    """
+    read from the panel if it has all columns and is in sync with the database,
+    else from the database. The panel is rebuilt by the next update_with_panel.
+
+    """
+    panel = gen_panel_db(db_struct)
+    value_columns = value_columns or db_struct.table.vars.names
+    sqldb = gen_db_mgr(
+        db_save_dir=db_struct.db_save_dir,
+        db_name=db_struct.db_name,
+        table=db_struct.table,
+        mode="r",
+    )
+    if panel.has_columns([z for z in value_columns if z not in ("trade_date", "instrument")]):
+        if is_panel_in_sync(panel, sqldb):
+            return panel.read_by_range(bgn_date, stp_date, value_columns)[value_columns]
+        logger.warning(f"Panel {panel.panel_dir} is out of sync with its database, read from the database")
+    return sqldb.read_by_range(bgn_date, stp_date, value_columns=value_columns)
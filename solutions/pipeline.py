@@ -0,0 +1,280 @@
+import os
+import sys
+import json
+import time
+import fnmatch
+import subprocess
+from dataclasses import dataclass, field
+from typing import Literal
+from loguru import logger
+from husfort.qutility import SFY, check_and_makedirs
+
+"""
+----------------------------------------------------------
+Part I: nodes of the pipeline, each node is one call of
+        "python main.py ..." with its switch and arguments
+----------------------------------------------------------
+"""
+
+TNodeStatus = Literal["pending", "running", "done", "up-to-date", "failed", "blocked"]
+
+
+@dataclass
+class CNode:
+    name: str  # like "factor.MTM" or "signals.facNeu"
+    argv: list[str]  # switch and its arguments, like ["factor", "--fclass", "MTM"]
+    bgn_date: str
+    deps: list[str] = field(default_factory=list)  # names of nodes this node depends on
+    cores: int = 1  # cores used, nodes with more than 1 core run their own pool with --processes
+    status: TNodeStatus = "pending"
+    t_start: float = 0
+    t_end: float = 0
+
+    @property
+    def elapsed(self) -> float:
+        return self.t_end - self.t_start
+
+    def get_cmd(self, script: str, stp_date: str, verbose: bool) -> list[str]:
+        cmd = [sys.executable, script, "--bgn", self.bgn_date, "--stp", stp_date]
+        cmd += ["--processes", str(self.cores)] + ([] if self.cores > 1 else ["--nomp"])
+        cmd += ["--verbose"] if verbose else []
+        return cmd + self.argv
+
+
+def gen_pipeline_nodes(
+        fclasses: list[str],
+        bgn_dates: dict[str, str],
+        cores: int,
+        factor_cores: int = 1,
+) -> list[CNode]:
+    """
+    The same stages as run_all.ps1, in topological order.
+
+    :param fclasses: factor classes, each one is a node, they are independent of each other
+    :param bgn_dates: begin date of each group of nodes, with keys = "raw", "sig", "sim", "ml",
+                      "mdl_prd" and "mdl_opt", see run_all.ps1
+    :param cores: cores of nodes with a pool of workers
+    :param factor_cores: cores of each factor node
+    """
+
+    def chain(tp: str, bgn_sig: str, bgn_sim: str, deps_sig: list[str]) -> list[CNode]:
+        return [
+            CNode(f"signals.{tp}", ["signals", "--type", tp], bgn_sig, deps_sig, cores),
+            CNode(f"simulations.{tp}", ["simulations", "--type", tp], bgn_sim,
+                  [f"signals.{tp}", "test_return"], cores),
+            CNode(f"evaluations.{tp}", ["evaluations", "--type", tp], bgn_sim, [f"simulations.{tp}"], cores),
+        ]
+
+    factors = [f"factor.{z}" for z in fclasses]
+    bgn_raw, bgn_sim = bgn_dates["raw"], bgn_dates["sim"]
+    bgn_mdl_prd, bgn_mdl_opt = bgn_dates["mdl_prd"], bgn_dates["mdl_opt"]
+    nodes = [
+        # --- prepare
+        CNode("available", ["available"], bgn_raw),
+        CNode("market", ["market"], bgn_raw, ["available"]),
+        CNode("test_return", ["test_return"], bgn_raw, ["available"], cores),
+
+        # --- factor
+        *[CNode(f"factor.{z}", ["factor", "--fclass", z], bgn_raw, ["available", "market"], factor_cores)
+          for z in fclasses],
+
+        # --- single factor test
+        *chain("facNeu", bgn_dates["sig"], bgn_sim, factors),
+
+        # --- machine learning
+        CNode("mclrn.parse", ["mclrn", "--type", "parse"], bgn_dates["ml"]),
+        CNode("mclrn.trnprd", ["mclrn", "--type", "trnprd"], bgn_dates["ml"],
+              ["mclrn.parse", "test_return"] + factors, cores),
+
+        # --- signals, simulations and optimization for each machine learning model
+        *chain("mdlPrd", bgn_mdl_prd, bgn_mdl_prd, ["mclrn.trnprd"]),
+        CNode("optimize.mdlPrd", ["optimize", "--type", "mdlPrd"], bgn_mdl_prd, ["simulations.mdlPrd"]),
+
+        # --- signals, simulations and optimization for each factor group
+        *chain("mdlOpt", bgn_mdl_opt, bgn_mdl_opt, ["signals.mdlPrd", "optimize.mdlPrd"]),
+        CNode("optimize.mdlOpt", ["optimize", "--type", "mdlOpt"], bgn_mdl_opt, ["simulations.mdlOpt"]),
+
+        # --- signals, simulations and optimization for each price type
+        *chain("grpOpt", bgn_sim, bgn_sim, ["signals.mdlOpt", "optimize.mdlOpt"]),
+    ]
+    return nodes
+
+
+def select_nodes(nodes: list[CNode], since: list[str]) -> list[CNode]:
+    """
+
+    :param since: patterns of node names, like ["mclrn.*"], for fnmatch
+    :return: nodes matching any pattern and all nodes depending on them, in the original order.
+             Dependencies out of the selection are taken as done.
+    """
+    selected: set[str] = set()
+    for node in nodes:
+        if any(fnmatch.fnmatch(node.name, p) for p in since) or any(d in selected for d in node.deps):
+            selected.add(node.name)
+    return [node for node in nodes if node.name in selected]
+
+
+"""
+---------------------------------------------------------------
+Part II: stamps. A node is up to date if it has finished with
+         the same command, and after all of its dependencies
+---------------------------------------------------------------
+"""
+
+
+class CStamps:
+    def __init__(self, stamps_dir: str):
+        self.stamps_dir = stamps_dir
+        check_and_makedirs(stamps_dir)
+
+    def get_path(self, name: str, ext: str = "json") -> str:
+        return os.path.join(self.stamps_dir, f"{name}.{ext}")
+
+    def is_up_to_date(self, node: CNode, cmd: list[str], deps: list[str]) -> bool:
+        path = self.get_path(node.name)
+        if not os.path.exists(path):
+            return False
+        with open(path, "r") as f:
+            if json.load(f)["cmd"] != cmd[1:]:  # interpreter is ignored
+                return False
+        mtime = os.path.getmtime(path)
+        for d in deps:
+            dep_path = self.get_path(d)
+            if not os.path.exists(dep_path) or os.path.getmtime(dep_path) > mtime:
+                return False
+        return True
+
+    def remove(self, node: CNode):
+        if os.path.exists(path := self.get_path(node.name)):
+            os.remove(path)
+
+    def save(self, node: CNode, cmd: list[str]):
+        with open(self.get_path(node.name), "w") as f:
+            json.dump({"cmd": cmd[1:], "elapsed": round(node.elapsed, 2)}, f)
+
+
+"""
+----------------------------------------------------------------
+Part III: run nodes as sub processes, a node starts as soon as
+          all of its dependencies are done and there are enough
+          free cores
+----------------------------------------------------------------
+"""
+
+
+class CPipeline:
+    def __init__(
+            self,
+            nodes: list[CNode],
+            script: str,
+            stp_date: str,
+            cores: int,
+            stamps: CStamps,
+            verbose: bool = False,
+    ):
+        """
+
+        :param nodes: in topological order
+        :param script: path of main.py
+        :param cores: budget of cores of all running nodes
+        :param stamps: stamps and logs of nodes are saved in stamps.stamps_dir
+        """
+        self.nodes = {node.name: node for node in nodes}
+        self.cmds = {node.name: node.get_cmd(script, stp_date, verbose) for node in nodes}
+        self.cores = cores
+        self.stamps = stamps
+        self.procs: dict[str, subprocess.Popen] = {}
+
+    def get_deps(self, node: CNode) -> list[str]:
+        return [d for d in node.deps if d in self.nodes]
+
+    def plan(self, force: bool):
+        for node in self.nodes.values():
+            deps = self.get_deps(node)
+            if force or any(self.nodes[d].status == "pending" for d in deps):
+                continue
+            if self.stamps.is_up_to_date(node, self.cmds[node.name], deps):
+                node.status = "up-to-date"
+
+    def is_ready(self, node: CNode) -> bool:
+        return node.status == "pending" and all(
+            self.nodes[d].status in ("done", "up-to-date") for d in self.get_deps(node)
+        )
+
+    def block_dependents(self, name: str):
+        for node in self.nodes.values():
+            if node.status == "pending" and name in node.deps:
+                node.status = "blocked"
+                self.block_dependents(node.name)
+
+    def start(self, node: CNode):
+        self.stamps.remove(node)
+        with open(self.stamps.get_path(node.name, "log"), "w") as log:
+            self.procs[node.name] = subprocess.Popen(self.cmds[node.name], stdout=log, stderr=subprocess.STDOUT)
+        node.status, node.t_start = "running", time.time()
+        logger.info(f"Start {SFY(node.name)} with {SFY(node.cores)} cores: {' '.join(self.cmds[node.name][1:])}")
+
+    def check(self) -> bool:
+        """
+
+        :return: whether any running node has finished
+        """
+        finished = False
+        for name, proc in list(self.procs.items()):
+            if (returncode := proc.poll()) is None:
+                continue
+            node, finished = self.nodes[name], True
+            node.t_end = time.time()
+            del self.procs[name]
+            if returncode == 0:
+                node.status = "done"
+                self.stamps.save(node, self.cmds[name])
+                logger.info(f"Finished {SFY(name)} in {SFY(f'{node.elapsed:.1f}')}s")
+            else:
+                node.status = "failed"
+                self.block_dependents(name)
+                logger.error(
+                    f"Failed {SFY(name)} with return code {returncode}, "
+                    f"see {self.stamps.get_path(name, 'log')}"
+                )
+        return finished
+
+    def run(self, force: bool = False, dry_run: bool = False, poll_interval: float = 0.5) -> int:
+        """
+
+        :param force: run all nodes, even if they are up to date
+        :param dry_run: only print nodes to run
+        :return: number of failed nodes
+        """
+        self.plan(force)
+        if dry_run:
+            for name, node in self.nodes.items():
+                logger.info(f"{name:<20s} {node.status:<10s} {' '.join(self.cmds[name][1:])}")
+            return 0
+
+        t0 = time.time()
+        while True:
+            used = sum(self.nodes[name].cores for name in self.procs)
+            for node in self.nodes.values():
+                # a node starts if it fits in free cores, or nothing else is running
+                if self.is_ready(node) and (used + node.cores <= self.cores or not self.procs):
+                    self.start(node)
+                    used += node.cores
+            if not self.procs:
+                break
+            while not self.check():
+                time.sleep(poll_interval)
+        self.report(time.time() - t0)
+        return sum(node.status == "failed" for node in self.nodes.values())
+
+    def report(self, wall: float):
+        t0 = min([node.t_start for node in self.nodes.values() if node.t_start > 0], default=0)
+        logger.info(f"Time of {SFY(len(self.nodes))} nodes with a budget of {SFY(self.cores)} cores:")
+        for name, node in self.nodes.items():
+            if node.t_start > 0:
+                timing = f"start = {node.t_start - t0:>8.1f}s, elapsed = {node.elapsed:>8.1f}s"
+            else:
+                timing = ""
+            logger.info(f"{name:<20s} {node.status:<10s} cores = {node.cores:>2d}, {timing}")
+        node_time = sum(node.elapsed for node in self.nodes.values() if node.t_start > 0)
+        logger.info(f"Wall time = {SFY(f'{wall:.1f}')}s, sum of time of nodes = {SFY(f'{node_time:.1f}')}s")
@@ -1,12 +1,14 @@
 import os
+import numpy as np
 import pandas as pd
-import scipy.stats as sps
+from scipy.special import ndtri
 import itertools as ittl
 from rich.progress import Progress
 from husfort.qsqlite import CDbStruct, CSqlTable, CSqlVar
 from typedef import TFactorClass, TFactorName, TFactorNames, TFactors, CSimArgs, TRets, TUniqueId, TGroupId, TRetPrc
 from typedef import TSimGrpIdByFacNeu, TSimGrpIdByFacGrp
 from typedef import CTestMdl, CRet, CModel, TFactorGroups
+from solutions.storage import get_db_name
 
 
 def convert_mkt_idx(mkt_idx: str, prefix: str = "I") -> str:
@@ -41,51 +43,38 @@ def neutralize_by_date(
         task = pb.add_task(description="Neutralizing", total=3)
 
         # --- get instrument rank for each day
-        rank_data = (
-            raw_data[[date_name] + old_names]
-            .groupby(by=date_name, group_keys=False)[old_names]
-            .apply(lambda z: z.rank() / (z.count() + 1))
-        )
+        grp_by_date = raw_data.groupby(by=date_name, sort=False)[old_names]
+        rank_data = grp_by_date.rank() / (grp_by_date.transform("count") + 1)
         pb.update(task, advance=1)
 
-        # --- map rank to random variable with normal distribution
-        norm_rv_data = rank_data.apply(sps.norm.ppf)
-        norm_data = pd.merge(
-            left=raw_data[[date_name, instru_name, sec_name]],
-            right=norm_rv_data,
-            how="inner",
-            left_index=True, right_index=True,
+        # --- map rank to random variable with normal distribution, same as scipy.stats.norm.ppf
+        norm_data = pd.DataFrame(
+            ndtri(rank_data.to_numpy(dtype=np.float64)),
+            index=rank_data.index, columns=old_names,
         )
         pb.update(task, advance=1)
 
         # --- neutralize for each sector and day
-        neu_data = (
-            norm_data[[date_name, sec_name] + old_names]
-            .groupby(by=[date_name, sec_name], group_keys=False)[old_names]
-            .apply(lambda z: z - z.mean())
-        )
-        rename_mapper = {o: n for o, n in zip(old_names, new_names)}
-        res_data = pd.merge(
-            left=raw_data[[date_name, instru_name, sec_name]],
-            right=neu_data,
-            how="inner",
-            left_index=True, right_index=True
-        ).rename(columns=rename_mapper)
+        keys = [raw_data[date_name], raw_data[sec_name]]
+        neu_data = norm_data - norm_data.groupby(by=keys, sort=False).transform("mean")
         pb.update(task, advance=1)
 
-        # --- reformat
-        res_data = res_data[[date_name, instru_name, sec_name] + new_names]
+        # --- reformat, rows without date or sector are dropped
+        rename_mapper = {o: n for o, n in zip(old_names, new_names)}
+        res_data = pd.concat([raw_data[[date_name, instru_name, sec_name]], neu_data], axis=1)
+        res_data = res_data.loc[raw_data[date_name].notna() & raw_data[sec_name].notna()]
+        res_data = res_data.rename(columns=rename_mapper)[[date_name, instru_name, sec_name] + new_names]
     return res_data
 
 
-# ----------------------------------------
-# ------ sqlite3 database structure ------
-# ----------------------------------------
+# ---------------------------------
+# ------ database structure -------
+# ---------------------------------
 
 def gen_tst_ret_fac_raw_db(instru: str, db_save_root_dir: str, save_id: str, rets: list[str]) -> CDbStruct:
     return CDbStruct(
         db_save_dir=os.path.join(db_save_root_dir, save_id),
-        db_name=f"{instru}.db",
+        db_name=get_db_name(instru, kind="tst_ret"),
         table=CSqlTable(
             name="test_return",
             primary_keys=[CSqlVar("trade_date", "TEXT")],
@@ -105,7 +94,7 @@ def gen_tst_ret_raw_db(db_save_root_dir: str, save_id: str, rets: list[str]) ->
 
     return CDbStruct(
         db_save_dir=db_save_root_dir,
-        db_name=f"{save_id}.db",
+        db_name=get_db_name(save_id, kind="tst_ret"),
         table=CSqlTable(
             name="test_return",
             primary_keys=[CSqlVar("trade_date", "TEXT"), CSqlVar("instrument", "TEXT")],
@@ -125,7 +114,7 @@ def gen_tst_ret_neu_db(db_save_root_dir: str, save_id: str, rets: list[str]) ->
 
     return CDbStruct(
         db_save_dir=db_save_root_dir,
-        db_name=f"{save_id}.db",
+        db_name=get_db_name(save_id, kind="tst_ret"),
         table=CSqlTable(
             name="test_return",
             primary_keys=[CSqlVar("trade_date", "TEXT"), CSqlVar("instrument", "TEXT")],
@@ -140,7 +129,7 @@ def gen_fac_raw_db(
 ) -> CDbStruct:
     return CDbStruct(
         db_save_dir=os.path.join(db_save_root_dir, factor_class),
-        db_name=f"{instru}.db",
+        db_name=get_db_name(instru, kind="fac_raw"),
         table=CSqlTable(
             name="factor",
             primary_keys=[CSqlVar("trade_date", "TEXT")],
@@ -155,7 +144,7 @@ def gen_fac_neu_db(
 ) -> CDbStruct:
     return CDbStruct(
         db_save_dir=os.path.join(db_save_root_dir, factor_class),
-        db_name=f"{factor_class}.db",
+        db_name=get_db_name(factor_class, kind="fac_neu"),
         table=CSqlTable(
             name="factor",
             primary_keys=[CSqlVar("trade_date", "TEXT"), CSqlVar("instrument", "TEXT")],
@@ -167,7 +156,7 @@ def gen_fac_neu_db(
 def gen_sig_db(db_save_dir: str, signal_id: str) -> CDbStruct:
     return CDbStruct(
         db_save_dir=db_save_dir,
-        db_name=f"{signal_id}.db",
+        db_name=get_db_name(signal_id, kind="sig"),
         table=CSqlTable(
             name="signal",
             primary_keys=[CSqlVar("trade_date", "TEXT"), CSqlVar("instrument", "TEXT")],
@@ -179,7 +168,7 @@ def gen_sig_db(db_save_dir: str, signal_id: str) -> CDbStruct:
 def gen_nav_db(db_save_dir: str, save_id: str) -> CDbStruct:
     return CDbStruct(
         db_save_dir=db_save_dir,
-        db_name=f"{save_id}.db",
+        db_name=get_db_name(save_id, kind="nav"),
         table=CSqlTable(
             name="nav",
             primary_keys=[CSqlVar("trade_date", "TEXT")],
@@ -197,7 +186,7 @@ def gen_nav_db(db_save_dir: str, save_id: str) -> CDbStruct:
 def gen_prdct_db(db_save_root_dir: str, test: CTestMdl) -> CDbStruct:
     return CDbStruct(
         db_save_dir=db_save_root_dir,
-        db_name=f"{test.save_tag_mdl}.db",
+        db_name=get_db_name(test.save_tag_mdl, kind="prdct"),
         table=CSqlTable(
             name="prediction",
             primary_keys=[CSqlVar("trade_date", "TEXT"), CSqlVar("instrument", "TEXT")],
@@ -209,7 +198,7 @@ def gen_prdct_db(db_save_root_dir: str, test: CTestMdl) -> CDbStruct:
 def gen_opt_wgt_db(db_save_dir: str, save_id: str, underlying_assets_names: list[str]) -> CDbStruct:
     return CDbStruct(
         db_save_dir=db_save_dir,
-        db_name=f"{save_id}.db",
+        db_name=get_db_name(save_id, kind="opt_wgt"),
         table=CSqlTable(
             name="weights",
             primary_keys=[CSqlVar("trade_date", "TEXT")],
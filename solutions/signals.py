@@ -1,12 +1,15 @@
+import numpy as np
 import pandas as pd
 import multiprocessing as mp
-from itertools import product
 from rich.progress import Progress, track
 from husfort.qutility import check_and_makedirs, error_handler
-from husfort.qsqlite import CMgrSqlDb
 from husfort.qcalendar import CCalendar
+from solutions.storage import gen_db_mgr
 from solutions.shared import gen_sig_db, gen_fac_neu_db, gen_prdct_db, gen_opt_wgt_db
-from typedef import CFactor, TFactors, TFactorNames, CSimArgs, TSimGrpIdByFacGrp, TRetPrc
+from solutions.panel import update_with_panel, read_by_range_with_panel
+from solutions.executor import CPoolExecutor, use_executor
+from solutions.factorKernels import compensated_cumsum, window_sums
+from typedef import TFactorClass, TFactorName, TFactors, TFactorNames, CSimArgs, TSimGrpIdByFacGrp, TRetPrc
 from typedef import CTestMdl
 
 
@@ -18,25 +21,19 @@ class _CSignal:
     def save(self, new_data: pd.DataFrame, calendar: CCalendar):
         db_struct_sig = gen_sig_db(self.signal_save_dir, self.signal_id)
         check_and_makedirs(db_struct_sig.db_save_dir)
-        sqldb = CMgrSqlDb(
+        sqldb = gen_db_mgr(
             db_save_dir=db_struct_sig.db_save_dir,
             db_name=db_struct_sig.db_name,
             table=db_struct_sig.table,
             mode="a",
         )
         if sqldb.check_continuity(new_data["trade_date"].iloc[0], calendar) == 0:
-            sqldb.update(new_data[db_struct_sig.table.vars.names])
+            update_with_panel(db_struct_sig, sqldb, new_data[db_struct_sig.table.vars.names])
         return 0
 
     def read(self, bgn_date: str, stp_date: str) -> pd.DataFrame:
         db_struct_sig = gen_sig_db(self.signal_save_dir, self.signal_id)
-        sqldb = CMgrSqlDb(
-            db_save_dir=db_struct_sig.db_save_dir,
-            db_name=db_struct_sig.db_name,
-            table=db_struct_sig.table,
-            mode="r",
-        )
-        data = sqldb.read_by_range(bgn_date, stp_date)
+        data = read_by_range_with_panel(db_struct_sig, bgn_date, stp_date)
         return data
 
     def load_input(self, bgn_date: str, stp_date: str, calendar: CCalendar) -> pd.DataFrame:
@@ -94,51 +91,130 @@ class _CSignal:
 """
 
 
-class CSignalFromFactorNeu(_CSignal):
-    def __init__(self, factor: CFactor, factor_save_root_dir: str, signal_save_dir: str, maw: int):
-        self.factor = factor
+def long_to_wide(
+        data: pd.DataFrame, value_columns: list[str]
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+
+    :param data: long table with columns "trade_date", "instrument" and value_columns,
+                 with unique (trade_date, instrument)
+    :return: (dates, instruments, mask, values), dates and instruments are sorted,
+             mask is a 2-D bool array of dates x instruments, True if the row exists,
+             values is a 3-D float array of dates x value_columns x instruments, nan if missing
+    """
+    dates, r = np.unique(data["trade_date"].to_numpy(dtype=object), return_inverse=True)
+    instruments, c = np.unique(data["instrument"].to_numpy(dtype=object), return_inverse=True)
+    mask = np.zeros((len(dates), len(instruments)), dtype=bool)
+    mask[r, c] = True
+    values = np.full((len(dates), len(value_columns), len(instruments)), np.nan)
+    for k, z in enumerate(value_columns):
+        values[r, k, c] = data[z].to_numpy(dtype=np.float64)
+    return dates, instruments, mask, values
+
+
+def rank_weights(values: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """
+    The same weights as sorting by ["trade_date", factor, "instrument"] with ascending =
+    [True, False, True] and applying map_factor_to_signal to each date, for all factors at once.
+
+    :param values: 3-D float array of dates x factors x instruments, instruments are sorted,
+                   nan is ranked after all numbers, like sort_values
+    :param mask: 2-D bool array of dates x instruments, True if the row exists
+    :return: 3-D float array of weights, the first half of rows of each date are 1, the last half
+             are -1, normalized by the sum of abs, and 0 where mask is False
+    """
+    col = np.broadcast_to(np.arange(values.shape[2]), values.shape)
+    is_nan = np.isnan(values)
+    missing = np.broadcast_to(~mask[:, None, :], values.shape)
+    order = np.lexsort((col, np.where(is_nan, 0, -values), is_nan, missing), axis=-1)
+    pos = np.empty_like(order)
+    np.put_along_axis(pos, order, np.broadcast_to(np.arange(values.shape[2]), values.shape), axis=-1)
+    n = mask.sum(axis=1)[:, None, None]
+    half = n // 2
+    weights = np.where(pos < half, 1.0, np.where(pos >= n - half, -1.0, 0.0))
+    weights[missing] = 0
+    return weights / np.maximum(2 * half, 1)
+
+
+class CSignalsFromFactorNeu:
+    def __init__(
+            self, factor_class: TFactorClass, factor_names: TFactorNames,
+            factor_save_root_dir: str, signal_save_dir: str, maws: list[int],
+    ):
+        """
+        Signals of all factors of a class and all moving average windows, from one read of
+        the neutralized factors. Results are the same as ranking each factor by date with
+        map_factor_to_signal and then moving_average_signal of each maw.
+
+        """
+        self.factor_class = factor_class
+        self.factor_names = factor_names
         self.factor_save_root_dir = factor_save_root_dir
-        self.maw = maw
-        signal_id = f"{factor.factor_name}.MA{self.maw:02d}"
-        super().__init__(signal_save_dir=signal_save_dir, signal_id=signal_id)
+        self.signal_save_dir = signal_save_dir
+        self.maws = maws
 
     def load_input(self, bgn_date: str, stp_date: str, calendar: CCalendar) -> pd.DataFrame:
-        base_bgn_date = calendar.get_next_date(bgn_date, -self.maw + 1)
+        base_bgn_date = calendar.get_next_date(bgn_date, -max(self.maws) + 1)
         db_struct_fac = gen_fac_neu_db(
             db_save_root_dir=self.factor_save_root_dir,
-            factor_class=self.factor.factor_class,
-            factor_names=TFactorNames([self.factor.factor_name]),
+            factor_class=self.factor_class,
+            factor_names=self.factor_names,
         )
-        sqldb = CMgrSqlDb(
-            db_save_dir=db_struct_fac.db_save_dir,
-            db_name=db_struct_fac.db_name,
-            table=db_struct_fac.table,
-            mode="r",
-        )
-        data = sqldb.read_by_range(
-            bgn_date=base_bgn_date, stp_date=stp_date,
-            value_columns=["trade_date", "instrument", self.factor.factor_name],
+        data = read_by_range_with_panel(
+            db_struct_fac, bgn_date=base_bgn_date, stp_date=stp_date,
+            value_columns=["trade_date", "instrument"] + self.factor_names,
         )
         return data
 
-    def core(self, input_data: pd.DataFrame, bgn_date: str, stp_date: str, calendar: CCalendar) -> pd.DataFrame:
-        sorted_data = input_data.sort_values(
-            by=["trade_date", self.factor.factor_name, "instrument"], ascending=[True, False, True]
-        )
-        grouped_data = sorted_data.groupby(by=["trade_date"], group_keys=False)
-        signal_data = grouped_data.apply(self.map_factor_to_signal)
-        signal_data_ma = self.moving_average_signal(signal_data, bgn_date=bgn_date, maw=self.maw)
-        return signal_data_ma
+    def core(
+            self, input_data: pd.DataFrame, bgn_date: str, stp_date: str, calendar: CCalendar,
+    ) -> dict[tuple[TFactorName, int], pd.DataFrame]:
+        """
+
+        :return: a dict with key = (factor_name, maw), value = pd.DataFrame with
+                 columns = ["trade_date", "instrument", "weight"]
+        """
+        dates, instruments, mask, values = long_to_wide(input_data, self.factor_names)
+        prefix = compensated_cumsum(rank_weights(values, mask))
+        i_bgn = int(np.searchsorted(dates, bgn_date))
+        res: dict[tuple[TFactorName, int], pd.DataFrame] = {}
+        for maw in self.maws:
+            # moving average of each maw only uses data since its own base begin date
+            i_base = int(np.searchsorted(dates, calendar.get_next_date(bgn_date, -maw + 1)))
+            cols = mask[i_base:].any(axis=0)
+            ma = np.zeros((len(dates) - i_bgn, len(self.factor_names), cols.sum()))
+            if (i_valid := max(i_bgn, i_base + maw - 1)) < len(dates):
+                ma[i_valid - i_bgn:] = window_sums(prefix, maw)[i_valid - maw + 1:][:, :, cols] / maw
+            abs_sum = np.abs(ma).sum(axis=2, keepdims=True)
+            weights = np.divide(ma, abs_sum, out=np.zeros_like(ma), where=abs_sum > 0)
+            trade_dates = np.repeat(dates[i_bgn:], cols.sum())
+            instru = np.tile(instruments[cols], len(dates) - i_bgn)
+            for k, factor_name in enumerate(self.factor_names):
+                res[(factor_name, maw)] = pd.DataFrame({
+                    "trade_date": trade_dates,
+                    "instrument": instru,
+                    "weight": weights[:, k, :].ravel(),
+                })
+        return res
+
+    def main(self, bgn_date: str, stp_date: str, calendar: CCalendar):
+        input_data = self.load_input(bgn_date, stp_date, calendar)
+        for (factor_name, maw), new_data in self.core(input_data, bgn_date, stp_date, calendar).items():
+            if not new_data.empty:
+                signal = _CSignal(signal_save_dir=self.signal_save_dir, signal_id=f"{factor_name}.MA{maw:02d}")
+                signal.save(new_data=new_data, calendar=calendar)
+        return 0
 
 
 def process_for_signal_from_factor_neu(
-        factor: CFactor, factor_save_root_dir: str, maw: int, signal_save_dir: str,
-        bgn_date: str, stp_date: str, calendar: CCalendar,
+        factor_class: TFactorClass, factor_names: TFactorNames, factor_save_root_dir: str, maws: list[int],
+        signal_save_dir: str, bgn_date: str, stp_date: str, calendar: CCalendar,
 ):
-    signal = CSignalFromFactorNeu(
-        factor, factor_save_root_dir=factor_save_root_dir, signal_save_dir=signal_save_dir, maw=maw,
+    signals = CSignalsFromFactorNeu(
+        factor_class=factor_class, factor_names=factor_names,
+        factor_save_root_dir=factor_save_root_dir, signal_save_dir=signal_save_dir, maws=maws,
     )
-    signal.main(bgn_date, stp_date, calendar)
+    signals.main(bgn_date, stp_date, calendar)
     return 0
 
 
@@ -152,36 +228,42 @@ def main_signals_from_factor_neu(
         calendar: CCalendar,
         call_multiprocess: bool,
         processes: int,
+        executor: CPoolExecutor | None = None,
 ):
+    """
+
+    :param executor: a running pool shared by stages, with "calendar" in its shared objects.
+                     If None, a new pool is started for this stage.
+    """
     desc = "Translating neutralized factors to signals"
-    iter_args = product(factors, maws)
+    grouped_factors: dict[TFactorClass, TFactorNames] = {}
+    for factor in factors:
+        grouped_factors.setdefault(factor.factor_class, TFactorNames([])).append(factor.factor_name)
     if call_multiprocess:
-        with Progress() as pb:
-            main_task = pb.add_task(description=desc, total=len(factors))
-            with mp.get_context("spawn").Pool(processes) as pool:
-                for factor, maw in iter_args:
-                    pool.apply_async(
-                        process_for_signal_from_factor_neu,
-                        kwds={
-                            "factor": factor,
-                            "factor_save_root_dir": factor_save_root_dir,
-                            "maw": maw,
-                            "signal_save_dir": signal_save_dir,
-                            "bgn_date": bgn_date,
-                            "stp_date": stp_date,
-                            "calendar": calendar,
-                        },
-                        callback=lambda _: pb.update(main_task, advance=1),
-                        error_callback=error_handler,
-                    )
-                pool.close()
-                pool.join()
+        with use_executor(executor, processes, shared={"calendar": calendar}) as pool_executor:
+            pool_executor.run(
+                process_for_signal_from_factor_neu,
+                [
+                    {
+                        "factor_class": factor_class,
+                        "factor_names": factor_names,
+                        "factor_save_root_dir": factor_save_root_dir,
+                        "maws": maws,
+                        "signal_save_dir": signal_save_dir,
+                        "bgn_date": bgn_date,
+                        "stp_date": stp_date,
+                    } for factor_class, factor_names in grouped_factors.items()
+                ],
+                shared_kwargs=("calendar",),
+                description=desc,
+            )
     else:
-        for factor, maw in track(list(iter_args), description=desc):
+        for factor_class, factor_names in track(list(grouped_factors.items()), description=desc):
             process_for_signal_from_factor_neu(
-                factor=factor,
+                factor_class=factor_class,
+                factor_names=factor_names,
                 factor_save_root_dir=factor_save_root_dir,
-                maw=maw,
+                maws=maws,
                 signal_save_dir=signal_save_dir,
                 bgn_date=bgn_date,
                 stp_date=stp_date,
@@ -208,7 +290,7 @@ class CSignalFromMdlPrd(_CSignal):
     def load_input(self, bgn_date: str, stp_date: str, calendar: CCalendar) -> pd.DataFrame:
         base_bgn_date = calendar.get_next_date(bgn_date, -self.maw + 1)
         db_struct_prd = gen_prdct_db(db_save_root_dir=self.mclrn_prd_dir, test=self.test)
-        sqldb = CMgrSqlDb(
+        sqldb = gen_db_mgr(
             db_save_dir=db_struct_prd.db_save_dir,
             db_name=db_struct_prd.db_name,
             table=db_struct_prd.table,
@@ -318,7 +400,7 @@ class CSignalFromOpt(_CSignal):
             save_id=self.signal_id,
             underlying_assets_names=self.underlying_assets_names,
         )
-        sqldb = CMgrSqlDb(
+        sqldb = gen_db_mgr(
             db_save_dir=db_struct_opt.db_save_dir,
             db_name=db_struct_opt.db_name,
             table=db_struct_opt.table,
@@ -333,7 +415,7 @@ class CSignalFromOpt(_CSignal):
             signal_id = ".".join(input_signal_id.split(".")[:-1])
             unique_id = input_signal_id.split(".")[0]
             db_struct_sig = gen_sig_db(db_save_dir=self.input_sig_dir, signal_id=signal_id)
-            sqldb = CMgrSqlDb(
+            sqldb = gen_db_mgr(
                 db_save_dir=db_struct_sig.db_save_dir,
                 db_name=db_struct_sig.db_name,
                 table=db_struct_sig.table,
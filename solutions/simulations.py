@@ -1,11 +1,23 @@
-import multiprocessing as mp
+import os
+import json
+import numpy as np
 import pandas as pd
-from rich.progress import track, Progress
-from husfort.qutility import error_handler, check_and_makedirs
+from rich.progress import track
+from husfort.qutility import check_and_makedirs
 from husfort.qcalendar import CCalendar
 from husfort.qsqlite import CMgrSqlDb
+from solutions.storage import CMgrParquetDb, gen_db_mgr
 from solutions.shared import gen_nav_db
-from typedef import CSimArgs
+from solutions.panel import read_by_range_with_panel
+from solutions.executor import CPoolExecutor, use_executor
+from solutions.calendarIndex import get_calendar_index
+from typedef import CRet, CSimArgs
+
+"""
+--------------------------------
+Part I: simulation of one signal
+--------------------------------
+"""
 
 
 class CSim:
@@ -15,24 +27,12 @@ class CSim:
         self.db_struct_sim = gen_nav_db(db_save_dir=sim_save_dir, save_id=sim_args.sim_id)
 
     def load_sig(self, bgn_date: str, stp_date: str) -> pd.DataFrame:
-        sqldb = CMgrSqlDb(
-            db_save_dir=self.sim_args.db_struct_sig.db_save_dir,
-            db_name=self.sim_args.db_struct_sig.db_name,
-            table=self.sim_args.db_struct_sig.table,
-            mode="r",
-        )
-        data = sqldb.read_by_range(bgn_date, stp_date)
+        data = read_by_range_with_panel(self.sim_args.db_struct_sig, bgn_date, stp_date)
         return data
 
     def load_ret(self, bgn_date: str, stp_date: str) -> pd.DataFrame:
-        sqldb = CMgrSqlDb(
-            db_save_dir=self.sim_args.db_struct_ret.db_save_dir,
-            db_name=self.sim_args.db_struct_ret.db_name,
-            table=self.sim_args.db_struct_ret.table,
-            mode="r",
-        )
-        data = sqldb.read_by_range(
-            bgn_date, stp_date,
+        data = read_by_range_with_panel(
+            self.sim_args.db_struct_ret, bgn_date, stp_date,
             value_columns=["trade_date", "instrument", self.sim_args.tgt_ret.ret_name]
         )
         return data
@@ -73,8 +73,8 @@ class CSim:
 
     def align_dates(self, sim_data: pd.DataFrame, bgn_date: str, calendar: CCalendar) -> pd.DataFrame:
         aligned_sim_data = sim_data.reset_index()
-        aligned_sim_data["trade_date"] = aligned_sim_data["trade_date"].map(
-            lambda z: calendar.get_next_date(z, self.sim_args.tgt_ret.shift)
+        aligned_sim_data["trade_date"] = get_calendar_index(calendar).shift(
+            aligned_sim_data["trade_date"], self.sim_args.tgt_ret.shift
         )
         return aligned_sim_data.query(f"trade_date >= '{bgn_date}'")
 
@@ -85,7 +85,7 @@ class CSim:
 
     def main(self, bgn_date: str, stp_date: str, calendar: CCalendar):
         check_and_makedirs(self.db_struct_sim.db_save_dir)
-        sqldb = CMgrSqlDb(
+        sqldb = gen_db_mgr(
             db_save_dir=self.db_struct_sim.db_save_dir,
             db_name=self.db_struct_sim.db_name,
             table=self.db_struct_sim.table,
@@ -115,6 +115,245 @@ class CSim:
         return 0
 
 
+"""
+------------------------------------------------------------------
+Part II: batch simulations. Sims with the same test return are
+         calculated together on a cube of sims x dates x instruments,
+         the return panel is loaded only once for all of them.
+------------------------------------------------------------------
+"""
+
+
+class CSimBatch:
+    def __init__(self, sim_args_list: list[CSimArgs], sim_save_dir: str):
+        """
+
+        :param sim_args_list: sims with the same db_struct_ret and tgt_ret, costs may differ
+        :param sim_save_dir:
+        """
+        self.sim_args_list = sim_args_list
+        self.sim_save_dir = sim_save_dir
+        self.db_struct_ret = sim_args_list[0].db_struct_ret
+        self.tgt_ret = sim_args_list[0].tgt_ret
+
+    def load_ret(self, bgn_date: str, stp_date: str) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+
+        :return: (dates, instruments, ret, mask), ret is a 2-D float array of dates x instruments,
+                 the same as CSim.reformat_ret, 0 where mask is False
+        """
+        ret_name = self.tgt_ret.ret_name
+        data = read_by_range_with_panel(
+            self.db_struct_ret, bgn_date, stp_date, value_columns=["trade_date", "instrument", ret_name]
+        )
+        dates, r = np.unique(data["trade_date"].to_numpy(dtype=object), return_inverse=True)
+        instruments, c = np.unique(data["instrument"].to_numpy(dtype=object), return_inverse=True)
+        mask = np.zeros((len(dates), len(instruments)), dtype=bool)
+        mask[r, c] = True
+        ret = np.zeros((len(dates), len(instruments)))
+        ret[r, c] = np.nan_to_num(data[ret_name].to_numpy(dtype=np.float64), nan=0) / self.tgt_ret.win
+        return dates, instruments, ret, mask
+
+    @staticmethod
+    def load_sig(
+            sim_args: CSimArgs, bgn_date: str, stp_date: str, dates: np.ndarray, instruments: np.ndarray,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+
+        :return: (sig, mask) on the grid of dates x instruments of returns, sig is 0 where mask
+                 is False, rows out of the grid are dropped, like the inner merge of CSim
+        """
+        data = read_by_range_with_panel(sim_args.db_struct_sig, bgn_date, stp_date)
+        grid_dates, sig_dates = dates.astype(str), data["trade_date"].to_numpy(dtype=str)  # faster than object
+        r = np.searchsorted(grid_dates, sig_dates)
+        r_in = r < len(dates)
+        r_in[r_in] = grid_dates[r[r_in]] == sig_dates[r_in]
+        c = pd.Index(instruments).get_indexer(data["instrument"].to_numpy(dtype=object))
+        keep = r_in & (c >= 0)
+        sig, mask = np.zeros((len(dates), len(instruments))), np.zeros((len(dates), len(instruments)), dtype=bool)
+        sig[r[keep], c[keep]] = np.nan_to_num(data["weight"].to_numpy(dtype=np.float64)[keep], nan=0)
+        mask[r[keep], c[keep]] = True
+        return sig, mask
+
+    @staticmethod
+    def cal_ret(
+            sig: np.ndarray, sig_mask: np.ndarray, ret: np.ndarray, ret_mask: np.ndarray, costs: np.ndarray,
+            wgt_init: np.ndarray = None,
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+
+        :param sig: 3-D float array of sims x dates x instruments
+        :param sig_mask: 3-D bool array, True if the signal row exists
+        :param ret: 2-D float array of dates x instruments
+        :param ret_mask: 2-D bool array, True if the return row exists
+        :param costs: 1-D array, cost rate of each sim
+        :param wgt_init: 2-D float array of sims x instruments, weights before the first date,
+                         None for all 0
+        :return: (raw_ret, dlt_wgt, cost, net_ret, present, wgt_last), the first 5 are 2-D arrays
+                 of sims x dates, present is True if the sim has any merged row at that date.
+                 Delta weight of a date is against the previous present date of the sim, like
+                 CSim.cal_ret. wgt_last is the 2-D array of weights at the last date.
+        """
+        merged = sig_mask & ret_mask
+        wgt = np.where(merged, sig, 0)
+        raw_ret = np.einsum("sdi,di->sd", wgt, ret)
+        present = merged.any(axis=2)
+        n_sims, n_dates = present.shape
+        last = np.maximum.accumulate(np.where(present, np.arange(n_dates), -1), axis=1)
+        prev = np.concatenate([np.full((n_sims, 1), -1), last[:, :-1]], axis=1)
+        wgt_prev = np.take_along_axis(wgt, np.maximum(prev, 0)[:, :, None], axis=1)
+        s, d = np.nonzero(prev < 0)
+        wgt_prev[s, d] = 0 if wgt_init is None else wgt_init[s]
+        dlt_wgt = np.abs(wgt - wgt_prev).sum(axis=2)
+        cost = dlt_wgt * costs[:, None]
+        net_ret = raw_ret - cost
+        return raw_ret, dlt_wgt, cost, net_ret, present, wgt[:, -1]
+
+    def get_state_path(self, sim_id: str) -> str:
+        return os.path.join(self.sim_save_dir, f"{sim_id}.state.json")
+
+    def load_state(self, sim_id: str) -> dict | None:
+        """
+
+        :return: {"base_date": str, "nav": float, "weights": {instrument: weight}}, saved by the
+                 last run of this sim in batch mode. "weights" are the merged weights at
+                 "base_date", the last base date of that run. None if there is no state.
+        """
+        if not os.path.exists(path := self.get_state_path(sim_id)):
+            return None
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def save_state(self, sim_id: str, base_date: str, nav: float, weights: dict[str, float]):
+        with open(self.get_state_path(sim_id), "w") as f:
+            json.dump({"base_date": base_date, "nav": nav, "weights": weights}, f)
+
+    def main(self, bgn_date: str, stp_date: str, calendar: CCalendar):
+        """
+        The same as CSim.main of each sim. If a sim has the state of its last run, and that run
+        stopped right before bgn_date, only the new dates are loaded, and the state gives the
+        previous weights and the last nav. Else the date before is loaded for the previous
+        weights, like CSim.main. Sims with nan results are not saved, and are raised together
+        after the others are saved.
+
+        """
+        check_and_makedirs(self.sim_save_dir)
+        shift = self.tgt_ret.shift
+        iter_dates = calendar.get_iter_list(bgn_date, stp_date)
+        prev_base_date = calendar.get_next_date(iter_dates[0], shift=-shift - 1)
+        base_end_date = calendar.get_next_date(iter_dates[-1], shift=-shift)
+        base_stp_date = calendar.get_next_date(base_end_date, shift=1)
+
+        # --- sims to update, with their own base begin dates, last nav and previous weights
+        sims: list[tuple[CSimArgs, CMgrSqlDb | CMgrParquetDb, str, float, dict[str, float]]] = []
+        for sim_args in self.sim_args_list:
+            db_struct_sim = gen_nav_db(db_save_dir=self.sim_save_dir, save_id=sim_args.sim_id)
+            sqldb = gen_db_mgr(
+                db_save_dir=db_struct_sim.db_save_dir,
+                db_name=db_struct_sim.db_name,
+                table=db_struct_sim.table,
+                mode="a",
+            )
+            if sqldb.check_continuity(bgn_date, calendar) == 0:
+                state = None if sqldb.empty else self.load_state(sim_args.sim_id)
+                if state is not None and state["base_date"] == prev_base_date:
+                    base_bgn_date = calendar.get_next_date(prev_base_date, shift=1)
+                    sims.append((sim_args, sqldb, base_bgn_date, state["nav"], state["weights"]))
+                else:
+                    d = 0 if sqldb.empty else 1  # for calculating delta weight
+                    base_bgn_date = calendar.get_next_date(iter_dates[0], shift=-shift - d)
+                    sims.append((sim_args, sqldb, base_bgn_date, sqldb.last_val(val="nav", val_if_none=1.0), {}))
+        if not sims:
+            return 0
+
+        # --- cube of sims x dates x instruments
+        load_bgn_date = min(z[2] for z in sims)
+        dates, instruments, ret, ret_mask = self.load_ret(load_bgn_date, base_stp_date)
+        if extra := sorted({k for z in sims for k in z[4]} - set(instruments)):
+            # instruments held before but without returns now, they are still sold
+            instruments = np.concatenate([instruments, np.array(extra, dtype=object)])
+            ret = np.pad(ret, ((0, 0), (0, len(extra))))
+            ret_mask = np.pad(ret_mask, ((0, 0), (0, len(extra))))
+        sig = np.zeros((len(sims), len(dates), len(instruments)))
+        sig_mask = np.zeros((len(sims), len(dates), len(instruments)), dtype=bool)
+        wgt_init = np.zeros((len(sims), len(instruments)))
+        instru_idx = pd.Index(instruments)
+        for k, (sim_args, _, base_bgn_date, _, weights) in enumerate(sims):
+            sig[k], sig_mask[k] = self.load_sig(sim_args, base_bgn_date, base_stp_date, dates, instruments)
+            if weights:
+                wgt_init[k, instru_idx.get_indexer(list(weights))] = list(weights.values())
+        costs = np.array([z[0].cost for z in sims])
+        raw_ret, dlt_wgt, cost, net_ret, present, wgt_last = self.cal_ret(
+            sig, sig_mask, ret, ret_mask, costs, wgt_init
+        )
+
+        # --- align dates and update nav
+        aligned_dates = get_calendar_index(calendar).shift(dates, shift)
+        present &= aligned_dates >= bgn_date
+        nav = np.cumprod(np.where(present, net_ret + 1, 1), axis=1)
+        if len(dates) == 0 or dates[-1] != base_end_date:
+            wgt_last[:] = 0  # no returns at base_end_date, so no merged rows
+        nan_sims: list[str] = []
+        for k, (sim_args, sqldb, _, last_nav, _) in enumerate(sims):
+            rows = present[k]
+            new_data = pd.DataFrame({
+                "trade_date": aligned_dates[rows],
+                "raw_ret": raw_ret[k, rows],
+                "dlt_wgt": dlt_wgt[k, rows],
+                "cost": cost[k, rows],
+                "net_ret": net_ret[k, rows],
+                "nav": nav[k, rows] * last_nav,
+            })
+            if new_data.isnull().any(axis=None):
+                nan_sims.append(sim_args.sim_id)
+                continue
+            sqldb.update(update_data=new_data)
+            self.save_state(
+                sim_args.sim_id,
+                base_date=base_end_date,
+                nav=float(new_data["nav"].iloc[-1]) if rows.any() else last_nav,
+                weights={instruments[j]: float(wgt_last[k, j]) for j in np.flatnonzero(wgt_last[k])},
+            )
+        if nan_sims:
+            raise ValueError(f"{nan_sims} have nan data")
+        return 0
+
+
+def group_sim_args_by_ret(sim_args_list: list[CSimArgs], sims_per_batch: int) -> list[list[CSimArgs]]:
+    """
+
+    :return: batches of sims, sims in a batch have the same test return
+    """
+    grouped: dict[tuple[str, str, CRet], list[CSimArgs]] = {}
+    for sim_args in sim_args_list:
+        key = (sim_args.db_struct_ret.db_save_dir, sim_args.db_struct_ret.db_name, sim_args.tgt_ret)
+        grouped.setdefault(key, []).append(sim_args)
+    return [
+        v[i:i + sims_per_batch]
+        for v in grouped.values()
+        for i in range(0, len(v), sims_per_batch)
+    ]
+
+
+def process_for_sim_batch(
+        sim_args_list: list[CSimArgs],
+        sim_save_dir: str,
+        bgn_date: str,
+        stp_date: str,
+        calendar: CCalendar,
+):
+    sim_batch = CSimBatch(sim_args_list=sim_args_list, sim_save_dir=sim_save_dir)
+    sim_batch.main(bgn_date, stp_date, calendar)
+    return 0
+
+
+"""
+-------------------------
+Part III: main functions
+-------------------------
+"""
+
+
 def process_for_sim(
         sim_args: CSimArgs,
         sim_save_dir: str,
@@ -135,27 +374,52 @@ def main_simulations(
         calendar: CCalendar,
         call_multiprocess: bool,
         processes: int,
+        executor: CPoolExecutor | None = None,
+        sims_per_batch: int = 64,
 ):
+    """
+
+    :param executor: a running pool shared by stages, with "calendar" in its shared objects.
+                     If None, a new pool is started for this stage.
+    :param sims_per_batch: max number of sims with the same test return calculated in a batch,
+                           each batch needs about 3 float arrays of sims x dates x instruments.
+                           0 to simulate one by one with CSim.
+    """
     desc = "Calculating simulations"
-    if call_multiprocess:
-        with Progress() as pb:
-            main_task = pb.add_task(description=desc, total=len(sim_args_list))
-            with mp.get_context("spawn").Pool(processes=processes) as pool:
-                for sim_args in sim_args_list:
-                    pool.apply_async(
-                        process_for_sim,
-                        kwds={
-                            "sim_args": sim_args,
-                            "sim_save_dir": sim_save_dir,
-                            "bgn_date": bgn_date,
-                            "stp_date": stp_date,
-                            "calendar": calendar,
-                        },
-                        callback=lambda _: pb.update(main_task, advance=1),
-                        error_callback=error_handler,
-                    )
-                pool.close()
-                pool.join()
+    if sims_per_batch > 0:
+        batches = group_sim_args_by_ret(sim_args_list, sims_per_batch)
+        if call_multiprocess:
+            with use_executor(executor, processes, shared={"calendar": calendar}) as pool_executor:
+                pool_executor.run(
+                    process_for_sim_batch,
+                    [
+                        {"sim_args_list": batch, "sim_save_dir": sim_save_dir,
+                         "bgn_date": bgn_date, "stp_date": stp_date}
+                        for batch in batches
+                    ],
+                    shared_kwargs=("calendar",),
+                    description=desc,
+                )
+        else:
+            for batch in track(batches, description=desc):
+                process_for_sim_batch(
+                    sim_args_list=batch,
+                    sim_save_dir=sim_save_dir,
+                    bgn_date=bgn_date,
+                    stp_date=stp_date,
+                    calendar=calendar,
+                )
+    elif call_multiprocess:
+        with use_executor(executor, processes, shared={"calendar": calendar}) as pool_executor:
+            pool_executor.run(
+                process_for_sim,
+                [
+                    {"sim_args": sim_args, "sim_save_dir": sim_save_dir, "bgn_date": bgn_date, "stp_date": stp_date}
+                    for sim_args in sim_args_list
+                ],
+                shared_kwargs=("calendar",),
+                description=desc,
+            )
     else:
         for sim_args in track(sim_args_list, description=desc):
             process_for_sim(
@@ -0,0 +1,241 @@
+import os
+import re
+import shutil
+import yaml
+import functools
+import pandas as pd
+from husfort.qsqlite import CSqlTable, CSqlVar, CMgrSqlDb
+from husfort.qcalendar import CCalendar
+
+"""
+----------------------------------------------------------------
+Part I: storage backends of databases generated by this project
+
+        The backend of each kind of database is set in section
+        "storage" of config.yaml, like:
+
+        storage:
+          fac_neu: parquet
+          sig: sqlite
+
+        and it is carried by the suffix of db_name in CDbStruct,
+        "*.db" for sqlite and "*.parquet" for parquet. So workers
+        of multiprocessing always open the same backend as the
+        main process.
+----------------------------------------------------------------
+"""
+
+STORAGE_SUFFIXES = {"sqlite": ".db", "parquet": ".parquet"}
+
+
+@functools.cache
+def load_storage_cfg(config_path: str = "config.yaml") -> dict[str, str]:
+    if not os.path.exists(config_path):
+        return {}
+    with open(config_path, "r") as f:
+        return yaml.safe_load(f).get("storage") or {}
+
+
+def get_db_name(stem: str, kind: str) -> str:
+    """
+
+    :param stem: like instrument, factor class or signal id
+    :param kind: like "fac_raw", "fac_neu", "sig", which is the key in section "storage" of config.yaml
+    :return: db_name with the suffix of the backend of this kind, default is sqlite
+    """
+    storage = load_storage_cfg().get(kind, "sqlite")
+    if storage not in STORAGE_SUFFIXES:
+        raise ValueError(f"storage = {storage} of {kind} is illegal, must be in {list(STORAGE_SUFFIXES)}")
+    return f"{stem}{STORAGE_SUFFIXES[storage]}"
+
+
+def get_db_stem(db_name: str) -> str:
+    for suffix in STORAGE_SUFFIXES.values():
+        if db_name.endswith(suffix):
+            return db_name.removesuffix(suffix)
+    return db_name
+
+
+"""
+--------------------------------------------------------------------
+Part II: parquet backend, with the same api as CMgrSqlDb.
+
+         A database is a directory partitioned by year, each update
+         adds a file, like "year=2024/part-20240102-20240131.parquet".
+         Reading by range prunes partitions and files by trade_date,
+         and only reads requested columns.
+--------------------------------------------------------------------
+"""
+
+PARQUET_DTYPES = {"TEXT": "string", "REAL": "float64", "INTEGER": "int64"}
+PART_FILE_PATTERN = re.compile(r"part-(\d{8})-(\d{8})\.parquet")
+MAX_DATE = "99999999"
+
+
+class CMgrParquetDb:
+    # daily updates add small files, a partition is compacted when it has this many files
+    MAX_PARTS_PER_YEAR = 32
+
+    def __init__(self, db_save_dir: str, db_name: str, table: CSqlTable, mode: str):
+        """
+
+        :param db_save_dir:
+        :param db_name: like "MTM.parquet"
+        :param table: the same as CMgrSqlDb, primary keys must contain "trade_date"
+        :param mode: "r", "a" or "w", existing data is removed if mode = "w"
+        """
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ImportError("pyarrow is required by parquet storage, please install it or use sqlite")
+
+        self.db_save_dir = db_save_dir
+        self.db_name = db_name
+        self.table = table
+        self.mode = mode
+        self.db_path = os.path.join(db_save_dir, db_name)
+        if mode == "w" and os.path.exists(self.db_path):
+            shutil.rmtree(self.db_path)
+
+    @property
+    def names(self) -> list[str]:
+        return self.table.vars.names
+
+    @property
+    def primary_keys(self) -> list[str]:
+        return [v.name for v in self.table.primary_keys]
+
+    def get_parts(self) -> list[tuple[str, str, str]]:
+        """
+
+        :return: a list of (first date, last date, path) of all files, sorted by date
+        """
+        res: list[tuple[str, str, str]] = []
+        if not os.path.exists(self.db_path):
+            return res
+        for partition in os.listdir(self.db_path):
+            for file in os.listdir(partition_dir := os.path.join(self.db_path, partition)):
+                if m := PART_FILE_PATTERN.fullmatch(file):
+                    res.append((m.group(1), m.group(2), os.path.join(partition_dir, file)))
+        return sorted(res)
+
+    @property
+    def empty(self) -> bool:
+        return not self.get_parts()
+
+    @property
+    def last_date(self) -> str | None:
+        parts = self.get_parts()
+        return max(p[1] for p in parts) if parts else None
+
+    def get_vars(self, columns: list[str]) -> list[tuple[str, CSqlVar]]:
+        variables = {v.name: v for v in self.table.primary_keys + self.table.value_columns}
+        return [(z, variables[z]) for z in columns]
+
+    def read_parts(
+            self, parts: list[tuple[str, str, str]], value_columns: list[str] | None, bgn_date: str, stp_date: str,
+    ) -> pd.DataFrame:
+        import pyarrow.dataset as ds
+
+        columns = value_columns or self.names
+        if not parts:
+            return pd.DataFrame({z: pd.Series(dtype=PARQUET_DTYPES[v.dtype]) for z, v in self.get_vars(columns)})
+        condition = (ds.field("trade_date") >= bgn_date) & (ds.field("trade_date") < stp_date)
+        if any(a[1] >= b[0] for a, b in zip(parts[:-1], parts[1:])):
+            # overlapped parts are left by an interrupted compaction, rows from newer files win
+            read_columns = list(dict.fromkeys(columns + self.primary_keys))
+            frames = [
+                ds.dataset(path, format="parquet").to_table(columns=read_columns, filter=condition).to_pandas()
+                for path in sorted([p[2] for p in parts], key=os.path.getmtime)
+            ]
+            data = pd.concat(frames, axis=0, ignore_index=True)
+            data = data.drop_duplicates(subset=self.primary_keys, keep="last")
+        else:
+            dataset = ds.dataset([p[2] for p in parts], format="parquet")
+            read_columns = list(dict.fromkeys(columns + ["trade_date"]))
+            data = dataset.to_table(columns=read_columns, filter=condition).to_pandas()
+        data = data.sort_values(by=[z for z in self.primary_keys if z in data.columns], kind="stable")
+        return data[columns].reset_index(drop=True)
+
+    def read(self, value_columns: list[str] = None) -> pd.DataFrame:
+        return self.read_parts(self.get_parts(), value_columns, bgn_date="", stp_date=MAX_DATE)
+
+    def read_by_range(self, bgn_date: str, stp_date: str, value_columns: list[str] = None) -> pd.DataFrame:
+        parts = [p for p in self.get_parts() if p[0] < stp_date and p[1] >= bgn_date]
+        return self.read_parts(parts, value_columns, bgn_date, stp_date)
+
+    def last_val(self, val: str, val_if_none=None):
+        parts = self.get_parts()
+        if not parts:
+            return val_if_none
+        last_part = max(parts, key=lambda p: p[1])
+        data = self.read_parts([last_part], None, bgn_date=last_part[1], stp_date=MAX_DATE)
+        return data[val].iloc[-1] if not data.empty else val_if_none
+
+    def check_continuity(self, incoming_date: str, calendar: CCalendar) -> int:
+        """
+        the same as CMgrSqlDb.check_continuity
+
+        :return: 0: incoming_date is the next trade date of the last date, or database is empty
+                 1: there are missing dates between them
+                 2: incoming_date is not after the last date
+        """
+        if (last_date := self.last_date) is None:
+            return 0
+        expected_date = calendar.get_next_date(last_date, shift=1)
+        if incoming_date == expected_date:
+            return 0
+        return 1 if incoming_date > expected_date else 2
+
+    def write_part(self, data: pd.DataFrame, year: str) -> str:
+        partition_dir = os.path.join(self.db_path, f"year={year}")
+        os.makedirs(partition_dir, exist_ok=True)
+        first_date, last_date = data["trade_date"].iloc[0], data["trade_date"].iloc[-1]
+        path = os.path.join(partition_dir, f"part-{first_date}-{last_date}.parquet")
+        data.to_parquet(f"{path}.tmp", engine="pyarrow", index=False)
+        os.replace(f"{path}.tmp", path)
+        return path
+
+    def update(self, update_data: pd.DataFrame, using_index: bool = False):
+        """
+        like CMgrSqlDb.update, columns are matched by position if they have the same size
+        as the table. Rows with existing primary keys are replaced.
+
+        """
+        data = update_data.reset_index() if using_index else update_data
+        data = data.set_axis(self.names, axis=1) if data.shape[1] == len(self.names) else data[self.names]
+        data = data.astype({z: PARQUET_DTYPES[v.dtype] for z, v in self.get_vars(self.names)})
+        data = data.sort_values(by=self.primary_keys, kind="stable")
+        if data.empty:
+            return 0
+
+        parts = self.get_parts()
+        for year, year_data in data.groupby(by=data["trade_date"].str[0:4], sort=True):
+            year_parts = [p for p in parts if p[0][0:4] == year]
+            overlapped = bool(year_parts) and year_data["trade_date"].iloc[0] <= max(p[1] for p in year_parts)
+            if overlapped or len(year_parts) >= self.MAX_PARTS_PER_YEAR:
+                # merge with existing data and rewrite this partition as one file
+                old_data = self.read_parts(year_parts, None, bgn_date="", stp_date=MAX_DATE)
+                year_data = pd.concat([old_data, year_data], axis=0, ignore_index=True)
+                year_data = year_data.drop_duplicates(subset=self.primary_keys, keep="last")
+                year_data = year_data.sort_values(by=self.primary_keys, kind="stable")
+                new_path = self.write_part(year_data.reset_index(drop=True), year)
+                for _, _, path in year_parts:
+                    if path != new_path:
+                        os.remove(path)
+            else:
+                self.write_part(year_data.reset_index(drop=True), year)
+        return 0
+
+
+"""
+---------------------------------------------------
+Part III: factory, backend is chosen by db_name
+---------------------------------------------------
+"""
+
+
+def gen_db_mgr(db_save_dir: str, db_name: str, table: CSqlTable, mode: str) -> CMgrSqlDb | CMgrParquetDb:
+    if db_name.endswith(STORAGE_SUFFIXES["parquet"]):
+        return CMgrParquetDb(db_save_dir=db_save_dir, db_name=db_name, table=table, mode=mode)
+    return CMgrSqlDb(db_save_dir=db_save_dir, db_name=db_name, table=table, mode=mode)
@@ -1,10 +1,15 @@
+import numpy as np
 import pandas as pd
 from rich.progress import track
 from loguru import logger
-from husfort.qutility import SFG, check_and_makedirs
+from husfort.qutility import SFG, SFY, check_and_makedirs
 from husfort.qcalendar import CCalendar
-from husfort.qsqlite import CDbStruct, CMgrSqlDb
+from husfort.qsqlite import CDbStruct
+from solutions.storage import gen_db_mgr
 from solutions.shared import gen_tst_ret_fac_raw_db, gen_tst_ret_raw_db, gen_tst_ret_neu_db, neutralize_by_date
+from solutions.panel import update_with_panel
+from solutions.factorKernels import compensated_cumsum, window_sums
+from solutions.executor import CPoolExecutor, use_executor
 from typedef import TUniverse
 
 
@@ -51,7 +56,7 @@ class CTstRetRaw(_CTstRet):
         return f"{self.win:03d}L{self.lag}RAW"
 
     def load_preprocess(self, instru: str, bgn_date: str, stp_date: str) -> pd.DataFrame:
-        sqldb = CMgrSqlDb(
+        sqldb = gen_db_mgr(
             db_save_dir=self.db_struct_preprocess.db_save_dir,
             db_name=f"{instru}.db",
             table=self.db_struct_preprocess.table,
@@ -65,15 +70,24 @@ class CTstRetRaw(_CTstRet):
 
     def cal_test_return(self, instru_ret_data: pd.DataFrame, base_bgn_date: str, base_end_date: str) -> pd.DataFrame:
         ret_cls, ret_opn = "return_c_major", "return_o_major"
-        instru_ret_data[self.ret_lbl_cls] = instru_ret_data[ret_cls].rolling(window=self.win).sum().shift(
-            -self.tot_shift)
-        instru_ret_data[self.ret_lbl_opn] = instru_ret_data[ret_opn].rolling(window=self.win).sum().shift(
-            -self.tot_shift)
+        instru_ret_data[[self.ret_lbl_cls, self.ret_lbl_opn]] = instru_ret_data[[ret_cls, ret_opn]].rolling(
+            window=self.win).sum().shift(-self.tot_shift).to_numpy()
         res = instru_ret_data.query(f"trade_date >= '{base_bgn_date}' & trade_date <= '{base_end_date}'")
         res = res[["trade_date", "ticker_major"] + self.rets]
         return res
 
-    def process_for_instru(self, instru: str, bgn_date: str, stp_date: str, calendar: CCalendar):
+    def process_for_instru(
+            self, instru: str, bgn_date: str, stp_date: str, calendar: CCalendar,
+            instru_tst_ret_data: pd.DataFrame | None = None,
+    ) -> pd.DataFrame | None:
+        """
+
+        :param instru_tst_ret_data: test returns calculated by caller with columns = ["trade_date",
+                                    "ticker_major"] + self.rets, which must start at or before the
+                                    base date of bgn_date, for sharing one read and one prefix sum
+                                    among windows. If provided, test return is returned even if it
+                                    is not saved.
+        """
         iter_dates = calendar.get_iter_list(bgn_date, stp_date)
         base_bgn_date = self.get_base_date(iter_dates[0], calendar)
         base_end_date = self.get_base_date(iter_dates[-1], calendar)
@@ -85,17 +99,24 @@ class CTstRetRaw(_CTstRet):
             rets=self.rets,
         )
         check_and_makedirs(db_struct_instru.db_save_dir)
-        sqldb = CMgrSqlDb(
+        sqldb = gen_db_mgr(
             db_save_dir=db_struct_instru.db_save_dir,
             db_name=db_struct_instru.db_name,
             table=db_struct_instru.table,
             mode="a",
         )
+        if instru_tst_ret_data is not None:
+            y_instru_data = instru_tst_ret_data.query(
+                f"trade_date >= '{base_bgn_date}' & trade_date <= '{base_end_date}'"
+            )[["trade_date", "ticker_major"] + self.rets]
+            if sqldb.check_continuity(base_bgn_date, calendar) == 0:
+                sqldb.update(update_data=y_instru_data)
+            return y_instru_data
         if sqldb.check_continuity(base_bgn_date, calendar) == 0:
             instru_ret_data = self.load_preprocess(instru, base_bgn_date, stp_date)
             y_instru_data = self.cal_test_return(instru_ret_data, base_bgn_date, base_end_date)
             sqldb.update(update_data=y_instru_data)
-        return 0
+        return None
 
     def main_test_return_raw(self, bgn_date: str, stp_date: str, calendar: CCalendar):
         desc = f"Processing test return with lag = {SFG(self.lag)}, win = {SFG(self.win)}"
@@ -142,7 +163,7 @@ class CTstRetNeu(_CTstRet):
             save_id=self.ref_id,
             rets=self.ref_rets,
         )
-        sqldb = CMgrSqlDb(
+        sqldb = gen_db_mgr(
             db_save_dir=db_struct_ref.db_save_dir,
             db_name=db_struct_ref.db_name,
             table=db_struct_ref.table,
@@ -163,7 +184,7 @@ class CTstRetNeu(_CTstRet):
         return res
 
     def load_available(self, base_bgn_date: str, base_stp_date: str) -> pd.DataFrame:
-        sqldb = CMgrSqlDb(
+        sqldb = gen_db_mgr(
             db_save_dir=self.db_struct_avlb.db_save_dir,
             db_name=self.db_struct_avlb.db_name,
             table=self.db_struct_avlb.table,
@@ -189,7 +210,7 @@ class CTstRetNeu(_CTstRet):
         else:
             raise ValueError(f"data_type = {data_type} is illegal")
         check_and_makedirs(db_struct_instru.db_save_dir)
-        sqldb = CMgrSqlDb(
+        sqldb = gen_db_mgr(
             db_save_dir=db_struct_instru.db_save_dir,
             db_name=db_struct_instru.db_name,
             table=db_struct_instru.table,
@@ -197,17 +218,26 @@ class CTstRetNeu(_CTstRet):
         )
         if sqldb.check_continuity(new_data["trade_date"].iloc[0], calendar) == 0:
             instru_tst_ret_neu_data = new_data[db_struct_instru.table.vars.names]
-            sqldb.update(update_data=instru_tst_ret_neu_data)
+            update_with_panel(db_struct_instru, sqldb, instru_tst_ret_neu_data)
         return 0
 
-    def main_test_return_neu(self, bgn_date: str, stp_date: str, calendar: CCalendar):
+    def main_test_return_neu(
+            self, bgn_date: str, stp_date: str, calendar: CCalendar, ref_tst_ret_data: pd.DataFrame | None = None,
+    ):
+        """
+
+        :param ref_tst_ret_data: raw test return of all instruments calculated by caller, with
+                                 columns ["trade_date", "instrument"] + ref_rets. If None, it is
+                                 loaded from databases of instruments.
+        """
         logger.info(f"Neutralizing test return with lag = {SFG(self.lag)}, win = {SFG(self.win)}")
         iter_dates = calendar.get_iter_list(bgn_date, stp_date)
         base_bgn_date = self.get_base_date(iter_dates[0], calendar)
         base_end_date = self.get_base_date(iter_dates[-1], calendar)
         base_stp_date = calendar.get_next_date(base_end_date, shift=1)
 
-        ref_tst_ret_data = self.load_ref_ret(base_bgn_date, base_stp_date)
+        if ref_tst_ret_data is None:
+            ref_tst_ret_data = self.load_ref_ret(base_bgn_date, base_stp_date)
         self.save(ref_tst_ret_data, calendar, data_type="raw")
 
         available_data = self.load_available(base_bgn_date, base_stp_date)
@@ -224,3 +254,116 @@ class CTstRetNeu(_CTstRet):
         tst_ret_neu_data = tst_ret_neu_data.query(f"trade_date >= '{base_bgn_date}' & trade_date <= '{base_stp_date}'")
         self.save(tst_ret_neu_data, calendar, data_type="neu")
         return 0
+
+
+# --------------------------------------------
+# ------ All windows in one run --------------
+# --------------------------------------------
+
+def cal_test_returns_by_wins(instru_ret_data: pd.DataFrame, tst_rets: list[CTstRetRaw]) -> pd.DataFrame:
+    """
+    the same as cal_test_return of each window, with one prefix sum of returns shared by all
+    windows. A window sum is nan if any return in it is nan, like rolling(window=win).sum().
+
+    :param instru_ret_data: preprocess data with columns "return_c_major" and "return_o_major"
+    :return: instru_ret_data with columns of test returns of all windows
+    """
+    ret = instru_ret_data[["return_c_major", "return_o_major"]].to_numpy(dtype=np.float64)
+    n = len(ret)
+    is_nan = np.isnan(ret)
+    prefix = compensated_cumsum(np.where(is_nan, 0, ret))
+    nan_prefix = np.zeros((n + 1, 2), dtype=np.int64)
+    np.cumsum(is_nan, axis=0, out=nan_prefix[1:])
+    res = instru_ret_data.copy()
+    for tst_ret in tst_rets:
+        win, k = tst_ret.win, tst_ret.lag + 1
+        y = np.full((n, 2), np.nan)
+        if (m := n - tst_ret.tot_shift) > 0:
+            # y[i] = sum of ret[i + lag + 1: i + lag + 1 + win], the rolling sum shifted by -tot_shift
+            sums = window_sums(prefix, win)[k:k + m]
+            has_nan = (nan_prefix[k + win:k + win + m] - nan_prefix[k:k + m]) > 0
+            y[:m] = np.where(has_nan, np.nan, sums)
+        res[tst_ret.ret_lbl_cls], res[tst_ret.ret_lbl_opn] = y[:, 0], y[:, 1]
+    return res
+
+
+def process_for_instru_by_wins(
+        tst_rets: list[CTstRetRaw], instru: str, bgn_date: str, stp_date: str, calendar: CCalendar,
+) -> tuple[str, dict[int, pd.DataFrame]]:
+    """
+    preprocess data of the instrument is read only once, and test returns of all windows
+    are calculated from one prefix sum
+
+    :return: (instru, {win: raw test return of the instrument})
+    """
+    iter_dates = calendar.get_iter_list(bgn_date, stp_date)
+    base_bgn_date = min([tst_ret.get_base_date(iter_dates[0], calendar) for tst_ret in tst_rets])
+    instru_ret_data = tst_rets[0].load_preprocess(instru, base_bgn_date, stp_date)
+    instru_tst_ret_data = cal_test_returns_by_wins(instru_ret_data, tst_rets)
+    res: dict[int, pd.DataFrame] = {}
+    for tst_ret in tst_rets:
+        y_instru_data = tst_ret.process_for_instru(instru, bgn_date, stp_date, calendar, instru_tst_ret_data)
+        res[tst_ret.win] = y_instru_data.rename(columns={"ticker_major": "ticker"}).assign(instrument=instru)
+    return instru, res
+
+
+def main_test_returns(
+        wins: list[int],
+        lag: int,
+        universe: TUniverse,
+        db_tst_ret_save_dir: str,
+        db_struct_preprocess: CDbStruct,
+        db_struct_avlb: CDbStruct,
+        bgn_date: str,
+        stp_date: str,
+        calendar: CCalendar,
+        call_multiprocess: bool,
+        processes: int,
+        executor: CPoolExecutor | None = None,
+):
+    """
+    raw test returns of all windows are calculated by instrument, then neutralized by window
+    with raw test returns of all instruments in memory.
+
+    :param executor: a running pool shared by stages, with "calendar" in its shared objects.
+                     If None, a new pool is started for this stage.
+    """
+    tst_rets = [
+        CTstRetRaw(
+            win=win, lag=lag, universe=universe,
+            db_tst_ret_save_dir=db_tst_ret_save_dir,
+            db_struct_preprocess=db_struct_preprocess,
+        ) for win in wins
+    ]
+    instru_data: dict[str, dict[int, pd.DataFrame]] = {}
+    description = f"Processing test return with lag = {SFG(lag)}, wins = {SFY(wins)}"
+    if call_multiprocess:
+        with use_executor(executor, processes, shared={"calendar": calendar}) as pool_executor:
+            # all instruments are needed by neutralization, so any failure stops this stage
+            res = pool_executor.run(
+                process_for_instru_by_wins,
+                [
+                    {"tst_rets": tst_rets, "instru": instru, "bgn_date": bgn_date, "stp_date": stp_date}
+                    for instru in universe
+                ],
+                shared_kwargs=("calendar",),
+                description=description,
+                raise_on_error=True,
+            )
+        instru_data.update(res)
+    else:
+        for instru in track(universe, description=description):
+            _, instru_data[instru] = process_for_instru_by_wins(tst_rets, instru, bgn_date, stp_date, calendar)
+
+    for tst_ret in tst_rets:
+        tst_ret_neu = CTstRetNeu(
+            win=tst_ret.win, lag=lag,
+            universe=universe,
+            db_tst_ret_save_dir=db_tst_ret_save_dir,
+            db_struct_avlb=db_struct_avlb,
+        )
+        ref_tst_ret_data = pd.concat([instru_data[instru][tst_ret.win] for instru in universe], axis=0)
+        ref_tst_ret_data = ref_tst_ret_data.sort_values(by="trade_date", ascending=True, kind="stable")
+        ref_tst_ret_data = ref_tst_ret_data[["trade_date", "instrument"] + tst_ret_neu.ref_rets]
+        tst_ret_neu.main_test_return_neu(bgn_date, stp_date, calendar, ref_tst_ret_data=ref_tst_ret_data)
+    return 0
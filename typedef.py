@@ -60,6 +60,11 @@ TFactorClass = NewType("TFactorClass", str)
 TFactorName = NewType("TFactorName", str)
 TFactorNames = list[TFactorName]
 
+# cost of calculating a factor class for one instrument
+# "light": cheaper than the overhead of dispatching it to a worker process
+# "heavy": worth a worker process per instrument
+TCostHint = Literal["light", "heavy"]
+
 
 @dataclass(frozen=True)
 class CFactor: